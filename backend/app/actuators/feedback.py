@@ -0,0 +1,152 @@
+"""
+This module, feedback.py, contains the ActuatorStateCache which keeps the latest state of every valve and relay.
+
+The valve feedback pins and the pilot valve limit switches are read by the shared acquisition scan, registered by their
+controllers like any sensor channel, so the cache only decodes each snapshot and never reads the device itself. A
+state request is answered from memory, and every change is published to the cache's events hub as a StateChange for
+clients that want to react to a valve moving rather than poll for it.
+
+Channels are named like telemetry channels: "valve.<name>" for the servo valves' feedback, "pilot_valve.<name>" for
+the pilot valve's limit switches and "relay.<name>" for the relays. Relays have no feedback pin, and reading a relay
+output would turn it into an input, so their state is the last value the relay controller wrote.
+"""
+
+from dataclasses import dataclass
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app.actuators.pilot_valve import PilotValveController
+from app.actuators.relay import IgnitorRelayController
+from app.actuators.valve import ValveController
+from app.metrics import PrometheusWriter
+from app.sensors.acquisition import Snapshot
+from app.telemetry.hub import Subscription, TelemetryHub
+
+EVENT_QUEUE_SIZE = 256  # State changes buffered per events subscriber before the oldest are dropped
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StateChange:
+    """
+    Represents a change in the state of one valve or relay.
+
+    Attributes:
+        timestamp (float): The UNIX time of the snapshot the change was seen in.
+        channel (str): The channel that changed, e.g. "valve.engine".
+        state: The new state.
+        previous: The state before the change, None if it was unknown.
+    """
+    timestamp: float
+    channel: str
+    state: Any
+    previous: Any = None
+
+
+class ActuatorStateCache:
+    """
+    Holds the state of every valve, pilot valve and relay, as of the latest acquisition snapshot.
+
+    Attributes:
+        readers (Dict[str, Callable]): The reader of each channel's state, keyed by channel name.
+        states (Dict[str, Any]): The latest state of each channel, None until it is known.
+        changed_at (Dict[str, Optional[float]]): The UNIX time each channel last changed state.
+        events (TelemetryHub): The hub every StateChange is published to.
+        changes (int): The number of state changes seen since startup.
+        timestamp (Optional[float]): The UNIX time of the latest snapshot decoded.
+    """
+
+    def __init__(self, valve_controller: ValveController, pilot_valve_controller: PilotValveController,
+                 relay_controller: IgnitorRelayController):
+        self.readers: Dict[str, Callable[[Snapshot], Any]] = {}
+        for name in valve_controller.valves:
+            self.readers[f"valve.{name}"] = \
+                lambda snapshot, name=name: valve_controller.state_from_snapshot(snapshot, name)
+        for name in pilot_valve_controller.motors:
+            self.readers[f"pilot_valve.{name}"] = \
+                lambda snapshot, name=name: pilot_valve_controller.state_from_snapshot(snapshot, name)
+        for name in relay_controller.relays:
+            self.readers[f"relay.{name}"] = \
+                lambda snapshot, name=name: relay_controller.states[name]
+        self.states: Dict[str, Any] = {channel: None for channel in self.readers}
+        self.changed_at: Dict[str, Optional[float]] = {channel: None for channel in self.readers}
+        self.events = TelemetryHub(EVENT_QUEUE_SIZE)
+        self.changes = 0
+        self.timestamp: Optional[float] = None
+
+    def update(self, snapshot: Snapshot):
+        """
+        Decodes a snapshot and publishes a StateChange for every channel whose state differs from the cache.
+
+        Args:
+            snapshot (Snapshot): A snapshot from the shared acquisition scan.
+        """
+        for channel, reader in self.readers.items():
+            state = reader(snapshot)
+            previous = self.states[channel]
+            if state == previous:
+                continue
+            self.states[channel] = state
+            self.changed_at[channel] = snapshot.timestamp
+            self.changes += 1
+            logger.info(f"{channel} changed from {getattr(previous, 'value', previous)} to "
+                        f"{getattr(state, 'value', state)}")
+            self.events.publish(StateChange(snapshot.timestamp, channel, state, previous))
+        self.timestamp = snapshot.timestamp
+
+    def get(self, channel: str) -> dict:
+        """
+        Returns a channel's cached state.
+
+        Args:
+            channel (str): The channel name, e.g. "valve.engine".
+
+        Returns:
+            dict: The state, when it last changed and how old the snapshot it was read from is, in seconds.
+
+        Raises:
+            KeyError: If there is no such channel.
+        """
+        return {
+            "state": self.states[channel],
+            "changed_at": self.changed_at[channel],
+            "age": time.time() - self.timestamp if self.timestamp is not None else None,
+        }
+
+    async def run(self, hub: TelemetryHub):
+        """
+        Updates the cache from every snapshot published to the acquisition hub until cancelled.
+
+        Args:
+            hub (TelemetryHub): The hub the acquisition snapshots are published to.
+        """
+        subscription: Subscription
+        with hub.subscribe() as subscription:
+            async for snapshot in subscription:
+                self.update(snapshot)
+
+    async def stream(self):
+        """
+        Creates a stream of state changes, starting with the current state of every channel.
+
+        Yields:
+            dict: A change, holding the snapshot time under "t", the channel, its state and its previous state.
+        """
+        with self.events.subscribe() as subscription:
+            for channel, state in self.states.items():
+                changed_at = self.changed_at[channel]
+                yield {"t": round(changed_at, 4) if changed_at is not None else None, "channel": channel,
+                       "state": state, "previous": None}
+            async for change in subscription:
+                yield {"t": round(change.timestamp, 4), "channel": change.channel, "state": change.state,
+                       "previous": change.previous}
+
+    def write_metrics(self, writer: PrometheusWriter):
+        """
+        Adds the number of state changes and the events hub.
+        """
+        writer.counter("actuator_state_changes_total", "Valve and relay state changes seen in the scan.",
+                       self.changes)
+        self.events.write_metrics(writer, "actuator_events")
@@ -3,15 +3,33 @@ from dataclasses import dataclass
 import time
 
 import logging
-from typing import Tuple
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
 from app.comms.hardware import LabJackConnection
 from app.comms.exceptions import MotorError
 from app.config import LABJACK_PINS
+from app.sensors.acquisition import AcquisitionScanner, Snapshot
 import csv
 logger = logging.getLogger(__name__)
 import asyncio
 
 
+class PilotValveState(str, Enum):
+    open = "open"
+    closed = "closed"
+    moving = "moving"
+    error = "error"
+
+
+# Pilot valve state from its (base, work) limit switches, it is between them while the motor runs
+LIMIT_SWITCH_STATES = {
+    (1, 0): PilotValveState.closed,
+    (0, 1): PilotValveState.open,
+    (0, 0): PilotValveState.moving,
+    (1, 1): PilotValveState.error,
+}
+
+
 @dataclass
 class PilotValve:
     """
@@ -32,16 +50,19 @@ class PilotValveController:
     """
     The PilotValveController class is responsible for controlling motors with limit switches connected to a LabJack device.
 
+    Given the shared scanner, the controller registers the limit switches of every motor with it, so their state is
+    read by each scan instead of by extra requests to the device.
+
     Args:
         labjack (LabJackConnection): An instance of the LabJackConnection class representing the connection to the LabJack device.
+        scanner (Optional[AcquisitionScanner]): The shared scanner that reads the limit switches.
 
     Attributes:
         motors (dict): A dictionary containing MotorWithLimitSwitch objects, with the motor names as keys and MotorWithLimitSwitch instances as values.
         labjack (LabJackConnection): An instance of the LabJackConnection class representing the connection to the LabJack device.
-        last_states (dict): A dictionary to store the last state of each motor.
     """
 
-    def __init__(self, labjack: LabJackConnection):
+    def __init__(self, labjack: LabJackConnection, scanner: Optional[AcquisitionScanner] = None):
         self.motors = {
             "pilot_valve": PilotValve(
                 LABJACK_PINS["pilot_valve_motor_enable"],
@@ -52,6 +73,49 @@ class PilotValveController:
                 LABJACK_PINS["ignitor_relay_pin"])
         }
         self.labjack = labjack
+        if scanner is not None:
+            scanner.register(self)
+
+    def registers(self) -> List[str]:
+        """
+        Returns the limit switch pins of every motor, read by the shared acquisition scan.
+        """
+        return [pin for motor in self.motors.values()
+                for pin in (motor.limit_switch_base_pin, motor.limit_switch_work_pin)]
+
+    def analog_inputs(self) -> list:
+        return []
+
+    def calibrations(self) -> Dict[str, tuple]:
+        return {}
+
+    def filters(self) -> Dict[str, dict]:
+        return {}
+
+    async def setup(self):
+        """
+        The limit switches are plain digital inputs and need no device configuration.
+        """
+
+    def state_from_snapshot(self, snapshot: Snapshot, motor_name: str) -> Optional[PilotValveState]:
+        """
+        Decodes a motor's limit switches from a scan snapshot.
+
+        Args:
+            snapshot (Snapshot): A snapshot from the shared acquisition scan.
+            motor_name (str): The name of the motor.
+
+        Returns:
+            Optional[PilotValveState]: Open at the work switch, closed at the base switch, moving between them, error
+            with both switches closed, None if the snapshot does not hold the switches.
+        """
+        motor = self._get_motor(motor_name)
+        try:
+            switches = (int(snapshot.values[motor.limit_switch_base_pin]),
+                        int(snapshot.values[motor.limit_switch_work_pin]))
+        except (KeyError, ValueError):
+            return None
+        return LIMIT_SWITCH_STATES.get(switches, PilotValveState.error)
 
     def _get_motor(self, motor_name: str) -> PilotValve:
         """
@@ -74,19 +138,18 @@ class PilotValveController:
 
     async def _stop_motor(self, motor_name: str):
         motor = self._get_motor(motor_name)
-        await self.labjack.write(motor.motor_enable_pin, 0)
+        await self.labjack.write_digital({motor.motor_enable_pin: 0})
 
     async def _spin_close(self, motor_name: str):
         motor = self._get_motor(motor_name)
-        await self.labjack.write(motor.motor_enable_pin, 1)
-        await self.labjack.write(motor.motor_in_pins[0], 0)
-        await self.labjack.write(motor.motor_in_pins[1], 1)
+        # Enable and direction change together, so the H-bridge never drives the motor the wrong way
+        await self.labjack.write_digital({motor.motor_enable_pin: 1, motor.motor_in_pins[0]: 0,
+                                          motor.motor_in_pins[1]: 1})
 
     async def _spin_open(self, motor_name: str):
         motor = self._get_motor(motor_name)
-        await self.labjack.write(motor.motor_enable_pin, 1)
-        await self.labjack.write(motor.motor_in_pins[0], 1)
-        await self.labjack.write(motor.motor_in_pins[1], 0)
+        await self.labjack.write_digital({motor.motor_enable_pin: 1, motor.motor_in_pins[0]: 1,
+                                          motor.motor_in_pins[1]: 0})
 
     async def _detect_at_base(self, motor_name: str) -> bool:
         motor = self._get_motor(motor_name)
@@ -106,7 +169,7 @@ class PilotValveController:
 
     async def close_motor(self, motor_name: str, wait_time: int = 15):
         curr_time = time.time()
-        self._spin_close(motor_name)
+        await self._spin_close(motor_name)
         # while (not self._detect_at_base(motor_name)) and (time.time() - curr_time < wait_time):
         #     pass
         await asyncio.sleep(15)
@@ -122,11 +185,11 @@ class PilotValveController:
         return state
 
     async def actuate_ignitor(self, valve_name, delay):
-        await self.labjack.write(LABJACK_PINS["ignitor_relay_pin"], 1)
+        await self.labjack.write_digital({LABJACK_PINS["ignitor_relay_pin"]: 1})
         
         await asyncio.sleep(delay)
 
-        await self.labjack.write(LABJACK_PINS["ignitor_relay_pin"], 0)
+        await self.labjack.write_digital({LABJACK_PINS["ignitor_relay_pin"]: 0})
 
         await self.open_motor(valve_name)
         return "Ignitor actuated"
@@ -33,6 +33,7 @@ class IgnitorRelayController:
         relays (dict): A dictionary of relays, where the keys are the names of the relays
             and the values are instances of the IgnitorRelay class.
         labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+        states (dict): The last value written to each relay, 1 while it is energised.
 
     """
 
@@ -46,6 +47,7 @@ class IgnitorRelayController:
                 LABJACK_PINS["qd_relay_pin"])
         }
         self.labjack = labjack
+        self.states = {relay_name: 0 for relay_name in self.relays}
 
     def _get_relay(self, relay_name: str) -> IgnitorRelay:
         """
@@ -68,7 +70,9 @@ class IgnitorRelayController:
 
     async def actuate_relay(self, relay_name):
         relay = self._get_relay(relay_name)
-        await self.labjack.write(relay.ignitor_pin, 1)
+        await self.labjack.write_digital({relay.ignitor_pin: 1})
+        self.states[relay_name] = 1
         await asyncio.sleep(1)
-        await self.labjack.write(relay.ignitor_pin, 0)
+        await self.labjack.write_digital({relay.ignitor_pin: 0})
+        self.states[relay_name] = 0
         return 
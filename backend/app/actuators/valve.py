@@ -1,9 +1,10 @@
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import logging
 from app.comms.hardware import LabJackConnection
 from app.comms.exceptions import ValveNotFoundError
 from app.config import LABJACK_PINS
+from app.sensors.acquisition import AcquisitionScanner, Snapshot
 from enum import Enum
 
 logger = logging.getLogger(__name__)
@@ -44,23 +45,47 @@ class ValveController:
     """
     The ValveController class is responsible for controlling valves connected to a LabJack device.
 
+    Given the shared scanner, the controller registers the feedback pins of every valve with it, so their state is
+    read by each scan instead of by extra requests to the device.
+
     Args:
         labjack (LabJackConnection): An instance of the LabJackConnection class representing the connection to the LabJack device.
+        scanner (Optional[AcquisitionScanner]): The shared scanner that reads the feedback pins.
 
     Attributes:
         valves (dict): A dictionary containing Valve objects, with the valve names as keys and Valve instances as values.
         labjack (LabJackConnection): An instance of the LabJackConnection class representing the connection to the LabJack device.
-        last_states (dict): A dictionary to store the last state of each valve.
 
     """
 
-    def __init__(self, labjack: LabJackConnection):
+    def __init__(self, labjack: LabJackConnection, scanner: Optional[AcquisitionScanner] = None):
         self.valves = {
             "engine": Valve(LABJACK_PINS["engine_input"], LABJACK_PINS["engine_output"]),
             "relief": Valve(LABJACK_PINS["relief_input"], LABJACK_PINS["relief_output"]),
         }
         self.labjack = labjack
-        self.last_states = {}
+        if scanner is not None:
+            scanner.register(self)
+
+    def registers(self) -> List[str]:
+        """
+        Returns the feedback pins of every valve, read by the shared acquisition scan.
+        """
+        return [pin for valve in self.valves.values() for pin in valve.output_pins]
+
+    def analog_inputs(self) -> list:
+        return []
+
+    def calibrations(self) -> Dict[str, tuple]:
+        return {}
+
+    def filters(self) -> Dict[str, dict]:
+        return {}
+
+    async def setup(self):
+        """
+        The feedback pins are plain digital inputs and need no device configuration.
+        """
 
     def _get_valve(self, valve_name: str) -> Valve:
         """
@@ -81,42 +106,37 @@ class ValveController:
             raise ValveNotFoundError("Valve not found")
         return self.valves[valve_name]
 
-    async def actuate_valve(self, valve_name: str, state: ValveState) -> str:
+    async def actuate_valve(self, valve_name: str, state: ValveState):
         """
         Actuate the valve to the specified state.
 
+        The state the valve reaches is read back from its feedback pins by the shared scan, see state_from_snapshot().
+
         Args:
             valve_name (str): The name of the valve.
             state (ValveState): The desired state of the valve.
 
-        Returns:
-            str: A message indicating the current state of the valve.
-
         """
         valve = self._get_valve(valve_name)
         input_state = ValveServoState.INPUT_STATES[valve_name][state]
 
-        for pin, value in zip(valve.input_pins, input_state):
-            await self.labjack.write(pin, value)
-
-        # Store the last actuated state
-        self.last_states[valve_name] = state
+        # Both inputs change together, so the servo never sees an intermediate command
+        await self.labjack.write_digital(dict(zip(valve.input_pins, input_state)))
 
-    def get_valve_state(self, valve_name: str) -> str:
+    def state_from_snapshot(self, snapshot: Snapshot, valve_name: str) -> Optional[ValveState]:
         """
-        Get the last actuated state of the valve.
+        Decodes a valve's feedback pins from a scan snapshot.
 
         Args:
+            snapshot (Snapshot): A snapshot from the shared acquisition scan.
             valve_name (str): The name of the valve.
 
         Returns:
-            str: The last actuated state of the valve.
-
-        Raises:
-            ValveNotFoundError: If the valve with the given name is not found.
-
+            Optional[ValveState]: The state reported by the valve, None if the snapshot does not hold its feedback.
         """
-        if valve_name not in self.last_states:
-            logger.error("Valve not found")
-            raise ValveNotFoundError("Valve not found")
-        return self.last_states[valve_name]
+        valve = self._get_valve(valve_name)
+        try:
+            feedback = tuple(int(snapshot.values[pin]) for pin in valve.output_pins)
+        except (KeyError, ValueError):
+            return None
+        return ValveServoState.OUTPUT_STATES.get(feedback, ValveState.error)
@@ -0,0 +1,462 @@
+"""
+This module, benchmark.py, measures the acquisition, streaming, logging and command paths against a simulated T7.
+
+The API is started in a child process with LABJACK_BACKEND "simulated", served by a single uvicorn worker as in
+production, and driven over HTTP from this process. It reports:
+
+- rates: the achieved rate and jitter of every per-sensor datastream endpoint, and of the acquisition timestamps seen
+  on /telemetry/stream
+- latency: the time from a sample being taken to its frame reaching a client, at each subscriber count
+- logging: the records per second logged into the run store by the API, and the raw throughput of a RunRecorder
+- valve: the latency of valve commands when idle, and under full telemetry load with logging active
+
+Intervals and latencies are summarised by their count, mean, p50, p99 and max in seconds. The report is written as
+JSON together with a flat "summary" of the headline numbers. Given a baseline report, every summary number that got
+worse by more than the tolerance is listed and the exit status is 1, so a regression fails a CI job.
+
+Clients run on one event loop in this process and stamp each line as it arrives, before parsing it. At high
+subscriber counts the client loop itself adds latency, so compare reports taken on the same machine.
+
+Usage, from the backend directory:
+
+    python -m app.benchmark --report bench.json
+    python -m app.benchmark --stream --report bench-stream.json --baseline bench-stream-main.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.storage.recorder import RunRecorder
+
+HOST = "127.0.0.1"
+DURATION = 10.0  # Seconds each measurement runs for
+WARMUP = 1.0  # Seconds of each measurement discarded while clients connect and queues settle
+SUBSCRIBERS = (1, 10, 50)  # Telemetry client counts the latency is measured at
+LOAD_SUBSCRIBERS = 50  # Telemetry clients connected while valve commands are timed under load
+VALVE_COMMANDS = 200  # Valve commands timed per measurement
+VALVE_INTERVAL = 0.02  # Seconds between valve commands
+RECORDER_RECORDS = 200_000  # Records appended by the raw recorder benchmark
+STARTUP_TIMEOUT = 30.0  # Seconds to wait for the API to start
+TOLERANCE = 0.2  # Relative change of a summary number that counts as a regression
+# Datastream endpoint of each telemetry channel group
+DATASTREAMS = {
+    "pressure": "/pressure/{}/datastream",
+    "thermocouple": "/thermocouple/{}/datastream",
+    "load_cell": "/load_cell_in/{}/datastream",
+}
+# Summary numbers ending in these are better when higher, every other number is a time and better when lower
+HIGHER_IS_BETTER = (".hz", ".records_per_s")
+
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkError(Exception):
+    """
+    Raised when the API under test fails to start or answers a request with an error.
+    """
+
+
+def _distribution(values: Sequence[float]) -> Optional[dict]:
+    """
+    Summarises durations in seconds, None if there are none.
+    """
+    if not len(values):
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def _rate(times: Sequence[float]) -> dict:
+    """
+    Summarises a series of event times as the achieved rate and the jitter of the intervals between them.
+    """
+    intervals = np.diff(np.asarray(times, dtype=np.float64))
+    if not len(intervals) or times[-1] <= times[0]:
+        return {"events": len(times), "hz": 0.0, "jitter": None, "interval": None}
+    return {
+        "events": len(times),
+        "hz": float(len(intervals) / (times[-1] - times[0])),
+        "jitter": float(intervals.std()),
+        "interval": _distribution(intervals),
+    }
+
+
+async def _open(port: int, path: str) -> Tuple[int, asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Sends a GET request and reads the response headers.
+
+    HTTP/1.0 makes the server send the body unframed and close the connection at its end, so a streamed response can
+    be read line by line without decoding chunked transfer encoding.
+    """
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(f"GET {path} HTTP/1.0\r\nHost: {HOST}\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+    return status, reader, writer
+
+
+async def fetch(port: int, path: str) -> Tuple[int, bytes]:
+    """
+    Sends a GET request and reads the whole response.
+
+    Returns:
+        Tuple[int, bytes]: The status code and body.
+    """
+    status, reader, writer = await _open(port, path)
+    try:
+        return status, await reader.read()
+    finally:
+        writer.close()
+
+
+async def fetch_json(port: int, path: str):
+    """
+    Sends a GET request and decodes the JSON response.
+
+    Raises:
+        BenchmarkError: If the response is not 200 OK.
+    """
+    status, body = await fetch(port, path)
+    if status != 200:
+        raise BenchmarkError(f"GET {path} returned {status}: {body[:200]!r}")
+    return json.loads(body)
+
+
+async def events(port: int, path: str, until: float, since: float = 0.0,
+                 limit: Optional[int] = None) -> List[Tuple[float, bytes]]:
+    """
+    Collects the server-sent events of a stream, stamped with their arrival time.
+
+    Args:
+        port (int): The port the API listens on.
+        path (str): The path of the stream.
+        until (float): The UNIX time to disconnect at.
+        since (float): The UNIX time before which arriving events are discarded.
+        limit (Optional[int]): Disconnect after this many events.
+
+    Returns:
+        List[Tuple[float, bytes]]: The arrival time and data of each event.
+
+    Raises:
+        BenchmarkError: If the stream cannot be opened.
+    """
+    status, reader, writer = await _open(port, path)
+    if status != 200:
+        writer.close()
+        raise BenchmarkError(f"GET {path} returned {status}")
+    received = []
+    try:
+        while limit is None or len(received) < limit:
+            remaining = until - time.time()
+            if remaining <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(reader.readline(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            arrived = time.time()
+            if line.startswith(b"data: ") and arrived >= since:
+                received.append((arrived, line[len(b"data: "):].rstrip()))
+    finally:
+        writer.close()
+    return received
+
+
+async def bench_rates(port: int, duration: float) -> dict:
+    """
+    Measures the rate and jitter of every datastream endpoint and of the acquisition timestamps.
+    """
+    first = await events(port, "/telemetry/stream", time.time() + 5, limit=1)
+    if not first:
+        raise BenchmarkError("No telemetry frame within 5 s")
+    streams = {}
+    for channel in json.loads(first[0][1]):
+        group, _, name = channel.partition(".")
+        if group in DATASTREAMS:
+            streams[channel] = DATASTREAMS[group].format(name)
+    streams["telemetry"] = "/telemetry/stream"
+    since = time.time() + WARMUP
+    until = since + duration
+    received = await asyncio.gather(*(events(port, path, until, since) for path in streams.values()))
+    results = {channel: _rate([arrived for arrived, _ in lines]) for channel, lines in zip(streams, received)}
+    results["telemetry"]["source"] = _rate([json.loads(data)["t"] for _, data in received[-1]])
+    return results
+
+
+async def bench_latency(port: int, duration: float, subscribers: int) -> dict:
+    """
+    Measures the time from each sample's timestamp to its frame arriving, with a number of clients subscribed.
+    """
+    since = time.time() + WARMUP
+    until = since + duration
+    received = await asyncio.gather(*(events(port, "/telemetry/stream", until, since) for _ in range(subscribers)))
+    latencies = [arrived - json.loads(data)["t"] for lines in received for arrived, data in lines]
+    return {
+        "subscribers": subscribers,
+        "frames": len(latencies),
+        "hz": float(np.mean([_rate([arrived for arrived, _ in lines])["hz"] for lines in received])),
+        "latency": _distribution(latencies),
+    }
+
+
+async def bench_logging(port: int, duration: float) -> dict:
+    """
+    Measures the records per second the API logs into the run store.
+    """
+    started = time.time()
+    await fetch_json(port, "/log_data/start")
+    await asyncio.sleep(duration)
+    stopped = await fetch_json(port, "/log_data/stop")
+    elapsed = time.time() - started
+    return {"run_id": stopped.get("run_id"), "records": stopped.get("samples", 0),
+            "records_per_s": stopped.get("samples", 0) / elapsed}
+
+
+async def bench_recorder(records: int = RECORDER_RECORDS, channels: int = 16) -> dict:
+    """
+    Measures how fast a RunRecorder appends and writes records, flushing as the RunLogger does.
+    """
+    values = [float(value) for value in range(channels)]
+    with tempfile.TemporaryDirectory() as runs_dir:
+        recorder = RunRecorder.create([f"channel{index}" for index in range(channels)], runs_dir)
+        started = time.perf_counter()
+        for index in range(records):
+            recorder.append(started + index * 1e-4, values)
+            if recorder.buffer_full:
+                await recorder.flush()
+        meta = await recorder.close()
+        elapsed = time.perf_counter() - started
+    return {
+        "records": records,
+        "channels": channels,
+        "records_per_s": records / elapsed,
+        "mb_per_s": records * meta.record_size / elapsed / 1e6,
+    }
+
+
+async def bench_valve(port: int, commands: int = VALVE_COMMANDS, interval: float = VALVE_INTERVAL) -> dict:
+    """
+    Measures the latency of alternately opening and closing the engine valve.
+    """
+    latencies = []
+    for index in range(commands):
+        state = "open" if index % 2 == 0 else "closed"
+        started = time.perf_counter()
+        await fetch_json(port, f"/valve/engine?state={state}")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return _distribution(latencies)
+
+
+async def bench_valve_loaded(port: int, subscribers: int = LOAD_SUBSCRIBERS) -> dict:
+    """
+    Measures valve command latency with telemetry clients subscribed and logging active.
+    """
+    until = time.time() + WARMUP + VALVE_COMMANDS * VALVE_INTERVAL * 4
+    clients = [asyncio.create_task(events(port, "/telemetry/stream", until, until)) for _ in range(subscribers)]
+    await fetch_json(port, "/log_data/start")
+    try:
+        await asyncio.sleep(WARMUP)
+        return await bench_valve(port)
+    finally:
+        await fetch_json(port, "/log_data/stop")
+        for client in clients:
+            client.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+
+
+def summarise(results: dict) -> Dict[str, float]:
+    """
+    Flattens the headline numbers of a report, keyed by dotted names, for comparison with a baseline.
+    """
+    summary = {}
+    for channel, rate in results["rates"].items():
+        summary[f"rates.{channel}.hz"] = rate["hz"]
+        if rate["jitter"] is not None:
+            summary[f"rates.{channel}.jitter"] = rate["jitter"]
+    source = results["rates"]["telemetry"]["source"]
+    if source["jitter"] is not None:
+        summary["rates.telemetry.source.jitter"] = source["jitter"]
+    for run in results["latency"]:
+        if run["latency"] is not None:
+            summary[f"latency.{run['subscribers']}.p50"] = run["latency"]["p50"]
+            summary[f"latency.{run['subscribers']}.p99"] = run["latency"]["p99"]
+    summary["logging.records_per_s"] = results["logging"]["records_per_s"]
+    summary["recorder.records_per_s"] = results["recorder"]["records_per_s"]
+    for name in ("idle", "loaded"):
+        summary[f"valve.{name}.p50"] = results["valve"][name]["p50"]
+        summary[f"valve.{name}.p99"] = results["valve"][name]["p99"]
+    return summary
+
+
+def compare(summary: Dict[str, float], baseline: Dict[str, float], tolerance: float = TOLERANCE) -> List[str]:
+    """
+    Lists the summary numbers that got worse than a baseline by more than a relative tolerance.
+    """
+    regressions = []
+    for key, value in summary.items():
+        before = baseline.get(key)
+        if not before:
+            continue
+        change = (value - before) / abs(before)
+        if key.endswith(HIGHER_IS_BETTER):
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{key}: {before:.6g} -> {value:.6g} ({change:+.0%} worse)")
+    return regressions
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def serve(port: int, stream: bool, latency: Optional[float]):
+    """
+    Runs the API against a simulated T7, in the child process started by start_server().
+    """
+    os.environ["LABJACK_BACKEND"] = "simulated"
+    import app.config as config
+    # Set before app.main is imported, which reads them
+    config.STREAM_ENABLED = stream
+    if latency is not None:
+        config.SIMULATOR_LATENCY = latency
+    import uvicorn
+    from app.main import app as api
+    logging.getLogger("app.main").setLevel(logging.WARNING)
+    uvicorn.run(api, host=HOST, port=port, log_level="warning")
+
+
+async def start_server(workdir: str, stream: bool, latency: Optional[float]) -> Tuple[subprocess.Popen, int]:
+    """
+    Starts the API in a child process with its working directory, and so its run store, in workdir.
+
+    Returns:
+        Tuple[subprocess.Popen, int]: The process and the port it listens on.
+
+    Raises:
+        BenchmarkError: If the API does not answer within STARTUP_TIMEOUT.
+    """
+    port = _free_port()
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, LABJACK_BACKEND="simulated",
+               PYTHONPATH=os.pathsep.join(filter(None, (backend, os.environ.get("PYTHONPATH")))))
+    command = [sys.executable, "-m", "app.benchmark", "--serve", str(port)]
+    if stream:
+        command.append("--stream")
+    if latency is not None:
+        command += ["--latency", str(latency)]
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            status = await fetch_json(port, "/")
+            if status.get("labjack_connection"):
+                return process, port
+        except (OSError, BenchmarkError, IndexError, ValueError):
+            pass
+        await asyncio.sleep(0.2)
+    process.kill()
+    raise BenchmarkError(f"The API did not start, see {os.path.join(workdir, 'server.log')}")
+
+
+async def run(duration: float = DURATION, subscribers: Sequence[int] = SUBSCRIBERS, stream: bool = False,
+              latency: Optional[float] = None) -> dict:
+    """
+    Runs every benchmark against a fresh API process and returns the report.
+    """
+    started_at = time.time()
+    workdir = tempfile.mkdtemp(prefix="pad-station-benchmark-")
+    process, port = await start_server(workdir, stream, latency)
+    try:
+        results = {"rates": await bench_rates(port, duration)}
+        results["latency"] = [await bench_latency(port, duration, count) for count in subscribers]
+        results["logging"] = await bench_logging(port, duration)
+        results["recorder"] = await bench_recorder()
+        results["valve"] = {"idle": await bench_valve(port), "loaded": await bench_valve_loaded(port)}
+        results["connection"] = await fetch_json(port, "/labjack/latency")
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {
+        "meta": {
+            "started_at": started_at,
+            "duration": duration,
+            "stream": stream,
+            "simulator_latency": latency,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workdir": workdir,
+        },
+        "summary": summarise(results),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pad station API against a simulated T7.")
+    parser.add_argument("--report", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="a previous report to compare the summary with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="the relative change of a summary number that counts as a regression")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds each measurement runs for")
+    parser.add_argument("--subscribers", default=",".join(map(str, SUBSCRIBERS)),
+                        help="comma separated telemetry client counts to measure latency at")
+    parser.add_argument("--stream", action="store_true", help="acquire in stream mode instead of polling")
+    parser.add_argument("--latency", type=float, help="seconds each simulated LabJack call takes")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.stream, args.latency)
+        return
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(run(args.duration, [int(count) for count in args.subscribers.split(",")], args.stream,
+                             args.latency))
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as file:
+            file.write(text)
+        logger.info(f"Wrote benchmark report to {args.report}")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report["summary"], json.load(file)["summary"], args.tolerance)
+        for regression in regressions:
+            logger.error(f"Regression in {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -43,3 +43,9 @@ class MotorError(Exception):
 
 class ThermocoupleSensorError(Exception):
     pass
+
+class TelemetryError(Exception):
+    pass
+
+class RunNotFoundError(Exception):
+    pass
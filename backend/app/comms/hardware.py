@@ -1,18 +1,112 @@
 """
 This is a Python module named hardware.py that contains a class LabJackConnection for managing a connection to a LabJack device.
+
+The connection notices when its handle has died, either from an LJM error that means the device is unreachable or
+from DEAD_AFTER_FAILURES failed calls in a row. It then drops the handle, so calls fail fast with DeviceNotOpenError
+instead of each waiting out an LJM timeout, and notifies the ConnectionSupervisor, which opens a new handle with
+reopen() and swaps it in without restarting the application.
+
+The LJM functions come from a device backend, labjack.ljm for real hardware or the SimulatedT7 of app.comms.simulator,
+selected with LABJACK_BACKEND in app.config. Any object with the functions listed on DeviceBackend can be passed in.
+
+Actuators set their digital outputs with write_digital(), which changes every pin of a command in the same instant:
+one eWriteNames call sets DIO_INHIBIT to shield every other line, writes the new levels to DIO_STATE and clears
+DIO_INHIBIT again, so a later write to a single pin is never silently ignored. Writing the pins one by one, even in a
+single eWriteNames call, would briefly leave e.g. an H-bridge in an intermediate state.
 """
 
 # Import necessary modules
 import logging
-from typing import Optional, Callable
-from labjack import ljm
+from typing import Any, Dict, List, Optional, Callable, Protocol, Sequence, Set, Tuple
 from app.comms.exceptions import DeviceNotOpenError, LabJackError
+from app.comms.worker import LabJackWorker, PRIORITY_COMMAND, PRIORITY_READ
+from app.metrics import PrometheusWriter
 import time
 import asyncio
+from app.config import LABJACK_BACKEND, SIMULATOR_LATENCY
+
+DEVICE_TYPE = "T7"
+CONNECTION_TYPE = "TCP"
+IDENTIFIER = "192.168.0.5"  # Or "ANY" with CONNECTION_TYPE "USB" or "ANY"
+DEAD_AFTER_FAILURES = 10  # Failed LJM calls in a row after which the handle is treated as dead
+# Names of the LJM errors which mean the device can no longer be reached over this handle
+DISCONNECT_ERRORS = ("DEVICE_NOT_OPEN", "NO_RESPONSE_BYTES_RECEIVED", "RECONNECT_FAILED",
+                     "CONNECTION_HAS_YIELDED_RECONNECT_FAILED", "SOCKET_LEVEL_ERROR", "DEVICE_DISCONNECTED")
+DIO_COUNT = 23  # Digital I/O lines on a T7, the bits of DIO_STATE and DIO_INHIBIT
+# First DIO number and line count of each digital I/O bank, FIO0 is DIO0 and EIO0 is DIO8
+DIO_BANKS = {"FIO": (0, 8), "EIO": (8, 8), "CIO": (16, 4), "MIO": (20, 3), "DIO": (0, DIO_COUNT)}
 
 # Set up a logger for the module
 logger = logging.getLogger(__name__)
 
+
+class DeviceBackend(Protocol):
+    """
+    The LJM functions a LabJackConnection calls, with the signatures of labjack.ljm.
+
+    Attributes:
+        LJMError: The exception raised by every failing call, with the LJM error code as errorCode.
+        errorcodes: A namespace of LJM error codes by name, e.g. errorcodes.DEVICE_NOT_OPEN.
+    """
+    LJMError: type
+    errorcodes: Any
+
+    def openS(self, deviceType: str, connectionType: str, identifier: str) -> int: ...
+
+    def close(self, handle: int): ...
+
+    def eReadName(self, handle: int, name: str) -> float: ...
+
+    def eReadNames(self, handle: int, numFrames: int, aNames: Sequence[str]) -> List[float]: ...
+
+    def eWriteName(self, handle: int, name: str, value: float): ...
+
+    def eWriteNames(self, handle: int, numFrames: int, aNames: Sequence[str], aValues: Sequence[float]): ...
+
+    def namesToAddresses(self, numFrames: int, names: Sequence[str]) -> Tuple[List[int], List[int]]: ...
+
+    def eStreamStart(self, handle: int, scansPerRead: int, numAddresses: int, aScanList: Sequence[int],
+                     scanRate: float) -> float: ...
+
+    def eStreamRead(self, handle: int) -> Tuple[List[float], int, int]: ...
+
+    def eStreamStop(self, handle: int): ...
+
+
+def dio_index(pin: str) -> Optional[int]:
+    """
+    Returns the DIO number of a digital I/O pin, e.g. 18 for "CIO2" or "DIO18", None if the pin is not a DIO line.
+    """
+    bank, number = pin[:3], pin[3:]
+    if bank not in DIO_BANKS or not number.isdigit():
+        return None
+    first, count = DIO_BANKS[bank]
+    return first + int(number) if int(number) < count else None
+
+
+def load_backend(name: str = LABJACK_BACKEND) -> DeviceBackend:
+    """
+    Loads a device backend by name.
+
+    Args:
+        name (str): "ljm" for a real LabJack through labjack.ljm, or "simulated" for a SimulatedT7.
+
+    Returns:
+        DeviceBackend: The backend.
+
+    Raises:
+        ValueError: If the name is unknown.
+    """
+    if name == "ljm":
+        # Imported here so the simulator runs without the LJM library installed
+        from labjack import ljm
+        return ljm
+    if name == "simulated":
+        from app.comms.simulator import SimulatedT7
+        return SimulatedT7(latency=SIMULATOR_LATENCY)
+    raise ValueError(f"Unknown LabJack backend {name}")
+
+
 # Define the LabJackConnection class
 
 
@@ -20,39 +114,167 @@ class LabJackConnection:
     """
     Represents a connection to a LabJack device.
 
+    Every LJM call is executed on a dedicated LabJackWorker thread which owns the handle, so reads and writes
+    await without blocking the event loop. Writes are queued ahead of reads.
+
     Attributes:
-        handle: The handle to the LabJack device.
+        backend (DeviceBackend): The LJM functions calls are made with.
+        handle: The handle to the LabJack device, None while the connection is lost.
+        consecutive_failures (int): The number of LJM calls in a row that have failed.
+        generation (int): Incremented on every reconnect, so device configuration and failures can be tied to the
+            handle they belong to.
+        disconnected_at (Optional[float]): The UNIX time the connection was lost, None while connected.
+        on_lost (Optional[Callable[[], None]]): Called from the event loop when the connection is lost.
 
     Methods:
         __init__(): Initializes the LabJackConnection object and opens a connection to a LabJack device.
+        reopen(): Opens a new handle to the device after the connection was lost.
         __del__(): Closes the connection to the LabJack device when the object is destroyed.
+        close(): Closes the connection to the LabJack device and stops the I/O worker.
         _access_pin(): Private method to access a pin on the LabJack device.
         write(): Writes a value to a pin on the LabJack device.
+        write_many(): Writes several registers on the LabJack device in a single round trip.
         read(): Reads a value from a pin on the LabJack device.
+        read_many(): Reads several registers from the LabJack device in a single round trip.
+        stream_start(): Starts hardware-timed stream acquisition of a list of registers.
+        stream_read(): Waits for the next read of stream scans.
+        stream_stop(): Stops stream acquisition.
+        latency_metrics(): Returns queue wait and LJM call time statistics for the I/O worker.
+        write_metrics(): Adds the connection state and the latency histograms of both workers to a PrometheusWriter.
     """
 
-    def __init__(self):
+    def __init__(self, backend: Optional[DeviceBackend] = None):
         """
         Initializes the LabJackConnection object and opens a connection to a LabJack device.
 
+        If the device cannot be opened the connection starts out lost, so the API can still start and the
+        ConnectionSupervisor keeps trying to open it.
+
+        Args:
+            backend (Optional[DeviceBackend]): The LJM functions to use, defaults to the configured LABJACK_BACKEND.
+        """
+        self.backend = backend if backend is not None else load_backend()
+        errorcodes = getattr(self.backend, "errorcodes", None)
+        self._disconnect_errors: Set[int] = {getattr(errorcodes, name, None) for name in DISCONNECT_ERRORS} - {None}
+        self._worker = LabJackWorker()
+        # eStreamRead blocks until a full read of scans is buffered, so it gets its own thread
+        self._stream_worker = LabJackWorker("labjack-stream")
+        self.handle = None
+        self.consecutive_failures = 0
+        self.disconnected_at: Optional[float] = time.time()
+        self.on_lost: Optional[Callable[[], None]] = None
+        self.generation = 0
+        try:
+            # The handle is opened on the worker thread, which owns it from here on
+            self.handle = self._worker.call(self.backend.openS, DEVICE_TYPE, CONNECTION_TYPE, IDENTIFIER)
+            self.disconnected_at = None
+        except self.backend.LJMError as e:
+            logger.error(f"Failed to open LabJack {DEVICE_TYPE} over {CONNECTION_TYPE} at {IDENTIFIER}: {e}")
+        except Exception:
+            self._worker.stop()
+            self._stream_worker.stop()
+            raise
+
+    @property
+    def connected(self) -> bool:
+        return self.handle is not None
+
+    async def reopen(self):
+        """
+        Opens a new handle to the device and swaps it in for the dead one.
+
         Raises:
-            DeviceNotOpenError: If the connection to the LabJack device fails.
+            LabJackError: If the device cannot be opened.
+        """
+        try:
+            handle = await self._worker.run(self.backend.openS, DEVICE_TYPE, CONNECTION_TYPE, IDENTIFIER,
+                                            priority=PRIORITY_COMMAND)
+        except self.backend.LJMError as e:
+            raise LabJackError(str(e))
+        self.consecutive_failures = 0
+        self.generation += 1
+        self.handle = handle
+        self.disconnected_at = None
+
+    def _lose(self, reason: str):
+        """
+        Drops a dead handle and notifies the supervisor, once per disconnection.
         """
-       # try:
-        self.handle = ljm.openS("T7", "TCP", "192.168.0.5")
-            # self.handle = ljm.openS("T7", "USB", "ANY")
-        #self.handle = ljm.openS("T7", "ANY", "ANY")
+        if self.handle is None:
+            return
+        handle, self.handle = self.handle, None
+        self.disconnected_at = time.time()
+        logger.error(f"LabJack connection lost: {reason}")
+        # Closing a dead handle can block for a timeout, so it happens on the worker behind any queued calls
+        self._worker.submit(self._close_quietly, handle, priority=PRIORITY_COMMAND)
+        if self.on_lost is not None:
+            self.on_lost()
 
-        #except:
-         #   logger.error("Failed to open device")
-          #  raise DeviceNotOpenError("Failed to open device")
+    def _close_quietly(self, handle):
+        try:
+            self.backend.close(handle)
+        except self.backend.LJMError:
+            pass
 
     def __del__(self):
         """
         Closes the connection to the LabJack device when the object is destroyed.
         """
-        if hasattr(self, 'handle') and self.handle:
-            ljm.close(self.handle)
+        self.close()
+
+    def close(self):
+        """
+        Closes the connection to the LabJack device and stops the I/O worker once pending calls have drained.
+        """
+        if getattr(self, 'handle', None):
+            handle, self.handle = self.handle, None
+            try:
+                self._worker.call(self.backend.close, handle)
+            except Exception as e:
+                logger.error(f"Failed to close device: {e}")
+        if hasattr(self, '_worker'):
+            self._worker.stop()
+        if hasattr(self, '_stream_worker'):
+            self._stream_worker.stop()
+
+    async def _call(self, action: Callable, *args: Any, priority: int = PRIORITY_READ,
+                    worker: Optional[LabJackWorker] = None, registers: Sequence[str] = ()) -> Any:
+        """
+        Private method to run an LJM function against the open handle on the I/O worker.
+
+        Args:
+            action: The LJM function to call, the handle is passed as its first argument.
+            *args: The remaining arguments for the LJM function.
+            priority: The priority of the call on the I/O worker.
+            worker: The worker to run the call on, defaults to the command/read worker.
+            registers: The registers the call accesses, for the per-register latency metrics.
+
+        Returns:
+            The return value of the LJM function.
+
+        Raises:
+            DeviceNotOpenError: If the connection to the LabJack device is not open.
+            LabJackError: If an error occurs while calling the LJM function.
+        """
+        if not hasattr(self, 'handle') or self.handle is None:
+            raise DeviceNotOpenError("Device not open")
+        generation = self.generation
+        try:
+            result = await (worker or self._worker).run(action, self.handle, *args, priority=priority,
+                                                        registers=registers)
+        except self.backend.LJMError as e:
+            logger.error(str(e))
+            # A call made before a reconnect failing on the old handle says nothing about the new one
+            if generation == self.generation:
+                self.consecutive_failures += 1
+                if getattr(e, "errorCode", None) in self._disconnect_errors:
+                    self._lose(str(e))
+                elif self.consecutive_failures >= DEAD_AFTER_FAILURES:
+                    self._lose(f"{self.consecutive_failures} calls failed in a row, last with {e}")
+            raise LabJackError(str(e))
+        if generation == self.generation:
+            self.consecutive_failures = 0
+        return result
 
     async def _access_pin(self, pin: str, action: Callable, value: Optional[int] = None) -> int:
         """
@@ -70,17 +292,10 @@ class LabJackConnection:
             DeviceNotOpenError: If the connection to the LabJack device is not open.
             LabJackError: If an error occurs while accessing the pin.
         """
-        if not hasattr(self, 'handle') or self.handle is None:
-            logger.error("Device not open")
-            raise DeviceNotOpenError("Device not open")
-        try:
-            if value is not None:
-                return action(self.handle, pin, value)
-            else:
-                return action(self.handle, pin)
-        except ljm.LJMError as e:
-            logger.error(str(e))
-            raise LabJackError(str(e))
+        if value is not None:
+            return await self._call(action, pin, value, priority=PRIORITY_COMMAND, registers=(pin,))
+        else:
+            return await self._call(action, pin, priority=PRIORITY_READ, registers=(pin,))
 
     async def write(self, pin: str, value: int):
         """
@@ -90,7 +305,41 @@ class LabJackConnection:
             pin: The name of the pin to write to.
             value: The value to write to the pin.
         """
-        await self._access_pin(pin, ljm.eWriteName, value)
+        await self._access_pin(pin, self.backend.eWriteName, value)
+
+    async def write_many(self, pins: List[str], values: List[float]):
+        """
+        Writes several registers on the LabJack device in a single eWriteNames round trip.
+
+        The device applies the writes in order, so configuration that depends on an earlier register (such as an
+        extended feature index) can be written in the same call.
+
+        Args:
+            pins: The names of the registers to write.
+            values: The values to write, in the same order as the names.
+        """
+        await self._call(self.backend.eWriteNames, len(pins), pins, values, priority=PRIORITY_COMMAND, registers=pins)
+
+    async def write_digital(self, states: Dict[str, int]):
+        """
+        Sets several digital outputs in one round trip, changing them all at the same instant.
+
+        Every other line is inhibited while DIO_STATE is written, so it keeps its direction and state, and the inhibit
+        mask is cleared in the same call. Pins that are not DIO lines are written one after another instead.
+
+        Args:
+            states: The level to set each pin to, 0 or 1, keyed by pin name.
+        """
+        pins = list(states)
+        indices = [dio_index(pin) for pin in pins]
+        if None in indices:
+            await self.write_many(pins, [states[pin] for pin in pins])
+            return
+        mask = sum(1 << index for index in indices)
+        levels = sum(1 << index for index, pin in zip(indices, pins) if states[pin])
+        inhibit = ((1 << DIO_COUNT) - 1) & ~mask
+        await self._call(self.backend.eWriteNames, 3, ["DIO_INHIBIT", "DIO_STATE", "DIO_INHIBIT"], [inhibit, levels, 0],
+                         priority=PRIORITY_COMMAND, registers=pins)
 
     async def read(self, pin: str) -> int:
         """
@@ -102,6 +351,72 @@ class LabJackConnection:
         Returns:
             The value read from the pin.
         """
-        val = await self._access_pin(pin, ljm.eReadName)
+        val = await self._access_pin(pin, self.backend.eReadName)
         return val
 
+    async def read_many(self, pins: List[str]) -> List[float]:
+        """
+        Reads several registers from the LabJack device in a single eReadNames round trip.
+
+        Args:
+            pins: The names of the registers to read.
+
+        Returns:
+            The values read, in the same order as the names.
+        """
+        return await self._call(self.backend.eReadNames, len(pins), pins, priority=PRIORITY_READ, registers=pins)
+
+    async def stream_start(self, pins: List[str], scan_rate: float, scans_per_read: int) -> float:
+        """
+        Starts hardware-timed stream acquisition on the LabJack device.
+
+        Args:
+            pins: The names of the registers to include in every scan.
+            scan_rate: The requested number of scans per second.
+            scans_per_read: The number of scans returned by each stream_read().
+
+        Returns:
+            The scan rate the device actually configured.
+        """
+        addresses, _ = self.backend.namesToAddresses(len(pins), pins)
+        # Free-running stream on the internal clock
+        await self.write("STREAM_TRIGGER_INDEX", 0)
+        await self.write("STREAM_CLOCK_SOURCE", 0)
+        return await self._call(self.backend.eStreamStart, scans_per_read, len(addresses), addresses, scan_rate,
+                                priority=PRIORITY_COMMAND)
+
+    async def stream_read(self) -> Tuple[List[float], int, int]:
+        """
+        Waits for the next read of stream scans.
+
+        The call blocks inside LJM until scans_per_read scans are buffered, so it runs on a dedicated stream worker
+        rather than holding up commands and reads on the main I/O worker.
+
+        Returns:
+            The interleaved samples, the device scan backlog and the LJM scan backlog.
+        """
+        return await self._call(self.backend.eStreamRead, worker=self._stream_worker)
+
+    async def stream_stop(self):
+        """
+        Stops stream acquisition on the LabJack device.
+        """
+        await self._call(self.backend.eStreamStop, priority=PRIORITY_COMMAND)
+
+    def latency_metrics(self) -> dict:
+        """
+        Returns latency statistics for the hardware I/O worker.
+
+        Returns:
+            A dict with the current queue depth and histograms of queue wait and LJM call time in seconds.
+        """
+        return self._worker.latency_metrics()
+
+    def write_metrics(self, writer: PrometheusWriter):
+        """
+        Adds the connection state and the latency histograms of both workers.
+        """
+        writer.gauge("labjack_connected", "Whether the LabJack handle is open.", int(self.connected))
+        writer.gauge("labjack_consecutive_failures", "LJM calls in a row that have failed.", self.consecutive_failures)
+        self._worker.write_metrics(writer)
+        self._stream_worker.write_metrics(writer)
@@ -0,0 +1,306 @@
+"""
+This module, simulator.py, contains SimulatedT7, a device backend that stands in for labjack.ljm when no T7 is attached.
+
+The simulator implements the subset of the LJM API used by the LabJackConnection (openS, eReadNames, eWriteNames,
+stream mode and so on) with the same signatures, so the whole stack runs unchanged on a laptop. Select it with
+LABJACK_BACKEND = "simulated" in app.config or the LABJACK_BACKEND environment variable.
+
+Analog inputs report the voltages that the configured CALIBRATIONS turn into plausible readings, and thermocouples
+report degrees Celsius once their extended feature is configured. Every channel sits at its standby value until the
+ignitor relay closes, which starts HOT_FIRE_PROFILE: the pilot valve opens, the chamber lights, thrust builds and the
+run tank drains and chills until burnout. Values between keyframes are interpolated and have Gaussian noise added.
+
+Digital outputs are remembered and read back, including lines set together through DIO_INHIBIT and DIO_STATE. The
+valve feedback pins report the state the valve inputs command, closed until they are first written, and the pilot
+valve's limit switches follow its motor. Every call sleeps for the configured latency on the calling thread, as an LJM
+call over TCP would, and disconnect() makes the device unreachable for a while to exercise the reconnect path.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.actuators.valve import ValveServoState, ValveState
+from app.comms.hardware import DIO_BANKS
+from app.config import CALIBRATIONS, LABJACK_PINS
+
+# Keyframes of each simulated quantity as (seconds since the ignitor relay closed, value)
+HOT_FIRE_PROFILE = {
+    "supply": [(0.0, 60.0), (3.0, 60.0), (3.5, 48.0), (10.0, 30.0), (12.0, 30.0)],  # bar
+    "tank": [(0.0, 55.0), (3.0, 55.0), (10.0, 18.0), (10.5, 15.0)],  # bar
+    "chamber": [(0.0, 0.0), (3.0, 0.0), (3.15, 28.0), (3.4, 24.0), (9.5, 10.0), (10.0, 0.0)],  # bar
+    "thrust": [(0.0, 0.0), (3.0, 0.0), (3.15, 2600.0), (3.4, 2200.0), (9.5, 900.0), (10.0, 0.0)],  # N
+    "temperature": [(0.0, 20.0), (3.0, 20.0), (10.0, 2.0), (40.0, 12.0)],  # Celsius
+}
+HOT_FIRE_DURATION = max(keyframes[-1][0] for keyframes in HOT_FIRE_PROFILE.values())
+NOISE = {"supply": 0.3, "tank": 0.3, "chamber": 0.2, "thrust": 15.0, "temperature": 0.2}  # Standard deviations
+TANK_HEAD = 2.0  # Extra pressure at the bottom of the run tank in bar
+PILOT_VALVE_TRAVEL = 2.0  # Seconds for the pilot valve motor to travel between its limit switches
+EF_THERMOCOUPLE_K = 22  # The AIN_EF index of a type K thermocouple
+
+logger = logging.getLogger(__name__)
+
+
+class LJMError(Exception):
+    """
+    Mirrors labjack.ljm.LJMError, raised by every simulated call that fails.
+
+    Attributes:
+        errorCode (int): The LJM error code.
+        errorString (str): The LJM error name.
+    """
+
+    def __init__(self, errorCode: int = 0, errorString: str = ""):
+        super().__init__(errorString)
+        self.errorCode = errorCode
+        self.errorString = errorString
+
+
+class errorcodes:
+    """
+    The LJM error codes the simulator raises, with the same names and values as labjack.ljm.errorcodes.
+    """
+    DEVICE_NOT_OPEN = 1224
+    NO_RESPONSE_BYTES_RECEIVED = 1263
+
+
+def _volts(channel: str, value):
+    """
+    Inverts a channel's linear calibration, so the scanner's conversion gives back the simulated value.
+    """
+    entry = CALIBRATIONS.get(channel, {})
+    if entry.get("type", "linear") != "linear" or "gain" not in entry:
+        return value
+    return (value - entry.get("offset", 0.0)) / entry["gain"]
+
+
+class SimulatedT7:
+    """
+    A simulated T7 implementing the LJM functions used by the LabJackConnection.
+
+    Attributes:
+        latency (float): The mean time each call takes in seconds.
+        jitter (float): The spread of the call time, as a fraction of the latency.
+        registers (Dict[str, float]): The last value written to each register.
+        fired_at (Optional[float]): The UNIX time the hot fire profile started, None while on standby.
+    """
+
+    def __init__(self, latency: float = 0.002, jitter: float = 0.5, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.registers: Dict[str, float] = {}
+        self.fired_at: Optional[float] = None
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._handles = 0
+        self._open: set = set()
+        self._offline_until = 0.0
+        self._addresses: List[str] = []
+        self._stream: Optional[dict] = None
+        self._pilot_position = 0.0
+        self._pilot_updated_at = time.time()
+        # Analog register to the simulated quantity and channel whose calibration gives its voltage
+        self._analog = {
+            LABJACK_PINS["pressure_transducer_supply"]: ("supply", "pressure.supply", 0.0),
+            LABJACK_PINS["pressure_transducer_engine"]: ("tank", "pressure.tank_bottom", TANK_HEAD),
+            LABJACK_PINS["pressure_transducer_tank"]: ("tank", "pressure.tank_top", 0.0),
+            LABJACK_PINS["pressure_transducer_chamber"]: ("chamber", "pressure.chamber", 0.0),
+            LABJACK_PINS["load_cell_test_stand"][0]: ("thrust", "load_cell.test_stand", 0.0),
+        }
+        self._thermocouple = f"{LABJACK_PINS['thermocouple_engine']}_EF_READ_A"
+        self._limit_switches = (LABJACK_PINS["pilot_valve_limit_switch_base"],
+                                LABJACK_PINS["pilot_valve_limit_switch_work"])
+        self._motor = (LABJACK_PINS["pilot_valve_motor_enable"], LABJACK_PINS["pilot_valve_motor_in_1"],
+                       LABJACK_PINS["pilot_valve_motor_in_2"])
+        # Valve feedback output to its valve and position in the feedback pair, the servos are assumed to reach
+        # their position instantly
+        self._feedback = {
+            output: (valve, index)
+            for valve in ValveServoState.INPUT_STATES
+            for index, output in enumerate(LABJACK_PINS[f"{valve}_output"])
+        }
+        # DIO number to the name the registers are stored under, e.g. 18 to "CIO2"
+        self._dio_names = {first + number: f"{bank}{number}" for bank, (first, count) in DIO_BANKS.items()
+                           if bank != "DIO" for number in range(count)}
+        self._feedback_levels = {state: levels for levels, state in ValveServoState.OUTPUT_STATES.items()
+                                 if state != ValveState.error}
+
+    LJMError = LJMError
+    errorcodes = errorcodes
+
+    @property
+    def firing(self) -> bool:
+        """
+        Whether the hot fire profile is still running, a new one can only start once it has ended.
+        """
+        return self.fired_at is not None and time.time() - self.fired_at < HOT_FIRE_DURATION
+
+    def fire(self):
+        """
+        Starts the hot fire profile now, as closing the ignitor relay does.
+        """
+        self.fired_at = time.time()
+        logger.info("Simulated hot fire started")
+
+    def disconnect(self, duration: float):
+        """
+        Makes the device unreachable for a while, dropping every open handle, as a T7 power cycle would.
+        """
+        self._offline_until = time.time() + duration
+        with self._lock:
+            self._open.clear()
+            self.registers.clear()
+            self._stream = None
+
+    def _call(self, handle: Optional[int] = None):
+        """
+        Waits out the call latency, then fails if the device is unreachable or the handle is not open.
+        """
+        if self.latency:
+            time.sleep(max(0.0, self.latency * (1 + self.jitter * (random.random() - 0.5) * 2)))
+        if time.time() < self._offline_until:
+            raise LJMError(errorcodes.NO_RESPONSE_BYTES_RECEIVED, "LJME_NO_RESPONSE_BYTES_RECEIVED")
+        if handle is not None and handle not in self._open:
+            raise LJMError(errorcodes.DEVICE_NOT_OPEN, "LJME_DEVICE_NOT_OPEN")
+
+    def _profile(self, quantity: str, times: np.ndarray) -> np.ndarray:
+        """
+        Returns a quantity at each time, with noise.
+        """
+        keyframes = HOT_FIRE_PROFILE[quantity]
+        elapsed = times - self.fired_at if self.fired_at is not None else np.zeros_like(times)
+        values = np.interp(elapsed, [point[0] for point in keyframes], [point[1] for point in keyframes])
+        return values + self._rng.normal(0.0, NOISE[quantity], len(times))
+
+    def _values(self, names: Sequence[str], times: np.ndarray) -> np.ndarray:
+        """
+        Returns a times by names array of register values.
+        """
+        values = np.zeros((len(times), len(names)))
+        for column, name in enumerate(names):
+            if name in self._analog:
+                quantity, channel, offset = self._analog[name]
+                values[:, column] = _volts(channel, self._profile(quantity, times) + offset)
+            elif name == self._thermocouple:
+                if self.registers.get(f"{LABJACK_PINS['thermocouple_engine']}_EF_INDEX") != EF_THERMOCOUPLE_K:
+                    raise LJMError(0, "LJME_EF_NOT_CONFIGURED")
+                values[:, column] = self._profile("temperature", times)
+            elif name in self._limit_switches:
+                position = self._move_pilot_valve()
+                values[:, column] = float(position <= 0.0 if name == self._limit_switches[0] else position >= 1.0)
+            elif name in self._feedback:
+                valve, index = self._feedback[name]
+                values[:, column] = self._valve_feedback(valve)[index]
+            else:
+                values[:, column] = self.registers.get(name, 0.0)
+        return values
+
+    def _valve_feedback(self, valve: str) -> Tuple[int, int]:
+        """
+        Returns the feedback levels of a valve, for the state its inputs command, or both low for an invalid command.
+        """
+        inputs = LABJACK_PINS[f"{valve}_input"]
+        if not any(pin in self.registers for pin in inputs):
+            return self._feedback_levels[ValveState.closed]
+        levels = tuple(int(self.registers.get(pin, 0)) for pin in inputs)
+        for state, commanded in ValveServoState.INPUT_STATES[valve].items():
+            if commanded == levels:
+                return self._feedback_levels[state]
+        return 0, 0
+
+    def _move_pilot_valve(self) -> float:
+        """
+        Advances the pilot valve motor from its enable and direction outputs, returning its position from 0 to 1.
+        """
+        now = time.time()
+        enable, in_1, _ = self._motor
+        if self.registers.get(enable):
+            opening = self.registers.get(in_1, 0) == 1
+            step = (now - self._pilot_updated_at) / PILOT_VALVE_TRAVEL
+            self._pilot_position = min(1.0, max(0.0, self._pilot_position + (step if opening else -step)))
+        self._pilot_updated_at = now
+        return self._pilot_position
+
+    def _write(self, name: str, value: float):
+        if name == "DIO_STATE":
+            # Every line not inhibited is set at once, as on the T7
+            inhibit = int(self.registers.get("DIO_INHIBIT", 0))
+            for index, line in self._dio_names.items():
+                if not inhibit & (1 << index):
+                    self._write(line, float((int(value) >> index) & 1))
+            return
+        if name in self._motor:
+            self._move_pilot_valve()
+        if name == LABJACK_PINS["ignitor_relay_pin"] and value == 1 and not self.firing:
+            self.fire()
+        self.registers[name] = value
+
+    def openS(self, deviceType: str, connectionType: str, identifier: str) -> int:
+        self._call()
+        with self._lock:
+            self._handles += 1
+            self._open.add(self._handles)
+            return self._handles
+
+    def close(self, handle: int):
+        with self._lock:
+            self._open.discard(handle)
+
+    def eReadName(self, handle: int, name: str) -> float:
+        self._call(handle)
+        return float(self._values([name], np.array([time.time()]))[0, 0])
+
+    def eReadNames(self, handle: int, numFrames: int, aNames: Sequence[str]) -> List[float]:
+        self._call(handle)
+        return self._values(aNames, np.array([time.time()]))[0].tolist()
+
+    def eWriteName(self, handle: int, name: str, value: float):
+        self._call(handle)
+        self._write(name, value)
+
+    def eWriteNames(self, handle: int, numFrames: int, aNames: Sequence[str], aValues: Sequence[float]):
+        self._call(handle)
+        for name, value in zip(aNames, aValues):
+            self._write(name, value)
+
+    def namesToAddresses(self, numFrames: int, names: Sequence[str]) -> Tuple[List[int], List[int]]:
+        with self._lock:
+            for name in names:
+                if name not in self._addresses:
+                    self._addresses.append(name)
+            return [self._addresses.index(name) for name in names], [3] * numFrames
+
+    def eStreamStart(self, handle: int, scansPerRead: int, numAddresses: int, aScanList: Sequence[int],
+                     scanRate: float) -> float:
+        self._call(handle)
+        self._stream = {
+            "names": [self._addresses[address] for address in aScanList],
+            "scans_per_read": scansPerRead,
+            "scan_rate": scanRate,
+            "started_at": time.time(),
+            "reads": 0,
+        }
+        return scanRate
+
+    def eStreamRead(self, handle: int) -> Tuple[List[float], int, int]:
+        stream = self._stream
+        if stream is None:
+            raise LJMError(errorcodes.DEVICE_NOT_OPEN, "LJME_STREAM_NOT_RUNNING")
+        scans, rate = stream["scans_per_read"], stream["scan_rate"]
+        first = stream["reads"] * scans
+        # Hardware-timed: a read returns once its last scan would have been sampled
+        delay = stream["started_at"] + (first + scans) / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self._call(handle)
+        stream["reads"] += 1
+        times = stream["started_at"] + (first + np.arange(scans)) / rate
+        return self._values(stream["names"], times).ravel().tolist(), 0, 0
+
+    def eStreamStop(self, handle: int):
+        self._call(handle)
+        self._stream = None
@@ -0,0 +1,127 @@
+"""
+This module, supervisor.py, contains the ConnectionSupervisor which reconnects to the LabJack when its handle dies.
+
+The LabJackConnection reports a lost connection as soon as it sees one. The supervisor then tries to open a new handle,
+waiting RECONNECT_INITIAL_DELAY after the first failed attempt and doubling the wait up to RECONNECT_MAX_DELAY, so a
+T7 that is rebooting is picked up within moments of coming back without flooding the network while it is away. Once
+the new handle is in place every reconnect callback runs, e.g. the scanner writing the channel configuration again
+and resuming stream mode, and the time telemetry was blind is recorded. A reconnect only counts once every callback
+has succeeded. If one fails, the supervisor backs off and tries again, opening a new handle first if the connection
+dropped again, so the outage stays open until acquisition has really recovered.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from app.comms.exceptions import DeviceNotOpenError, LabJackError
+from app.comms.hardware import LabJackConnection
+from app.metrics import PrometheusWriter
+
+RECONNECT_INITIAL_DELAY = 0.1  # Seconds to wait after the first failed reconnect attempt
+RECONNECT_MAX_DELAY = 5.0  # Longest wait between reconnect attempts in seconds
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionSupervisor:
+    """
+    Reopens the LabJack connection whenever it is lost.
+
+    Attributes:
+        labjack (LabJackConnection): The supervised connection.
+        reconnects (int): The number of successful reconnects.
+        attempts (int): The number of reconnect attempts, successful or not.
+        last_outage (Optional[float]): How long the last outage lasted in seconds, from losing the handle until the
+            reconnect callbacks had run.
+        total_outage (float): The total time spent disconnected in seconds, not counting an outage in progress.
+        outage_started_at (Optional[float]): The UNIX time the outage being recovered from began, None when there is
+            none.
+    """
+
+    def __init__(self, labjack: LabJackConnection):
+        self.labjack = labjack
+        self.reconnects = 0
+        self.attempts = 0
+        self.last_outage: Optional[float] = None
+        self.total_outage = 0.0
+        self.outage_started_at: Optional[float] = None
+        self._callbacks: List[Callable[[], Awaitable[None]]] = []
+        self._lost = asyncio.Event()
+        labjack.on_lost = self._lost.set
+
+    def on_reconnect(self, callback: Callable[[], Awaitable[None]]):
+        """
+        Registers a coroutine function to run after every reconnect, in registration order.
+        """
+        self._callbacks.append(callback)
+
+    async def run(self):
+        """
+        Reconnects every time the connection is lost, until cancelled.
+        """
+        while True:
+            if self.labjack.connected:
+                await self._lost.wait()
+            self._lost.clear()
+            await self._reconnect()
+
+    async def _reconnect(self):
+        """
+        Retries opening the device and running every reconnect callback, with exponential backoff, until both succeed.
+        """
+        self.outage_started_at = self.labjack.disconnected_at or time.time()
+        delay = RECONNECT_INITIAL_DELAY
+        while True:
+            self.attempts += 1
+            # A loss during this attempt is handled by the retries here, not by another pass of run()
+            self._lost.clear()
+            try:
+                if not self.labjack.connected:
+                    await self.labjack.reopen()
+                for callback in self._callbacks:
+                    await callback()
+                break
+            except (DeviceNotOpenError, LabJackError) as e:
+                logger.warning(f"LabJack reconnect attempt failed, retrying in {delay:.1f} s: {e}")
+            except Exception as e:
+                logger.exception(f"Unexpected error reconnecting to the LabJack, retrying in {delay:.1f} s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        self.reconnects += 1
+        self.last_outage = time.time() - self.outage_started_at
+        self.total_outage += self.last_outage
+        self.outage_started_at = None
+        logger.info(f"LabJack reconnected after {self.last_outage:.2f} s blind, {self.attempts} attempts so far")
+
+    def status(self) -> dict:
+        """
+        Returns the connection state and reconnect statistics.
+
+        While a reconnect is in progress the outage counts as ongoing, even once a new handle is open, until every
+        reconnect callback has succeeded.
+        """
+        disconnected_at = self.outage_started_at or self.labjack.disconnected_at
+        return {
+            "connected": self.labjack.connected,
+            "recovering": self.outage_started_at is not None,
+            "disconnected_for": time.time() - disconnected_at if disconnected_at is not None else None,
+            "reconnects": self.reconnects,
+            "attempts": self.attempts,
+            "last_outage": self.last_outage,
+            "total_outage": self.total_outage,
+        }
+
+    def write_metrics(self, writer: PrometheusWriter):
+        """
+        Adds the reconnect counters and the length of the last and current outage.
+        """
+        status = self.status()
+        writer.counter("labjack_reconnects_total", "Successful reconnects to the LabJack.", self.reconnects)
+        writer.counter("labjack_reconnect_attempts_total", "Reconnect attempts, successful or not.", self.attempts)
+        writer.counter("labjack_outage_seconds_total", "Time spent disconnected, not counting an outage in progress.",
+                       self.total_outage)
+        writer.gauge("labjack_last_outage_seconds", "Length of the last outage.", self.last_outage)
+        writer.gauge("labjack_disconnected_seconds", "Length of the outage in progress, 0 once recovered.",
+                     status["disconnected_for"] or 0.0)
@@ -0,0 +1,153 @@
+"""
+This is a Python module named worker.py that contains a class LabJackWorker which runs every LJM call on a single dedicated thread.
+
+LJM calls block for a full Modbus TCP round trip (and longer while the library retries a slow T7). Running them
+directly inside a coroutine freezes the event loop, so the LabJackConnection hands each call to this worker instead
+and awaits the result. Calls are serialised in priority order so that commands (valve, relay and abort writes) are
+never stuck behind a queue of sensor reads.
+"""
+
+# Import necessary modules
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Sequence
+
+from app.metrics import LatencyHistogram, PrometheusWriter
+
+# Set up a logger for the module
+logger = logging.getLogger(__name__)
+
+# Lower numbers are served first
+PRIORITY_COMMAND = 0
+PRIORITY_READ = 1
+PRIORITY_SHUTDOWN = 2
+
+
+class LabJackWorker:
+    """
+    Represents the hardware I/O thread that owns all access to the LabJack handle.
+
+    Attributes:
+        name (str): The name of the worker thread.
+        queue_wait (LatencyHistogram): Time each call spent queued before the worker picked it up.
+        call_time (LatencyHistogram): Time spent inside the LJM function itself.
+        register_call_time (Dict[str, LatencyHistogram]): Time spent inside the LJM functions that accessed each
+            register, a batched call counts towards every register it accessed.
+
+    Methods:
+        submit(): Queues a call and returns a concurrent.futures.Future for its result.
+        run(): Queues a call and awaits its result from the event loop.
+        call(): Queues a call and blocks the calling thread until it completes.
+        stop(): Lets the queued calls drain and then stops the worker thread.
+        write_metrics(): Adds the queue depth and latency histograms to a PrometheusWriter.
+    """
+
+    def __init__(self, name: str = "labjack-io"):
+        self.name = name
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self.queue_wait = LatencyHistogram()
+        self.call_time = LatencyHistogram()
+        self.register_call_time: Dict[str, LatencyHistogram] = {}
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """
+        Main loop of the worker thread.
+        """
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                break
+            future, action, args, registers, enqueued_at = job
+            # Skip calls whose caller has already gone away (e.g. a disconnected datastream)
+            if not future.set_running_or_notify_cancel():
+                continue
+            started_at = time.perf_counter()
+            self.queue_wait.observe(started_at - enqueued_at)
+            try:
+                result = action(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                duration = time.perf_counter() - started_at
+                self.call_time.observe(duration)
+                for register in registers:
+                    histogram = self.register_call_time.get(register)
+                    if histogram is None:
+                        histogram = self.register_call_time[register] = LatencyHistogram()
+                    histogram.observe(duration)
+
+    def submit(self, action: Callable, *args: Any, priority: int = PRIORITY_READ,
+               registers: Sequence[str] = ()) -> Future:
+        """
+        Queues a call on the worker thread.
+
+        Args:
+            action: The function to call.
+            *args: The positional arguments for the function.
+            priority: The priority of the call, lower values run first.
+            registers: The registers the call accesses, its duration is recorded against each of them.
+
+        Returns:
+            Future: A future that resolves to the return value of the call.
+        """
+        if not self._thread.is_alive():
+            raise RuntimeError("LabJack worker is not running")
+        future: Future = Future()
+        self._queue.put((priority, next(self._sequence), (future, action, args, registers, time.perf_counter())))
+        return future
+
+    async def run(self, action: Callable, *args: Any, priority: int = PRIORITY_READ,
+                  registers: Sequence[str] = ()) -> Any:
+        """
+        Queues a call on the worker thread and awaits its result without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self.submit(action, *args, priority=priority, registers=registers))
+
+    def call(self, action: Callable, *args: Any, priority: int = PRIORITY_COMMAND) -> Any:
+        """
+        Queues a call on the worker thread and blocks until it completes. Only for use outside the event loop.
+        """
+        return self.submit(action, *args, priority=priority).result()
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stops the worker thread once every call already queued has been served.
+
+        Args:
+            timeout: The maximum time to wait for the thread to exit.
+        """
+        if self._thread.is_alive():
+            self._queue.put((PRIORITY_SHUTDOWN, next(self._sequence), None))
+            self._thread.join(timeout)
+
+    def latency_metrics(self) -> dict:
+        """
+        Returns the queue wait and call time histograms as a JSON friendly dict.
+        """
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_wait": self.queue_wait.snapshot(),
+            "call_time": self.call_time.snapshot(),
+        }
+
+    def write_metrics(self, writer: PrometheusWriter):
+        """
+        Adds the queue depth and latency histograms of the worker, labelled with its name.
+        """
+        writer.gauge("labjack_queue_depth", "LJM calls waiting for the worker.", self._queue.qsize(), worker=self.name)
+        writer.histogram("labjack_queue_wait_seconds", "Time LJM calls waited for the worker.", self.queue_wait,
+                         worker=self.name)
+        writer.histogram("labjack_call_seconds", "Time spent inside LJM calls.", self.call_time, worker=self.name)
+        for register, histogram in list(self.register_call_time.items()):
+            writer.histogram("labjack_register_call_seconds", "Time spent inside LJM calls accessing each register.",
+                             histogram, register=register)
@@ -10,8 +10,42 @@ Pin Configuration:
 - `relief_output`: Pin numbers for relief output.
 - `d1_servo_pwm`: Pin number for D1 servo PWM.
 - `d1_servo_feedback`: Pin number for D1 servo feedback.
+
+The `STREAM_*` settings configure hardware-timed stream acquisition of the fast analog channels. With
+`STREAM_ENABLED` set to False every channel is polled instead.
+
+`CALIBRATIONS` maps telemetry channel names to the conversion from the raw register value to engineering units. Each
+entry is one of:
+
+- `{"type": "linear", "gain": g, "offset": o}`: g * v + o
+- `{"type": "polynomial", "coefficients": [c0, c1, c2, ...]}`: c0 + c1 * v + c2 * v**2 + ...
+- `{"type": "lookup", "points": [[v0, x0], [v1, x1], ...]}`: linear interpolation between points, sorted by v
+
+with an optional `"decimals"` to round the result to. A JSON file at `CALIBRATION_FILE` holding the same mapping
+overrides these entries, so a sensor can be recalibrated without editing code.
+
+`AIN_PROFILES` holds the analog converter settings applied to every AIN a sensor reads, trading scan speed against
+noise, see app.sensors.analog. `AIN_PROFILE` is the profile applied at startup, it can be switched at runtime.
+
+`FILTERS` maps telemetry channel names to the real-time filter applied after calibration, see app.sensors.filters.
+Channels without an entry use their sensor's default, a moving average over the sensor's filter_size samples.
+
+The `REDIS_*` settings configure the optional Redis sink that mirrors every logged run into Redis alongside the run
+files on disk.
+
+`LABJACK_BACKEND` selects the device backend: "ljm" talks to a real T7, "simulated" runs the whole stack against the
+simulated T7 of app.comms.simulator, which plays a scripted hot fire when the ignitor relay closes. It can be
+overridden with the LABJACK_BACKEND environment variable. `SIMULATOR_LATENCY` is the mean time in seconds each
+simulated call takes.
+
+`LOG_FORMAT` is "text" for readable lines with any structured fields appended as key=value, or "json" for one JSON
+object per line. `REQUEST_LOG_SAMPLING` maps route paths, as declared in app.main, to the fraction of their requests
+that are logged; other routes use `REQUEST_LOG_DEFAULT_RATE`. Failed requests and requests slower than
+`REQUEST_LOG_SLOW` seconds are always logged, see app.request_log.
 """
 
+import os
+
 LABJACK_PINS = {
     "engine_input": ("FIO3", "FIO2"),
     "engine_output": ("FIO1", "FIO0"),
@@ -38,3 +72,66 @@ LABJACK_PINS = {
     "load_cell_test_stand": ("AIN8", "AIN9") 
 }
 
+# Hardware-timed stream acquisition
+STREAM_ENABLED = False
+STREAM_PINS = (
+    "pressure_transducer_supply",
+    "pressure_transducer_engine",
+    "pressure_transducer_tank",
+    "pressure_transducer_chamber",
+    "load_cell_test_stand",
+)
+STREAM_SCAN_RATE = 2000  # Scans per second, typically 1-10 kHz
+STREAM_SCANS_PER_READ = 100  # Scans returned by each eStreamRead, sets the block size
+STREAM_UI_RATE = 200  # Rate in Hz of the decimated snapshots published to datastream clients
+
+# Analog converter profiles, a lower resolution index converts faster but with more noise
+AIN_PROFILES = {
+    "fast": {"resolution_index": 1, "settling_us": 0, "stream_resolution_index": 1},  # Burns, highest scan rate
+    "quiet": {"resolution_index": 8, "settling_us": 0, "stream_resolution_index": 0},  # Standby, 0 is the default
+}
+AIN_PROFILE = "quiet"
+
+# Conversion of raw register values to engineering units, keyed by telemetry channel
+CALIBRATIONS = {
+    "pressure.supply": {"type": "linear", "gain": 54.87, "offset": -25.82, "decimals": 2},
+    "pressure.tank_bottom": {"type": "linear", "gain": 54.87, "offset": -25.82, "decimals": 2},
+    "pressure.tank_top": {"type": "linear", "gain": 54.87, "offset": -25.82, "decimals": 2},
+    "pressure.chamber": {"type": "linear", "gain": 54.87, "offset": -25.82, "decimals": 2},
+    "load_cell.test_stand": {"type": "linear", "gain": 1214127, "offset": 34.6, "decimals": 2},  # 7629, -3017
+}
+CALIBRATION_FILE = "calibration.json"  # Relative to the backend working directory
+
+# Real-time filtering of calibrated values, keyed by telemetry channel
+FILTERS = {
+    # "pressure.chamber": {"type": "median", "size": 5},
+    # "load_cell.test_stand": {"type": "low_pass", "time_constant": 0.02},
+    # "thermocouple.tank_thermocouple": {"type": "none"},
+}
+
+# Optional Redis mirror of logged runs
+REDIS_ENABLED = False
+REDIS_URL = "redis://localhost:6379/0"
+REDIS_MAX_CONNECTIONS = 4  # Size of the connection pool shared by the whole application
+
+# Device backend, "ljm" or "simulated"
+LABJACK_BACKEND = os.environ.get("LABJACK_BACKEND", "ljm")
+SIMULATOR_LATENCY = 0.002  # Roughly a T7 command-response round trip over Ethernet
+
+# Logging, written to stderr from a background thread
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text"  # "text" or "json"
+REQUEST_LOG_SAMPLING = {
+    # Commands are always logged
+    "/valve/{valve_name}": 1.0,
+    "/pilot_valve/{valve_name}": 1.0,
+    "/relays/{relay_name}": 1.0,
+    "/ignition": 1.0,
+    "/log_data/start": 1.0,
+    "/log_data/stop": 1.0,
+    "/analog/profile/{profile}": 1.0,
+    # Scraped every few seconds
+    "/metrics": 0.0,
+}
+REQUEST_LOG_DEFAULT_RATE = 0.05  # Fraction of requests to other routes that are logged
+REQUEST_LOG_SLOW = 0.5  # Requests slower than this many seconds are always logged
@@ -2,27 +2,47 @@
 
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Path, Query, Request, BackgroundTasks, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from app.comms.hardware import LabJackConnection
-from app.comms.exceptions import DeviceNotOpenError, ValveNotFoundError, ServoNotFoundError, LabJackError, PressureSensorError, LoadCellError
+from app.comms.supervisor import ConnectionSupervisor
+from app.comms.exceptions import DeviceNotOpenError, ValveNotFoundError, ServoNotFoundError, LabJackError, PressureSensorError, LoadCellError, TelemetryError, RunNotFoundError
 from app.actuators.valve import ValveController, ValveState
 from app.comms.models import ValveResponse
 from app.sensors.pressure_transducer import PressureTransducerSensor
 from app.actuators.pilot_valve import PilotValveController
+from app.actuators.feedback import ActuatorStateCache
 from app.sensors.thermocouple import ThermocoupleSensor
 from app.sensors.load_cell import LoadCellSensor
+from app.sensors.acquisition import AcquisitionScanner
+from app.sensors.stream import StreamAcquisition
+from app.config import LABJACK_PINS, STREAM_ENABLED, STREAM_PINS, STREAM_SCAN_RATE, STREAM_SCANS_PER_READ, STREAM_UI_RATE
+from app.config import REDIS_ENABLED, REDIS_URL, REDIS_MAX_CONNECTIONS
+from app.telemetry.hub import TelemetryHub
+from app.telemetry.frames import TelemetryFrameBuilder
+from app.telemetry.tiers import TIERS, TelemetryTiers
+from app.storage.run_logger import RunLogger
+from app.storage.recorder import RunReader, list_run_meta
+from app.storage.redis_sink import RedisRunSink, create_client
 from app.actuators.relay import IgnitorRelayController
+from app.metrics import PrometheusWriter
+from app.request_log import RequestLogMiddleware, setup_logging
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from dataclasses import asdict
+from typing import Optional
 import logging
+import json
 import os
 import asyncio
 
 
 
-logging.basicConfig(level=logging.INFO)
+# Records are written to stderr by a background thread, so logging never blocks a request
+setup_logging()
 logger = logging.getLogger(__name__)
 
+TIER_PATTERN = f"^({'|'.join(TIERS)})$"  # Accepted values of the tier query parameter of every datastream
+
 
 
 @asynccontextmanager
@@ -31,19 +51,67 @@ async def lifespan(app: FastAPI):
     try:
         logging.info("Attempting to establish LabJack connection")
         connection = LabJackConnection()
-        app.state.valve_controller = ValveController(connection)
+        app.state.labjack = connection
+        # Reopens the connection if the T7 drops, the acquisition loops carry on once it is back
+        app.state.supervisor = ConnectionSupervisor(connection)
+        app.state.telemetry_hub = TelemetryHub()
+        app.state.scanner = AcquisitionScanner(connection, app.state.telemetry_hub)
+        # The valve feedback pins and the pilot valve limit switches are read by the shared scan
+        app.state.valve_controller = ValveController(connection, app.state.scanner)
         app.state.pressure_transducer_sensor = PressureTransducerSensor(
-            connection)
-        app.state.thermocouple_sensor = ThermocoupleSensor(connection)
-        app.state.pilot_valve_controller = PilotValveController(connection)
+            connection, app.state.scanner)
+        app.state.thermocouple_sensor = ThermocoupleSensor(
+            connection, app.state.scanner)
+        app.state.pilot_valve_controller = PilotValveController(connection, app.state.scanner)
         app.state.ignitor_relay_controller = IgnitorRelayController(connection)
-        app.state.load_cell_sensor = LoadCellSensor(connection)
-        app.state.labjack_connected = True
-        logging.info("LabJack connection established")
+        app.state.load_cell_sensor = LoadCellSensor(
+            connection, app.state.scanner)
+        if STREAM_ENABLED:
+            # Differential pairs are streamed by their positive channel
+            stream_registers = [pin if isinstance(pin, str) else pin[0]
+                                for pin in (LABJACK_PINS[name] for name in STREAM_PINS)]
+            app.state.scanner.attach_stream(StreamAcquisition(
+                connection, stream_registers, STREAM_SCAN_RATE, STREAM_SCANS_PER_READ, STREAM_UI_RATE))
+        app.state.telemetry_frames = TelemetryFrameBuilder(
+            app.state.scanner, app.state.pressure_transducer_sensor, app.state.thermocouple_sensor,
+            app.state.load_cell_sensor, app.state.valve_controller, app.state.ignitor_relay_controller,
+            app.state.pilot_valve_controller)
+        app.state.actuator_states = ActuatorStateCache(
+            app.state.valve_controller, app.state.pilot_valve_controller, app.state.ignitor_relay_controller)
+        app.state.telemetry_tiers = TelemetryTiers(app.state.telemetry_frames)
+        # One pooled Redis client for the whole application, only when runs are mirrored to Redis
+        app.state.redis = create_client(REDIS_URL, REDIS_MAX_CONNECTIONS) if REDIS_ENABLED else None
+        app.state.run_logger = RunLogger(
+            app.state.scanner, app.state.telemetry_frames,
+            sink=RedisRunSink(app.state.redis) if app.state.redis is not None else None)
+        app.state.supervisor.on_reconnect(app.state.scanner.reconnected)
+        if connection.connected:
+            logging.info("LabJack connection established")
     except Exception as e:
         logging.error(f"Failed to establish LabJack connection: {e}")
         raise e
+    # One acquisition loop feeds every datastream and logger through the telemetry hub
+    acquisition_task = asyncio.create_task(app.state.scanner.run())
+    supervisor_task = asyncio.create_task(app.state.supervisor.run())
+    # The decimated UI tiers are computed once from the full-rate samples and shared by every client
+    tiers_task = asyncio.create_task(app.state.telemetry_tiers.run(app.state.scanner.samples))
+    # Valve and relay states are decoded from the same snapshots, state requests never touch the device
+    states_task = asyncio.create_task(app.state.actuator_states.run(app.state.scanner.hub))
+    # Recovery only reads the tail of each interrupted run, but exporting one can take a while
+    recovered = await app.state.run_logger.recover()
+    export_task = asyncio.create_task(app.state.run_logger.finalise_recovered(recovered))
     yield
+    await export_task
+    await app.state.run_logger.stop()
+    for task in (states_task, tiers_task, acquisition_task, supervisor_task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+    connection.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -54,6 +122,8 @@ app = FastAPI(lifespan=lifespan)
 @app.exception_handler(LabJackError)
 @app.exception_handler(PressureSensorError)
 @app.exception_handler(LoadCellError)
+@app.exception_handler(TelemetryError)
+@app.exception_handler(RunNotFoundError)
 async def handle_custom_exceptions(exc):
     return JSONResponse(status_code=500, content={"message": str(exc)})
 
@@ -71,17 +141,66 @@ app.add_middleware(
 )
 
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Received request: {request.method} {request.url}")
-    response = await call_next(request)
-    logger.info(f"Sent response: {response.status_code}")
-    return response
+# Added last so it wraps everything else and times the whole request
+app.add_middleware(RequestLogMiddleware)
 
 
 @app.get("/")
 async def read_root():
-    return {"labjack_connection": app.state.labjack_connected}
+    return {"labjack_connection": app.state.labjack.connected}
+
+
+@app.get("/labjack/connection")
+async def get_labjack_connection():
+    """
+    Returns whether the LabJack is connected, how long it has been disconnected and how long past outages lasted.
+    """
+    return app.state.supervisor.status()
+
+
+@app.get("/labjack/latency")
+async def get_labjack_latency():
+    return app.state.labjack.latency_metrics()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Serves the hardware and pipeline counters in the Prometheus text format: LJM call latency per worker and per
+    register, the acquisition period and jitter, hub and per-subscriber queue depths and drops, run store flushes and
+    reconnects.
+    """
+    writer = PrometheusWriter()
+    app.state.labjack.write_metrics(writer)
+    app.state.supervisor.write_metrics(writer)
+    app.state.scanner.write_metrics(writer)
+    app.state.telemetry_tiers.write_metrics(writer)
+    app.state.actuator_states.write_metrics(writer)
+    app.state.run_logger.write_metrics(writer)
+    return PlainTextResponse(writer.text(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/analog")
+async def get_analog_config() -> dict:
+    """
+    Returns the analog profile in use, the available profiles and the configuration of every analog input.
+    """
+    return app.state.scanner.analog.describe()
+
+
+@app.get("/analog/profile/{profile}")
+async def set_analog_profile(profile: str = Path(...)) -> dict:
+    """
+    Switches every analog input to a speed/noise profile, e.g. "fast" for a burn or "quiet" for standby.
+    """
+    try:
+        await app.state.scanner.analog.apply(profile)
+        return {"message": "Analog profile applied", "profile": profile}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error applying analog profile {profile}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error. Check connection to LabJack.")
 
 
 @app.get("/valve/{valve_name}", response_model=ValveResponse)
@@ -121,13 +240,47 @@ async def actuate_relay(relay_name: str = Path(...)):
 
 @app.get("/valve/{valve_name}/state", response_model=ValveResponse)
 async def get_valve_state(valve_name: str = Path(...)):
+    """
+    Returns the state reported by a valve's feedback pins in the latest scan, None until it has been read.
+    """
     try:
-        feedback = app.state.valve_controller.get_valve_state(valve_name)
-        return {"valve_name": valve_name, "feedback": feedback}
-    except Exception as e:
-        logging.error(f"Error: {e}")
-        raise HTTPException(
-            status_code=500, detail="Internal Server Error. Check connection to LabJack.")
+        feedback = app.state.actuator_states.get(f"valve.{valve_name}")["state"]
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Valve {valve_name} not found")
+    return {"valve_name": valve_name, "feedback": feedback}
+
+
+@app.get("/pilot_valve/{valve_name}/state", response_model=ValveResponse)
+async def get_pilot_valve_state(valve_name: str = Path(...)):
+    """
+    Returns the state reported by a pilot valve's limit switches in the latest scan: open, closed, moving or error.
+    """
+    try:
+        feedback = app.state.actuator_states.get(f"pilot_valve.{valve_name}")["state"]
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Pilot valve {valve_name} not found")
+    return {"valve_name": valve_name, "feedback": feedback}
+
+
+@app.get("/actuators/state")
+async def get_actuator_states():
+    """
+    Returns the cached state of every valve, pilot valve and relay, with when each last changed.
+    """
+    states = app.state.actuator_states
+    return {channel: states.get(channel) for channel in states.readers}
+
+
+@app.get("/telemetry/events")
+async def telemetry_events():
+    """
+    Streams valve, pilot valve and relay state changes as server-sent events, starting with the current state of
+    each channel.
+    """
+    async def event_generator():
+        async for change in app.state.actuator_states.stream():
+            yield f"data: {json.dumps(change, separators=(',', ':'))}\n\n"
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
 @app.get("/pressure/{pressure_transducer_name}/feedback")
@@ -142,14 +295,42 @@ async def get_pressure_transducer_feedback(pressure_transducer_name: str = Path(
             status_code=500, detail="Internal Server Error. Check connection to LabJack.")
 
 
+def tier_datastream(channel: str, tier: str):
+    """
+    Creates a stream of one sensor channel's value at the end of each bucket of a decimated tier.
+
+    Args:
+        channel (str): The telemetry channel, e.g. "pressure.chamber".
+        tier (str): The tier name, e.g. "20hz".
+
+    Returns:
+        The async generator of values.
+
+    Raises:
+        TelemetryError: If there is no such channel.
+    """
+    selected = app.state.telemetry_frames.select([channel])
+
+    async def values():
+        async for frame in app.state.telemetry_tiers.stream(selected, tier):
+            yield frame[channel]
+    return values()
+
+
 @app.get("/pressure/{pressure_transducer_name}/datastream")
-async def pressure_transducer_datastream(pressure_transducer_name: str):
+async def pressure_transducer_datastream(pressure_transducer_name: str,
+                                         tier: str = Query("full", pattern=TIER_PATTERN)):
     try:
+        values = app.state.pressure_transducer_sensor.pressure_transducer_datastream(pressure_transducer_name) \
+            if tier == "full" else tier_datastream(f"pressure.{pressure_transducer_name}", tier)
+
         async def event_generator():
-            async for data in app.state.pressure_transducer_sensor.pressure_transducer_datastream(pressure_transducer_name):
+            async for data in values:
                 yield f"data: {data}\n\n"
 
         return StreamingResponse(event_generator(), media_type="text/event-stream")
+    except TelemetryError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logging.error(f"Error: {e}")
         raise HTTPException(
@@ -170,23 +351,67 @@ async def get_thermocouple_feedback(thermocouple_name: str = Path(...)):
 
 
 @app.get("/thermocouple/{thermocouple_name}/datastream")
-async def thermocouple_datastream(thermocouple_name: str):
+async def thermocouple_datastream(thermocouple_name: str, tier: str = Query("full", pattern=TIER_PATTERN)):
     try:
+        values = app.state.thermocouple_sensor.thermocouple_datastream(thermocouple_name) \
+            if tier == "full" else tier_datastream(f"thermocouple.{thermocouple_name}", tier)
+
         async def event_generator():
-            async for data in app.state.thermocouple_sensor.thermocouple_datastream(thermocouple_name):
+            async for data in values:
                 yield f"data: {round(data, 1)}\n\n"
         return StreamingResponse(event_generator(), media_type="text/event-stream")
+    except TelemetryError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e: 
         logging.error(f"Error: {e}")
         raise HTTPException(
             status_code=500, detail="Internal Server Error. Check connection to LabJack.")
 
 
+@app.get("/telemetry/stream")
+async def telemetry_stream(channels: Optional[str] = Query(None), rate: Optional[float] = Query(None, gt=0),
+                           encoding: str = Query("json", pattern="^(json|binary)$"),
+                           batch: int = Query(1, ge=1, le=1000),
+                           tier: str = Query("full", pattern=TIER_PATTERN)):
+    """
+    Streams one frame per acquisition tick holding every selected sensor, valve and relay channel.
+
+    Args:
+        channels: Comma separated channel or group names, e.g. "pressure,valve.engine". Defaults to every channel.
+        rate: The maximum frame rate in Hz. Defaults to every acquisition tick, or every bucket of a decimated tier.
+        encoding: "json" for server-sent events, or "binary" for packed frames (see app.telemetry.encoding).
+        batch: For binary encoding, the maximum number of samples packed into each frame.
+        tier: "full" for every acquisition tick, or a decimated tier ("100hz", "20hz", "1hz") whose frames also carry
+            the min and max of each channel over the bucket (see app.telemetry.tiers).
+    """
+    try:
+        selected = app.state.telemetry_frames.select(channels.split(",") if channels else None)
+        tiers = app.state.telemetry_tiers
+
+        if encoding == "binary":
+            if tier != "full":
+                return StreamingResponse(tiers.stream_binary(selected, tier, rate, batch),
+                                         media_type="application/octet-stream")
+            return StreamingResponse(app.state.telemetry_frames.stream_binary(selected, rate, batch),
+                                     media_type="application/octet-stream")
+
+        async def event_generator():
+            frames = tiers.stream(selected, tier, rate) if tier != "full" else \
+                app.state.telemetry_frames.stream(selected, rate)
+            async for frame in frames:
+                yield f"data: {json.dumps(frame, separators=(',', ':'))}\n\n"
+        return StreamingResponse(event_generator(), media_type="text/event-stream")
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        raise HTTPException(
+            status_code=500, detail="Internal Server Error. Check connection to LabJack.")
+
+
 @app.get("/ignition")
 async def ignition(background_tasks: BackgroundTasks, delay: int = Query(3)):
     try:
         background_tasks.add_task(
-            app.state.pilot_valve_controller.actuate_ignitor, delay)
+            app.state.pilot_valve_controller.actuate_ignitor, "pilot_valve", delay)
 
         return {"message": "Ignition successful"}
     except Exception as e:
@@ -207,41 +432,28 @@ async def get_load_cell_mass(load_cell_name: str = Path(...)):
 
 
 @app.get("/load_cell_in/{load_cell_name}/datastream")
-async def load_cell_datastream(load_cell_name: str):
+async def load_cell_datastream(load_cell_name: str, tier: str = Query("full", pattern=TIER_PATTERN)):
     try:
+        values = app.state.load_cell_sensor.load_cell_datastream(load_cell_name) \
+            if tier == "full" else tier_datastream(f"load_cell.{load_cell_name}", tier)
+
         async def event_generator():
-            async for data in app.state.load_cell_sensor.load_cell_datastream(load_cell_name):
+            async for data in values:
                 yield f"data: {data}\n\n"
         return StreamingResponse(event_generator(), media_type="text/event-stream")
+    except TelemetryError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logging.error(f"Error: {e}")
         raise HTTPException(
             status_code=500, detail="Internal Server Error. Check connection to LabJack.")
 
 
-async def start_or_stop_sensor_logging(sensor, action: str):
-    try:
-        if action == "start":
-            await sensor.start_logging_all_sensors()
-        elif action == "stop":
-            await sensor.end_logging_all_sensors()
-    except Exception as e:
-        logging.error(f"Failed to {action} logging for {sensor.__class__.__name__}: {e}")
-
-    
-
-async def operate_all_sensors_concurrently(action: str):
-    tasks = []
-    for sensor in [app.state.pressure_transducer_sensor, app.state.thermocouple_sensor , app.state.load_cell_sensor]:
-        tasks.append(start_or_stop_sensor_logging(sensor, action))
-    await asyncio.gather(*tasks)
-    return {"message": f"Logging {action}ed for all sensors"}
-
 @app.get("/log_data/start")
-async def start_log_data(background_tasks: BackgroundTasks) -> dict:
+async def start_log_data(rate: Optional[float] = Query(None, gt=0)) -> dict:
     try:
-        background_tasks.add_task(operate_all_sensors_concurrently, "start")
-        return {"message": "Logging started"}
+        run_id = await app.state.run_logger.start(rate)
+        return {"message": "Logging started", "run_id": run_id}
     except Exception as e:
         logging.error(f"Error starting log data: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error. Check connection to LabJack.")
@@ -249,8 +461,93 @@ async def start_log_data(background_tasks: BackgroundTasks) -> dict:
 @app.get("/log_data/stop")
 async def stop_log_data(background_tasks: BackgroundTasks) -> dict:
     try:
-        background_tasks.add_task(operate_all_sensors_concurrently, "stop")
-        return {"message": "Logging stopped"}
+        meta = await app.state.run_logger.stop()
+        if meta is None:
+            return {"message": "Logging was not active"}
+        background_tasks.add_task(app.state.run_logger.build_lod, meta.run_id)
+        # Keep writing a CSV of every run as the old per-sensor loggers did
+        background_tasks.add_task(app.state.run_logger.export_csv, meta.run_id)
+        if "error" in meta.extra:
+            return {"message": "Logging stopped after a recording error", "run_id": meta.run_id,
+                    "samples": meta.samples, "error": meta.extra["error"]}
+        return {"message": "Logging stopped", "run_id": meta.run_id, "samples": meta.samples}
     except Exception as e:
         logging.error(f"Error stopping log data: {e}")
-        raise HTTPException(status_code=500, detail="Internal Server Error. Check connection to LabJack.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal Server Error. Check connection to LabJack.")
+
+
+@app.get("/runs")
+async def list_runs() -> list:
+    try:
+        return [asdict(meta) for meta in await asyncio.to_thread(list_run_meta)]
+    except Exception as e:
+        logging.error(f"Error listing runs: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error. Could not read runs.")
+
+
+@app.get("/runs/{run_id}/convert")
+async def convert_run(run_id: str = Path(...), format: str = Query("csv", pattern="^(csv|columnar)$")) -> dict:
+    try:
+        if format == "csv":
+            path = await app.state.run_logger.export_csv(run_id)
+        else:
+            path = await app.state.run_logger.export_columnar(run_id)
+        return {"run_id": run_id, "path": path}
+    except Exception as e:
+        logging.error(f"Error converting run {run_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error. Could not convert run.")
+
+
+@app.get("/runs/{run_id}/query")
+async def query_run(run_id: str = Path(...), channels: Optional[str] = Query(None),
+                    start: Optional[float] = Query(None), end: Optional[float] = Query(None),
+                    points: int = Query(2000, ge=1, le=100000)) -> dict:
+    """
+    Returns a time range of a recorded run downsampled to min/max/mean buckets, for plotting.
+
+    Args:
+        channels: Comma separated channel or group names, e.g. "pressure.chamber". Defaults to every channel.
+        start: The UNIX time the range starts at. Defaults to the start of the run.
+        end: The UNIX time the range ends at. Defaults to the end of the run.
+        points: The maximum number of buckets per channel.
+    """
+    try:
+        return await app.state.run_logger.query(run_id, channels.split(",") if channels else None, start, end, points)
+    except RunNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except TelemetryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error querying run {run_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error. Could not read run.")
+
+
+@app.get("/runs/{run_id}/export")
+async def export_run(run_id: str = Path(...), format: str = Query("csv", pattern="^(csv|columnar)$"),
+                     channels: Optional[str] = Query(None), start: Optional[float] = Query(None),
+                     end: Optional[float] = Query(None)):
+    """
+    Streams a recorded run, reading it from disk one chunk at a time.
+
+    Args:
+        format: "csv", or "columnar" for the binary columnar stream described in app.storage.recorder.
+        channels: Comma separated channel or group names, e.g. "pressure,load_cell". Defaults to every channel.
+        start: The UNIX time of the first sample to include. Defaults to the start of the run.
+        end: The UNIX time of the last sample to include. Defaults to the end of the run.
+    """
+    try:
+        reader = await asyncio.to_thread(RunReader.open, run_id, app.state.run_logger.runs_dir)
+        columns = reader.select(channels.split(",") if channels else None)
+    except RunNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except TelemetryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error exporting run {run_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error. Could not read run.")
+    # The readers are plain generators, so the response reads the files in a worker thread
+    if format == "csv":
+        return StreamingResponse(reader.iter_csv(columns, start, end), media_type="text/csv",
+                                 headers={"Content-Disposition": f'attachment; filename="{run_id}.csv"'})
+    return StreamingResponse(reader.iter_columnar(columns, start, end), media_type="application/octet-stream",
+                             headers={"Content-Disposition": f'attachment; filename="{run_id}.psr"'})
@@ -0,0 +1,212 @@
+"""
+This module, metrics.py, contains lightweight in-process instrumentation used across the pad station backend.
+
+The classes here are deliberately simple: they hold plain counters updated from whichever thread records the
+measurement and are read by the API when a client asks for them. Nothing on the hot path allocates or locks.
+
+Components expose their counters through a write_metrics(writer) method. The /metrics endpoint passes one
+PrometheusWriter to each of them and serves the result in the Prometheus text format, so all the formatting cost is
+paid by the scrape rather than by the code being measured.
+"""
+
+# Import necessary modules
+import bisect
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Default latency buckets in seconds, covering sub-millisecond USB/TCP calls up to multi-second retries
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+METRIC_PREFIX = "padstation_"  # Prefix of every exported metric name
+
+
+class LatencyHistogram:
+    """
+    Represents a fixed-bucket histogram of durations.
+
+    Attributes:
+        buckets (tuple): The upper bounds of each bucket in seconds, an implicit +Inf bucket follows the last one.
+        counts (list): The number of observations that fell into each bucket (not cumulative).
+        count (int): The total number of observations.
+        total (float): The sum of every observed duration in seconds.
+        max (float): The largest observed duration in seconds.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """
+        Records a single duration.
+
+        Args:
+            value (float): The duration in seconds.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimates a quantile from the bucket counts.
+
+        Args:
+            q (float): The quantile to estimate, between 0 and 1.
+
+        Returns:
+            Optional[float]: The upper bound of the bucket containing the quantile, the observed maximum if it
+            falls in the +Inf bucket, or None if nothing has been observed.
+        """
+        if self.count == 0:
+            return None
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, object]:
+        """
+        Returns a JSON friendly summary of the histogram.
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": {str(bound): n for bound, n in zip(self.buckets + ("+Inf",), self.counts)},
+        }
+
+
+class PeriodMeter:
+    """
+    Measures the period of a loop from the timestamp of each tick, and its jitter.
+
+    Attributes:
+        period (LatencyHistogram): The time between consecutive ticks.
+        ticks (int): The number of ticks.
+        jitter (float): The exponentially weighted standard deviation of the period in seconds.
+    """
+
+    def __init__(self, smoothing: float = 0.05):
+        self.period = LatencyHistogram()
+        self.ticks = 0
+        self.jitter = 0.0
+        self._smoothing = smoothing
+        self._mean: Optional[float] = None
+        self._variance = 0.0
+        self._last: Optional[float] = None
+
+    def tick(self, timestamp: float):
+        """
+        Records one tick of the loop.
+
+        Args:
+            timestamp (float): The time of the tick in seconds.
+        """
+        last, self._last = self._last, timestamp
+        self.ticks += 1
+        if last is None:
+            return
+        interval = timestamp - last
+        self.period.observe(interval)
+        if self._mean is None:
+            self._mean = interval
+            return
+        delta = interval - self._mean
+        self._mean += self._smoothing * delta
+        self._variance = (1 - self._smoothing) * (self._variance + self._smoothing * delta * delta)
+        self.jitter = math.sqrt(self._variance)
+
+    def restart(self):
+        """
+        Forgets the last tick, so the gap while the loop was stopped is not counted as a period.
+        """
+        self._last = None
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def _format_labels(labels: Dict[str, object]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class PrometheusWriter:
+    """
+    Collects metric samples and renders them in the Prometheus text exposition format, version 0.0.4.
+
+    Samples of the same metric may be added from several components in any order, they are grouped under one HELP
+    and TYPE line when rendered. Samples with a value of None are skipped.
+
+    Attributes:
+        prefix (str): The prefix added to every metric name.
+    """
+
+    def __init__(self, prefix: str = METRIC_PREFIX):
+        self.prefix = prefix
+        self._families: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def _family(self, name: str, kind: str, description: str) -> List[str]:
+        name = self.prefix + name
+        if name not in self._families:
+            self._families[name] = (kind, description, [])
+        return self._families[name][2]
+
+    def counter(self, name: str, description: str, value: Optional[float], **labels):
+        """
+        Adds a sample of a counter, a value that only goes up. The name should end in _total.
+        """
+        if value is not None:
+            self._family(name, "counter", description).append(
+                f"{self.prefix}{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def gauge(self, name: str, description: str, value: Optional[float], **labels):
+        """
+        Adds a sample of a gauge, a value that can go up and down.
+        """
+        if value is not None:
+            self._family(name, "gauge", description).append(
+                f"{self.prefix}{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def histogram(self, name: str, description: str, histogram: LatencyHistogram, **labels):
+        """
+        Adds the cumulative buckets, sum and count of a histogram.
+        """
+        lines = self._family(name, "histogram", description)
+        # Copied first, the histogram may be updated by another thread while it is rendered
+        counts, total = list(histogram.counts), histogram.total
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (math.inf,), counts):
+            cumulative += count
+            bucket_labels = _format_labels({**labels, "le": _format_value(float(bound))})
+            lines.append(f"{self.prefix}{name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.prefix}{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{self.prefix}{name}_count{_format_labels(labels)} {cumulative}")
+
+    def text(self) -> str:
+        """
+        Returns the exposition of every metric added so far.
+        """
+        lines = []
+        for name, (kind, description, samples) in self._families.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
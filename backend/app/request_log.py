@@ -0,0 +1,149 @@
+"""
+This module, request_log.py, sets up the application's logging and contains the RequestLogMiddleware.
+
+Log records are put on a queue by a QueueHandler and written to stderr by a QueueListener thread, so a request never
+waits on a slow terminal or pm2 pipe. Records can carry structured fields, passed as extra={"fields": {...}}, which
+LOG_FORMAT in app.config renders as key=value pairs after a readable line or as one JSON object per line.
+
+The middleware logs one record per request when the response starts, holding the method, path, route, status,
+duration and client. Commands are always logged, while routes that are hit many times a second are sampled according
+to REQUEST_LOG_SAMPLING, keyed by the declared route path so e.g. "/valve/{valve_name}" and
+"/valve/{valve_name}/state" are sampled separately. The sample rate is included in each record, so counts can be
+scaled back up. Failed and slow requests are logged regardless of sampling. For a streamed response, such as a
+datastream, the duration is the time until the stream started.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Dict, Optional
+
+from app.config import LOG_FORMAT, LOG_LEVEL, REQUEST_LOG_DEFAULT_RATE, REQUEST_LOG_SAMPLING, REQUEST_LOG_SLOW
+
+LOG_LINE_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+logger = logging.getLogger(__name__)
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as text with their structured fields appended as key=value, or as JSON objects.
+
+    Attributes:
+        json_output (bool): Whether to output one JSON object per record.
+    """
+
+    def __init__(self, json_output: bool = False):
+        super().__init__(LOG_LINE_FORMAT)
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        if self.json_output:
+            entry = {"time": record.created, "level": record.levelname, "logger": record.name,
+                     "message": record.getMessage(), **fields}
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> logging.handlers.QueueListener:
+    """
+    Routes every log record through a queue to a background thread that writes it to stderr.
+
+    Replaces any handlers already on the root logger. The listener is stopped at exit, after writing what is queued.
+
+    Args:
+        level (str): The minimum level logged, e.g. "INFO".
+        log_format (str): "text" or "json".
+
+    Returns:
+        logging.handlers.QueueListener: The running listener.
+    """
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(StructuredFormatter(json_output=log_format == "json"))
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware that logs a sample of requests with their timing.
+
+    Attributes:
+        app: The ASGI application being wrapped.
+        sampling (Dict[str, float]): The fraction of requests logged for each route path.
+        default_rate (float): The fraction of requests logged for other routes.
+        slow (float): The duration in seconds above which a request is always logged.
+    """
+
+    def __init__(self, app, sampling: Optional[Dict[str, float]] = None, default_rate: float = REQUEST_LOG_DEFAULT_RATE,
+                 slow: float = REQUEST_LOG_SLOW):
+        self.app = app
+        self.sampling = REQUEST_LOG_SAMPLING if sampling is None else sampling
+        self.default_rate = default_rate
+        self.slow = slow
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started_at = time.perf_counter()
+        status = None
+
+        async def send_and_log(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                self._log(scope, status, time.perf_counter() - started_at)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_log)
+        except Exception:
+            if status is None:
+                self._log(scope, 500, time.perf_counter() - started_at)
+            raise
+
+    def _log(self, scope: dict, status: int, duration: float):
+        """
+        Logs a request if it is sampled, failed or slow.
+        """
+        # Set by the router once the request has been matched, missing for unknown paths
+        route = getattr(scope.get("route"), "path", None)
+        rate = self.sampling.get(route, self.default_rate)
+        failed = status >= 400
+        slow = duration >= self.slow
+        if rate < 1.0 and not (failed or slow) and random.random() >= rate:
+            return
+        path = scope["path"]
+        if scope.get("query_string"):
+            path += "?" + scope["query_string"].decode("latin-1")
+        level = logging.ERROR if status >= 500 else logging.WARNING if failed or slow else logging.INFO
+        client = scope.get("client")
+        logger.log(level, f"{scope['method']} {path} {status} {duration * 1000:.1f} ms", extra={"fields": {
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route,
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+            "client": client[0] if client else None,
+            "sample_rate": rate,
+        }})
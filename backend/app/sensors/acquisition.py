@@ -0,0 +1,426 @@
+"""
+This module, acquisition.py, contains the AcquisitionScanner which reads every configured analog channel in one batch.
+
+Each sensor class registers the LabJack registers it needs with the scanner. A scan reads all of them with a single
+eReadNames round trip and returns a Snapshot, so every channel in a snapshot shares the same timestamp. Sensors also
+register the calibration of each of their channels, and every snapshot carries the converted values alongside the raw
+ones. The converted values then go through each channel's real-time filter, and snapshots carry both series: the
+filtered values are what the sensor getters and datastreams report, the unfiltered ones stay available to the run
+logger. Stream blocks are calibrated and filtered in bulk, as arrays.
+
+While run() is active the scanner is the single producer of sensor data: it scans once per period and publishes each
+snapshot to a TelemetryHub, so any number of datastream clients cost no extra hardware reads. Device configuration,
+the analog inputs of every sensor in one batch and then each sensor's own setup (e.g. the thermocouple extended
+feature), is written once before the first scan. A failed scan is retried straight
+away, and the configuration is only written again after RECONFIGURE_AFTER_FAILURES scans in a row have failed, so a
+transient error costs one extra read rather than a full reconfiguration.
+
+When a StreamAcquisition is attached, the fast channels are taken from hardware-timed stream mode instead: decimated
+stream scans are merged with the latest polled values (e.g. thermocouples, which cannot be streamed) and published to
+the hub. If the stream cannot start or fails, the scanner falls back to polling every channel.
+
+Consumers that need every sample rather than the UI rate, such as the run logger, subscribe to the samples hub
+instead. It receives one SampleBatch per polled scan or stream block. A batch keeps a block's scans as arrays next to
+one reference to the latest polled snapshot, so no per-scan objects are built at the stream rate, only for the
+decimated scans published to the hub.
+"""
+
+from dataclasses import dataclass, field
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.comms.hardware import LabJackConnection
+from app.comms.exceptions import DeviceNotOpenError, LabJackError
+from app.metrics import PeriodMeter, PrometheusWriter
+from app.sensors.analog import AnalogConfigurator
+from app.sensors.calibration import CalibrationTable
+from app.sensors.filters import FilterBank
+from app.sensors.stream import StreamAcquisition
+from app.telemetry.hub import TelemetryHub
+
+POLLING_RATE = 0.005  # Time between scans in seconds
+SCAN_RETRIES = 1  # Immediate re-reads of a failed scan before the failure is reported
+RECONFIGURE_AFTER_FAILURES = 20  # Failed scans in a row after which the sensors are configured again
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Snapshot:
+    """
+    Represents the values of every scanned register at one instant.
+
+    Attributes:
+        timestamp (float): The UNIX time in seconds at which the registers were read.
+        values (Dict[str, float]): The raw register values, keyed by register name.
+        converted (Dict[str, float]): The calibrated channel values, keyed by channel name, e.g. "pressure.chamber".
+        filtered (Dict[str, float]): The calibrated values after each channel's real-time filter, keyed by channel.
+    """
+    timestamp: float
+    values: Dict[str, float]
+    converted: Dict[str, float] = field(default_factory=dict)
+    filtered: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class SampleBatch:
+    """
+    Represents the full-rate samples of one polled scan or one stream block, as published to the samples hub.
+
+    The streamed registers and channels are held as scans by columns arrays. Every register and channel that is not
+    streamed takes its value from the polled snapshot, which is the whole batch for a polled scan.
+
+    Attributes:
+        timestamps (np.ndarray): The UNIX time of each scan.
+        polled (Snapshot): The latest polled snapshot.
+        registers (List[str]): The streamed registers, the columns of raw.
+        raw (np.ndarray): The raw value of each streamed register in each scan.
+        channels (List[str]): The streamed channels, the columns of converted and filtered.
+        converted (np.ndarray): The calibrated value of each streamed channel in each scan.
+        filtered (np.ndarray): The filtered value of each streamed channel in each scan.
+    """
+    timestamps: np.ndarray
+    polled: Snapshot
+    registers: List[str] = field(default_factory=list)
+    raw: Optional[np.ndarray] = None
+    channels: List[str] = field(default_factory=list)
+    converted: Optional[np.ndarray] = None
+    filtered: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "SampleBatch":
+        return cls(np.array([snapshot.timestamp]), snapshot)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def column(self, source: str, key: str) -> Optional[np.ndarray]:
+        """
+        Returns the streamed values of a register or channel.
+
+        Args:
+            source (str): "values" for a raw register, "converted" or "filtered" for a channel, as on Snapshot.
+            key (str): The register or channel name.
+
+        Returns:
+            Optional[np.ndarray]: The value in each scan, None if the register or channel is not streamed.
+        """
+        names: Sequence[str] = self.registers if source == "values" else self.channels
+        if key not in names:
+            return None
+        array = self.raw if source == "values" else getattr(self, source)
+        return array[:, names.index(key)]
+
+    def snapshot(self, index: int) -> Snapshot:
+        """
+        Builds the snapshot of one scan, the streamed values merged over the polled ones.
+
+        Args:
+            index (int): The scan's position in the batch.
+
+        Returns:
+            Snapshot: The snapshot.
+        """
+        if not self.registers:
+            return self.polled
+        polled = self.polled
+        return Snapshot(float(self.timestamps[index]),
+                        {**polled.values, **dict(zip(self.registers, self.raw[index].tolist()))},
+                        {**polled.converted, **dict(zip(self.channels, self.converted[index].tolist()))},
+                        {**polled.filtered, **dict(zip(self.channels, self.filtered[index].tolist()))})
+
+
+class AcquisitionScanner:
+    """
+    Reads every registered sensor channel from the LabJack in a single batched call per tick.
+
+    Attributes:
+        labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+        hub (TelemetryHub): The hub every snapshot is published to by run().
+        samples (TelemetryHub): The hub every full-rate SampleBatch is published to by run().
+        period (float): The minimum time between scans in seconds, callers within this window share a snapshot.
+        registers (List[str]): The registers read on every scan, in scan order.
+        analog (AnalogConfigurator): The input configuration of every registered analog channel.
+        calibration (CalibrationTable): The calibration of every registered channel.
+        filters (FilterBank): The real-time filter of every registered channel.
+        snapshot (Optional[Snapshot]): The most recent snapshot.
+        stream (Optional[StreamAcquisition]): The stream mode acquisition of the fast channels, if enabled.
+        streaming (bool): Whether the fast channels are currently being streamed rather than polled.
+        failed_scans (int): The number of scans in a row that have failed.
+        loop_period (Dict[str, PeriodMeter]): The period and jitter of the publishing loop, from the time each polled
+            scan was taken under "polling" and each stream block arrived under "stream".
+        scan_failures (int): The number of scans that have failed since startup.
+    """
+
+    def __init__(self, labjack: LabJackConnection, hub: TelemetryHub, period: float = POLLING_RATE,
+                 calibration: Optional[CalibrationTable] = None, filters: Optional[FilterBank] = None):
+        """
+        Initializes an AcquisitionScanner object.
+
+        Args:
+            labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+            hub (TelemetryHub): The hub every snapshot is published to by run().
+            period (float): The minimum time between scans in seconds.
+            calibration (Optional[CalibrationTable]): The calibration table, defaults to one loaded from the config.
+            filters (Optional[FilterBank]): The filter bank, defaults to one configured from the config.
+        """
+        self.labjack = labjack
+        self.hub = hub
+        self.samples = TelemetryHub()
+        self.period = period
+        self.registers: List[str] = []
+        self.analog = AnalogConfigurator(labjack)
+        self.calibration = calibration or CalibrationTable()
+        self.filters = filters or FilterBank()
+        self.sensors = []
+        self.snapshot: Optional[Snapshot] = None
+        self.stream: Optional[StreamAcquisition] = None
+        self.streaming = False
+        self.failed_scans = 0
+        self.loop_period = {"polling": PeriodMeter(), "stream": PeriodMeter()}
+        self.scan_failures = 0
+        # The connection generation the device was last configured on, None to configure it on the next scan
+        self._setup_generation: Optional[int] = None
+        self._resume_stream = False
+        self._scan_in_flight: Optional[asyncio.Future] = None
+
+    def register(self, sensor):
+        """
+        Adds a sensor's registers to the scan list, its analog inputs to the analog configuration and its channels to
+        the calibration table and filter bank.
+
+        Args:
+            sensor: A sensor object providing registers(), analog_inputs(), calibrations(), filters() and an async
+                setup() method.
+        """
+        self.sensors.append(sensor)
+        for register in sensor.registers():
+            if register not in self.registers:
+                self.registers.append(register)
+        for analog_input in sensor.analog_inputs():
+            self.analog.add(analog_input)
+        for channel, (register, default) in sensor.calibrations().items():
+            calibration = self.calibration.add(channel, register, default)
+            self.filters.add(channel, sensor.filters().get(channel), calibration.decimals)
+
+    def attach_stream(self, stream: StreamAcquisition):
+        """
+        Serves the stream's registers from stream mode while run() is active.
+
+        Args:
+            stream (StreamAcquisition): The stream acquisition, its registers must all be registered by a sensor.
+        """
+        unknown = [register for register in stream.registers if register not in self.registers]
+        if unknown:
+            raise ValueError(f"Stream registers {unknown} are not read by any sensor")
+        self.stream = stream
+
+    def _polled_registers(self) -> List[str]:
+        """
+        Returns the registers to read with eReadNames, which excludes any being streamed.
+        """
+        if not self.streaming:
+            return self.registers
+        return [register for register in self.registers if register not in self.stream.registers]
+
+    async def _setup_sensors(self):
+        """
+        Writes the analog input configuration of every sensor in one batch, then runs each sensor's own setup.
+        """
+        generation = self.labjack.generation
+        await self.analog.apply()
+        for sensor in self.sensors:
+            await sensor.setup()
+        self._setup_generation = generation
+
+    async def _scan(self) -> Snapshot:
+        """
+        Reads every registered register in one eReadNames call.
+        """
+        if self._setup_generation != self.labjack.generation:
+            await self._setup_sensors()
+        registers = self._polled_registers()
+        for attempt in range(SCAN_RETRIES + 1):
+            started_at = time.time()
+            try:
+                values = await self.labjack.read_many(registers)
+                break
+            except LabJackError:
+                if attempt < SCAN_RETRIES:
+                    continue
+                self.failed_scans += 1
+                self.scan_failures += 1
+                if self.failed_scans >= RECONFIGURE_AFTER_FAILURES:
+                    # Persistent failures may mean the device lost its configuration, e.g. after a power cycle
+                    logger.warning(f"{self.failed_scans} scans failed in a row, configuring sensors again")
+                    self.failed_scans = 0
+                    self._setup_generation = None
+                raise
+        self.failed_scans = 0
+        # Stamp the snapshot halfway through the round trip
+        timestamp = (started_at + time.time()) / 2
+        fresh = dict(zip(registers, values))
+        # Only the registers read by this scan are converted, so streamed channels are never filtered twice
+        converted = self.calibration.convert(fresh)
+        filtered = self.filters.apply(converted, timestamp)
+        if self.streaming and self.snapshot:
+            self.snapshot = Snapshot(timestamp, {**self.snapshot.values, **fresh},
+                                     {**self.snapshot.converted, **converted}, {**self.snapshot.filtered, **filtered})
+        else:
+            self.snapshot = Snapshot(timestamp, fresh, converted, filtered)
+        return self.snapshot
+
+    async def scan(self) -> Snapshot:
+        """
+        Performs a scan, or joins the scan already in flight so concurrent callers cost one round trip.
+
+        Returns:
+            Snapshot: The values of every registered register.
+        """
+        if self._scan_in_flight is None:
+            self._scan_in_flight = asyncio.ensure_future(self._scan())
+            self._scan_in_flight.add_done_callback(self._clear_scan_in_flight)
+        return await asyncio.shield(self._scan_in_flight)
+
+    def _clear_scan_in_flight(self, _future: asyncio.Future):
+        self._scan_in_flight = None
+
+    async def latest(self) -> Snapshot:
+        """
+        Returns the latest snapshot, scanning again only if it is stale.
+
+        A snapshot is stale once it is more than two periods old, which leaves room for scheduling jitter in run()
+        so that callers never trigger an extra read while the acquisition loop is active.
+
+        Returns:
+            Snapshot: A snapshot no older than two scan periods.
+        """
+        if self.snapshot is not None and time.time() - self.snapshot.timestamp < 2 * self.period:
+            return self.snapshot
+        return await self.scan()
+
+    async def reconnected(self):
+        """
+        Brings acquisition back after the ConnectionSupervisor has opened a new handle: the first scan on the new
+        connection configures the device again, and stream mode is restarted if a stream is attached.
+        """
+        self.failed_scans = 0
+        if self.stream is not None:
+            self._resume_stream = True
+        await self.scan()
+
+    async def run(self):
+        """
+        Produces snapshots for the hub until cancelled, from stream mode if a stream is attached, else by polling.
+
+        After falling back to polling, stream mode is tried again once the connection has been re-established.
+        """
+        while True:
+            self._resume_stream = False
+            if self.stream is not None:
+                try:
+                    # A full polled scan first so every channel has a value before the first stream block
+                    await self.scan()
+                    await self.stream.start()
+                except (DeviceNotOpenError, LabJackError) as e:
+                    logger.error(f"Stream mode unavailable, falling back to polling: {e}")
+                except Exception:
+                    logger.exception("Unexpected error starting stream mode, falling back to polling")
+                else:
+                    await self._run_streaming()
+            await self._run_polling(publish=True)
+
+    async def _run_streaming(self):
+        """
+        Publishes decimated stream scans merged with polled values, until the stream fails.
+        """
+        self.streaming = True
+        self.loop_period["stream"].restart()
+        # Channels that cannot be streamed keep being polled, their values are merged into each stream snapshot
+        poll_task = None
+        if self._polled_registers():
+            poll_task = asyncio.create_task(self._run_polling(publish=False))
+        try:
+            while True:
+                block = await self.stream.read()
+                # Block timestamps come from the device clock, the arrival time shows how evenly blocks are delivered
+                self.loop_period["stream"].tick(time.time())
+                raw = np.asarray(block.data, dtype=np.float64).reshape(-1, len(block.registers))
+                channels, converted = self.calibration.convert_block(block.registers, raw)
+                timestamps = block.timestamp + np.arange(block.scans) / block.scan_rate
+                filtered = self.filters.apply_block(channels, converted, timestamps)
+                batch = SampleBatch(timestamps, self.snapshot, block.registers, raw, channels, converted, filtered)
+                self.samples.publish(batch)
+                # Snapshots are only built for the decimated scans the UI sees, and the last one for latest()
+                for index in self.stream.decimate(block, range(block.scans)):
+                    self.hub.publish(batch.snapshot(index))
+                self.snapshot = batch.snapshot(block.scans - 1)
+        except (DeviceNotOpenError, LabJackError) as e:
+            logger.error(f"Stream acquisition failed, falling back to polling: {e}")
+        except Exception:
+            # Acquisition must carry on whatever broke the block, e.g. an unexpected block shape
+            logger.exception("Unexpected error in stream acquisition, falling back to polling")
+        finally:
+            self.streaming = False
+            if poll_task is not None:
+                poll_task.cancel()
+            try:
+                await self.stream.stop()
+            except Exception as e:
+                logger.error(f"Failed to stop stream: {e}")
+
+    async def _run_polling(self, publish: bool):
+        """
+        Scans every period, publishing each snapshot to the hub if requested.
+
+        Ticks are scheduled against absolute deadlines so the scan rate does not drift by the round-trip time.
+
+        While the connection is lost no scans are attempted. When publishing, returns once stream mode should be
+        resumed after a reconnect.
+
+        Args:
+            publish (bool): Whether to publish snapshots, False when stream mode is the producer.
+        """
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        if publish:
+            self.loop_period["polling"].restart()
+        while not (publish and self._resume_stream):
+            if self.labjack.connected:
+                try:
+                    snapshot = await self.scan()
+                    if publish:
+                        self.loop_period["polling"].tick(snapshot.timestamp)
+                        self.hub.publish(snapshot)
+                        self.samples.publish(SampleBatch.from_snapshot(snapshot))
+                except (DeviceNotOpenError, LabJackError) as e:
+                    logger.error(f"Acquisition scan failed: {e}")
+                except Exception:
+                    # This loop is the only producer of sensor data, an unexpected error must not end it
+                    logger.exception("Unexpected error in acquisition scan")
+            next_tick += self.period
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Overran the period, resynchronise rather than bursting to catch up
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def write_metrics(self, writer: PrometheusWriter):
+        """
+        Adds the period and jitter of the acquisition loop, scan failures and the snapshot and samples hubs.
+        """
+        for mode, meter in self.loop_period.items():
+            writer.histogram("acquisition_period_seconds", "Time between consecutive acquisition ticks.",
+                             meter.period, mode=mode)
+            writer.gauge("acquisition_jitter_seconds", "Exponentially weighted standard deviation of the period.",
+                         meter.jitter, mode=mode)
+        writer.gauge("acquisition_streaming", "Whether the fast channels are being streamed.", int(self.streaming))
+        writer.counter("acquisition_scan_failures_total", "Polled scans that failed after retrying.",
+                       self.scan_failures)
+        self.hub.write_metrics(writer, "snapshots")
+        self.samples.write_metrics(writer, "samples")
@@ -0,0 +1,131 @@
+"""
+This module, analog.py, contains the AnalogConfigurator which applies the input configuration of every analog channel.
+
+Each sensor declares the AnalogInputs it reads: the AIN register, its range and, for differential inputs, the negative
+channel. The resolution index and settling time set the speed/noise tradeoff of the converter, so they come from a
+profile in AIN_PROFILES in app.config unless an input fixes them itself:
+
+- "fast": the lowest resolution index, for burns where the scan rate matters most
+- "quiet": the highest resolution index, for standby where noise matters more than rate
+
+Every input of every sensor is written in one eWriteNames call, before the first scan and again whenever the profile
+changes or the device has to be configured again. Stream mode ignores the per-channel values and uses the profile's
+optional "stream_resolution_index" instead, from its next start. It is kept separate because high resolution indices
+cannot keep up with typical stream rates.
+"""
+
+from dataclasses import asdict, dataclass
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from app.comms.hardware import LabJackConnection
+from app.config import AIN_PROFILE, AIN_PROFILES
+
+SINGLE_ENDED = 199  # AIN#_NEGATIVE_CH value of a single-ended input
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AnalogInput:
+    """
+    Represents the configuration of one analog input.
+
+    Attributes:
+        register (str): The positive AIN register, e.g. "AIN8".
+        range (Optional[float]): The input range in volts, e.g. 10 or 0.01, None leaves the device setting.
+        negative_channel (Optional[int]): The negative AIN number of a differential input, SINGLE_ENDED for a
+            single-ended input, None leaves the device setting.
+        resolution_index (Optional[int]): A fixed resolution index, None follows the profile.
+        settling_us (Optional[float]): A fixed settling time in microseconds, None follows the profile.
+    """
+    register: str
+    range: Optional[float] = None
+    negative_channel: Optional[int] = SINGLE_ENDED
+    resolution_index: Optional[int] = None
+    settling_us: Optional[float] = None
+
+
+class AnalogConfigurator:
+    """
+    Holds the analog inputs of every sensor and writes their configuration in one batch.
+
+    Attributes:
+        labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+        inputs (Dict[str, AnalogInput]): The configuration of each input, keyed by register.
+        profiles (Dict[str, dict]): The available profiles, keyed by name.
+        profile (str): The name of the profile in use.
+    """
+
+    def __init__(self, labjack: LabJackConnection, profiles: Dict[str, dict] = AIN_PROFILES,
+                 profile: str = AIN_PROFILE):
+        if profile not in profiles:
+            raise ValueError(f"Unknown analog profile {profile}")
+        self.labjack = labjack
+        self.inputs: Dict[str, AnalogInput] = {}
+        self.profiles = profiles
+        self.profile = profile
+
+    def add(self, analog_input: AnalogInput):
+        """
+        Adds an input, replacing any earlier configuration of the same register.
+        """
+        self.inputs[analog_input.register] = analog_input
+
+    def writes(self, profile: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Returns the register writes that configure every input under a profile.
+
+        Args:
+            profile (Optional[str]): The profile name, defaults to the profile in use.
+
+        Returns:
+            List[Tuple[str, float]]: The register names and values, in the order they are written.
+        """
+        settings = self.profiles[profile or self.profile]
+        writes = []
+        for analog_input in self.inputs.values():
+            register = analog_input.register
+            if analog_input.negative_channel is not None:
+                writes.append((f"{register}_NEGATIVE_CH", analog_input.negative_channel))
+            if analog_input.range is not None:
+                writes.append((f"{register}_RANGE", analog_input.range))
+            resolution_index = analog_input.resolution_index
+            writes.append((f"{register}_RESOLUTION_INDEX",
+                           settings["resolution_index"] if resolution_index is None else resolution_index))
+            settling_us = analog_input.settling_us
+            writes.append((f"{register}_SETTLING_US", settings["settling_us"] if settling_us is None else settling_us))
+        if "stream_resolution_index" in settings:
+            writes.append(("STREAM_RESOLUTION_INDEX", settings["stream_resolution_index"]))
+        return writes
+
+    async def apply(self, profile: Optional[str] = None):
+        """
+        Writes the configuration of every input in one eWriteNames call.
+
+        Args:
+            profile (Optional[str]): The profile to switch to, defaults to the profile in use.
+
+        Raises:
+            ValueError: If the profile is unknown.
+            DeviceNotOpenError: If the connection to the LabJack device is not open.
+            LabJackError: If the device rejects the writes, the profile in use is then unchanged.
+        """
+        profile = profile or self.profile
+        if profile not in self.profiles:
+            raise ValueError(f"Unknown analog profile {profile}")
+        writes = self.writes(profile)
+        pins, values = zip(*writes)
+        await self.labjack.write_many(list(pins), list(values))
+        self.profile = profile
+        logger.info(f"Configured {len(self.inputs)} analog inputs with the {profile} profile in one write")
+
+    def describe(self) -> dict:
+        """
+        Returns the profile in use, the available profiles and the configuration of every input.
+        """
+        return {
+            "profile": self.profile,
+            "profiles": self.profiles,
+            "inputs": {register: asdict(analog_input) for register, analog_input in self.inputs.items()},
+        }
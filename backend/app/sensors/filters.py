@@ -0,0 +1,228 @@
+"""
+This module, filters.py, contains the real-time filters applied to calibrated channels between acquisition and fan-out.
+
+Each channel has at most one filter, taken from FILTERS in app.config when one is configured, else from the default of
+the sensor that owns the channel:
+
+- `{"type": "moving_average", "size": n}`: the mean of the last n samples
+- `{"type": "median", "size": n}`: the median of the last n samples, rejects spikes shorter than n / 2 samples
+- `{"type": "low_pass", "time_constant": tau}`: a single-pole IIR low-pass with time constant tau seconds, computed
+  from the sample timestamps so it behaves the same at any sample rate
+- `{"type": "none"}`: no filtering
+
+Filters keep their state between calls and work on whole blocks with NumPy, so a stream block of hundreds of scans is
+filtered with a few array operations per channel. NaN samples are ignored rather than poisoning the filter state.
+"""
+
+import logging
+import math
+import warnings
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.config import FILTERS
+
+logger = logging.getLogger(__name__)
+
+
+class Filter:
+    """
+    Base class of the channel filters.
+    """
+
+    def apply(self, values: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        """
+        Filters consecutive samples of one channel, continuing from the previous call.
+
+        Args:
+            values (np.ndarray): The samples, oldest first.
+            timestamps (np.ndarray): The UNIX time of each sample.
+
+        Returns:
+            np.ndarray: The filtered samples.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def from_config(entry: dict) -> Optional["Filter"]:
+        """
+        Builds a filter from a FILTERS entry.
+
+        Args:
+            entry (dict): The entry, see the top of this module.
+
+        Returns:
+            Optional[Filter]: The filter, None for type "none".
+
+        Raises:
+            ValueError: If the entry is not a valid filter.
+        """
+        kind = entry.get("type")
+        if kind == "none":
+            return None
+        if kind == "moving_average":
+            return MovingAverageFilter(int(entry["size"]))
+        if kind == "median":
+            return MedianFilter(int(entry["size"]))
+        if kind == "low_pass":
+            return LowPassFilter(float(entry["time_constant"]))
+        raise ValueError(f"Unknown filter type {kind}")
+
+
+class WindowFilter(Filter):
+    """
+    Base class of filters over the last size samples, which keeps the last size - 1 samples between calls.
+
+    Attributes:
+        size (int): The number of samples in the window.
+    """
+
+    def __init__(self, size: int):
+        if size < 1:
+            raise ValueError("Filter size must be at least 1")
+        self.size = size
+        # NaN history makes the first outputs use only the samples seen so far
+        self._history = np.full(size - 1, np.nan)
+
+    def _window(self, values: np.ndarray) -> np.ndarray:
+        samples = np.concatenate((self._history, values))
+        self._history = samples[len(samples) - (self.size - 1):]
+        return samples
+
+
+class MovingAverageFilter(WindowFilter):
+    """
+    Averages the last size samples, using running sums so the cost per sample does not depend on size.
+    """
+
+    def apply(self, values: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        samples = self._window(values)
+        valid = ~np.isnan(samples)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, samples, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        ends = np.arange(self.size, len(samples) + 1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (sums[ends] - sums[ends - self.size]) / (counts[ends] - counts[ends - self.size])
+
+
+class MedianFilter(WindowFilter):
+    """
+    Takes the median of the last size samples.
+    """
+
+    def apply(self, values: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        windows = sliding_window_view(self._window(values), self.size)
+        with warnings.catch_warnings():
+            # A window of only NaN has no median and is reported as NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nanmedian(windows, axis=1)
+
+
+class LowPassFilter(Filter):
+    """
+    Single-pole IIR low-pass, y += (1 - exp(-dt / time_constant)) * (x - y) for each sample dt seconds after the last.
+
+    Attributes:
+        time_constant (float): The time constant in seconds, the cutoff frequency is 1 / (2 pi time_constant).
+    """
+
+    def __init__(self, time_constant: float):
+        if time_constant <= 0:
+            raise ValueError("Filter time constant must be positive")
+        self.time_constant = time_constant
+        self._output: Optional[float] = None
+        self._last_time = 0.0
+
+    def apply(self, values: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        output, last_time = self._output, self._last_time
+        filtered = []
+        # The recurrence is inherently sequential, but it is a couple of float operations per sample
+        for value, timestamp in zip(values.tolist(), timestamps.tolist()):
+            if value == value:
+                if output is None:
+                    output = value
+                else:
+                    output -= math.expm1(-max(timestamp - last_time, 0.0) / self.time_constant) * (value - output)
+                last_time = timestamp
+            filtered.append(math.nan if output is None else output)
+        self._output, self._last_time = output, last_time
+        return np.array(filtered)
+
+
+class FilterBank:
+    """
+    Holds the filter of every channel and applies them to calibrated values.
+
+    Attributes:
+        config (Dict[str, dict]): The configured filter entries, keyed by channel.
+        filters (Dict[str, Tuple[Filter, Optional[int]]]): The filter of each filtered channel and the decimals its
+            output is rounded to.
+    """
+
+    def __init__(self, config: Optional[Dict[str, dict]] = None):
+        self.config = FILTERS if config is None else config
+        self.filters: Dict[str, Tuple[Filter, Optional[int]]] = {}
+
+    def add(self, channel: str, default: Optional[dict], decimals: Optional[int] = None):
+        """
+        Adds a channel, filtered by its configured entry if there is one, else by the default.
+
+        Args:
+            channel (str): The telemetry channel name, e.g. "pressure.chamber".
+            default (Optional[dict]): The filter entry to use when none is configured, None for no filter.
+            decimals (Optional[int]): The number of decimals to round the output to, None leaves it unrounded.
+
+        Raises:
+            ValueError: If the entry is not a valid filter.
+        """
+        entry = self.config.get(channel, default)
+        try:
+            channel_filter = Filter.from_config(entry) if entry is not None else None
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid filter for {channel}: {e}")
+        if channel_filter is None:
+            self.filters.pop(channel, None)
+        else:
+            self.filters[channel] = (channel_filter, decimals)
+
+    def apply_block(self, channels: Sequence[str], values: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        """
+        Filters a block of scans.
+
+        Args:
+            channels (Sequence[str]): The channel of each column.
+            values (np.ndarray): A scans by channels array of calibrated values.
+            timestamps (np.ndarray): The UNIX time of each scan.
+
+        Returns:
+            np.ndarray: The filtered values, unfiltered channels are copied unchanged.
+        """
+        filtered = values.copy()
+        for column, channel in enumerate(channels):
+            entry = self.filters.get(channel)
+            if entry is None:
+                continue
+            channel_filter, decimals = entry
+            output = channel_filter.apply(values[:, column], timestamps)
+            filtered[:, column] = output if decimals is None else np.round(output, decimals)
+        return filtered
+
+    def apply(self, converted: Dict[str, float], timestamp: float) -> Dict[str, float]:
+        """
+        Filters a single scan.
+
+        Args:
+            converted (Dict[str, float]): The calibrated values of the channels read by the scan.
+            timestamp (float): The UNIX time of the scan.
+
+        Returns:
+            Dict[str, float]: The filtered values, keyed by channel.
+        """
+        channels: List[str] = list(converted)
+        if not channels:
+            return {}
+        values = np.array([list(converted.values())], dtype=np.float64)
+        filtered = self.apply_block(channels, values, np.array([timestamp]))
+        return dict(zip(channels, filtered[0].tolist()))
@@ -1,22 +1,13 @@
-from collections import deque
 from dataclasses import dataclass
-import asyncio
-from datetime import datetime, timezone
 import logging
 from app.comms.hardware import LabJackConnection
 from app.comms.exceptions import LoadCellError
+from app.sensors.acquisition import AcquisitionScanner, Snapshot
+from app.sensors.analog import AnalogInput
+from app.sensors.calibration import Calibration
 from app.config import LABJACK_PINS
-import aiofiles
-import redis
-from concurrent.futures import ThreadPoolExecutor
 
-
-import csv
-import os
-from pathlib import Path
-
-LOGGING_RATE = 1  # Time between tc log points in seconds
-POLLING_RATE = 0.005  # Time between tc readings in seconds
+from typing import Dict, List, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +16,6 @@ logger = logging.getLogger(__name__)
 class load_cell:
     signal_pos: str
     signal_neg: str
-    calibration_factor: float
-    calibration_constant: float
 
 
 class LoadCellSensor:
@@ -37,23 +26,61 @@ class LoadCellSensor:
         load_cells (dict): A dictionary of load_cells, where the keys are the names of the load_cells
             and the values are instances of the load_cell class.
         labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+        scanner (AcquisitionScanner): The shared scanner that reads every load_cell in one batch.
+        filter_size (int): The moving average window applied to each channel unless FILTERS configures one.
     """
 
-    def __init__(self, labjack: LabJackConnection, filter_size: int = 10):
+    def __init__(self, labjack: LabJackConnection, scanner: AcquisitionScanner, filter_size: int = 10):
         """
         Initializes a load_cellSensor object.
 
         Args:
             labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+            scanner (AcquisitionScanner): The shared scanner that reads every load_cell in one batch.
+            filter_size (int): The default moving average window of each channel, in samples.
         """
         self.load_cells = {
-            "test_stand": load_cell(*LABJACK_PINS["load_cell_test_stand"] , 1214127 , 34.6) # 7629, -3017
+            # Calibrated by CALIBRATIONS["load_cell.test_stand"] in app.config
+            "test_stand": load_cell(*LABJACK_PINS["load_cell_test_stand"])
         }
         self.labjack = labjack
+        self.scanner = scanner
+        self.filter_size = filter_size
+        scanner.register(self)
+
+    def registers(self) -> List[str]:
+        """
+        Returns the LabJack registers read by the shared acquisition scan.
+        """
+        return [load_cell.signal_pos for load_cell in self.load_cells.values()]
+
+    def analog_inputs(self) -> List[AnalogInput]:
+        """
+        Returns the input configuration of each load_cell, differential on the 10 mV range.
+        """
+        return [AnalogInput(load_cell.signal_pos, range=0.01,
+                            negative_channel=int(load_cell.signal_neg[len("AIN"):]))
+                for load_cell in self.load_cells.values()]
 
-        self.load_cell_setup = False
+    def calibrations(self) -> Dict[str, Tuple[str, Calibration]]:
+        """
+        Returns the register and default calibration of each load_cell channel. Load cells have no sensible default,
+        so an unconfigured load_cell reports its raw voltage.
+        """
+        return {f"load_cell.{name}": (load_cell.signal_pos, Calibration())
+                for name, load_cell in self.load_cells.items()}
 
-        self.logging_active = False
+    def filters(self) -> Dict[str, dict]:
+        """
+        Returns the default real-time filter of each load_cell channel, a moving average over filter_size samples.
+        """
+        return {f"load_cell.{name}": {"type": "moving_average", "size": self.filter_size}
+                for name in self.load_cells}
+
+    async def setup(self):
+        """
+        Load cells are plain differential AIN reads, configured with every other analog input by the scanner.
+        """
 
     def _get_load_cell(self, load_cell_name: str) -> load_cell:
         """
@@ -73,26 +100,23 @@ class LoadCellSensor:
         except KeyError:
             logger.error("load_cell not found")
             raise LoadCellError("load_cell not found")
-        
 
-    async def _load_cell_setup(self, load_cell_name: str):
+    def mass_from_snapshot(self, snapshot: Snapshot, load_cell_name: str) -> float:
         """
-        Sets up the LabJack device to read from the specified load_cell.
+        Get a load_cell's mass from a scan snapshot.
 
         Args:
+            snapshot (Snapshot): A snapshot from the shared acquisition scan.
             load_cell_name (str): The name of the load_cell.
-        """
-        load_cell = self._get_load_cell(load_cell_name)
 
-        # Set up the load_cell
-        await self.labjack.write(f"{load_cell.signal_pos}_RANGE", 0.01)
-        await self.labjack.write(f"{load_cell.signal_pos}_RESOLUTION_INDEX", 0)
-        await self.labjack.write(f"{load_cell.signal_pos}_NEGATIVE_CH", int(load_cell.signal_neg[-1]))
-        await self.labjack.write(f"{load_cell.signal_pos}_SETTLING_US", 0)
-        self.load_cell_setup = True 
+        Returns:
+            float: The mass reading in degrees N.
+        """
+        self._get_load_cell(load_cell_name)
+        return snapshot.filtered[f"load_cell.{load_cell_name}"]
 
     async def get_load_cell_mass(self, load_cell_name: str) -> float:
-        """œ
+        """
         Get the mass reading from a load_cell.
 
         Args:
@@ -101,16 +125,9 @@ class LoadCellSensor:
         Returns:
             float: The mass reading in degrees N.
         """
-        load_cell = self._get_load_cell(load_cell_name)
-        if not self.load_cell_setup:
-            await self._load_cell_setup(load_cell_name)
-            
-
-        voltage = await self.labjack.read(load_cell.signal_pos) 
-        mass = voltage * load_cell.calibration_factor + load_cell.calibration_constant
-
-
-        return round(mass, 2)
+        self._get_load_cell(load_cell_name)
+        snapshot = await self.scanner.latest()
+        return self.mass_from_snapshot(snapshot, load_cell_name)
 
     async def load_cell_datastream(self, load_cell_name: str):
         """
@@ -123,76 +140,7 @@ class LoadCellSensor:
             float: The next mass reading from the specified load_cell.
         """
 
-        while True:
-            mass = await self.get_load_cell_mass(load_cell_name)
-            yield mass
-            await asyncio.sleep(POLLING_RATE)
-    
-    async def load_cell_logging(self, load_cell_name: str):
-        # Initialize Redis connection
-        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
-        
-        # Create a ThreadPoolExecutor
-        executor = ThreadPoolExecutor()
-
-        try:
-            while self.logging_active:
-                mass_reading = await self.get_load_cell_mass(load_cell_name)
-                current_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                
-                # Create a structured string or a dictionary to represent the data
-                data = f"{mass_reading},{current_time}"
-                
-                # Use run_in_executor to run the synchronous Redis operation in a separate thread
-                await asyncio.get_event_loop().run_in_executor(executor, lambda: redis_client.lpush(f"load_data:{load_cell_name}", data))
-                
-                await asyncio.sleep(LOGGING_RATE)
-        finally:
-            # Close Redis connection outside of the loop
-            redis_client.close()
-            # Shutdown the executor
-            executor.shutdown(wait=True)
-
-
-    async def start_logging_all_sensors(self):
-        self.logging_active = True
-        tasks = [self.load_cell_logging(name) for name in self.load_cells]
-        await asyncio.gather(*tasks)
-
-        return {"message": "Logging started"}
-
-
-    async def stop_load_cell_logging(self, load_cell_name: str):
-        # Ensure logging is marked as inactive
-        self.logging_active = False
-
-        # Initialize Redis connection
-        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
-
-        # Create a ThreadPoolExecutor for running synchronous Redis operations
-        executor = ThreadPoolExecutor()
-
-        try:
-            # Fetch data from Redis asynchronously using executor
-            data = await asyncio.get_event_loop().run_in_executor(executor, lambda: redis_client.lrange(f"load_data:{load_cell_name}", 0, -1))
-
-            # Define filename for saving data
-            filename = os.path.join(os.getcwd(), f'logs/load_cell/{load_cell_name}_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.csv')
-
-            # Write data to file asynchronously
-            async with aiofiles.open(filename, 'w') as file:
-                await file.write("Mass,Time\n")
-                for entry in data:
-                    await file.write(f"{entry}\n")
-        finally:
-            # Close Redis connection and shutdown executor
-            redis_client.close()
-            executor.shutdown(wait=True)
-
-    async def end_logging_all_sensors(self):
-        # Ensure logging is marked as inactive
-        self.logging_active = False
-
-        # Create tasks for each sensor to stop logging and save data
-        tasks = [self.stop_load_cell_logging(name) for name in self.load_cells]
-        await asyncio.gather(*tasks)
\ No newline at end of file
+        self._get_load_cell(load_cell_name)
+        with self.scanner.hub.subscribe() as subscription:
+            async for snapshot in subscription:
+                yield self.mass_from_snapshot(snapshot, load_cell_name)
@@ -1,23 +1,13 @@
-from collections import deque
 from dataclasses import dataclass
-import asyncio
-from datetime import datetime, timezone
 import logging
 from app.comms.hardware import LabJackConnection
 from app.comms.exceptions import PressureSensorError
+from app.sensors.acquisition import AcquisitionScanner, Snapshot
+from app.sensors.analog import AnalogInput
+from app.sensors.calibration import Calibration
 from app.config import LABJACK_PINS
-import redis
-import aiofiles
-from concurrent.futures import ThreadPoolExecutor
 
-
-import csv
-import os
-from typing import Tuple
-
-
-LOGGING_RATE = 1  # Time between pt log points in seconds
-POLLING_RATE = 0.005  # Time between pt readings in seconds
+from typing import Dict, List, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +17,12 @@ class PressureTransducer:
     pressure_signal: str
     max_pressure: float  # The maximum pressure the transducer can measure
 
+    def default_calibration(self) -> Calibration:
+        """
+        Returns the datasheet scaling of a 0.5-4.5 V transducer, used when no calibration is configured.
+        """
+        return Calibration.linear(self.max_pressure / 4, -0.5 * self.max_pressure / 4, decimals=2)
+
 
 class PressureTransducerSensor:
     """
@@ -36,14 +32,18 @@ class PressureTransducerSensor:
         pressure_transducers (dict): A dictionary of pressure transducers, where the keys are the names of the transducers
             and the values are instances of the PressureTransducer class.
         labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+        scanner (AcquisitionScanner): The shared scanner that reads every transducer in one batch.
+        filter_size (int): The moving average window applied to each channel unless FILTERS configures one.
     """
 
-    def __init__(self, labjack: LabJackConnection, filter_size: int = 10):
+    def __init__(self, labjack: LabJackConnection, scanner: AcquisitionScanner, filter_size: int = 10):
         """
         Initializes a PressureTransducerSensor object.
 
         Args:
             labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+            scanner (AcquisitionScanner): The shared scanner that reads every transducer in one batch.
+            filter_size (int): The default moving average window of each channel, in samples.
         """
         self.pressure_transducers = {
             "supply": PressureTransducer(LABJACK_PINS["pressure_transducer_supply"], 200),
@@ -52,7 +52,41 @@ class PressureTransducerSensor:
             "chamber": PressureTransducer(LABJACK_PINS["pressure_transducer_chamber"], 200),
         }
         self.labjack = labjack
-        self.logging_active = False  # Used to disable logging at a chosen time
+        self.scanner = scanner
+        self.filter_size = filter_size
+        scanner.register(self)
+
+    def registers(self) -> List[str]:
+        """
+        Returns the LabJack registers read by the shared acquisition scan.
+        """
+        return [pressure_transducer.pressure_signal for pressure_transducer in self.pressure_transducers.values()]
+
+    def analog_inputs(self) -> List[AnalogInput]:
+        """
+        Returns the input configuration of each transducer, single-ended on the 10 V range.
+        """
+        return [AnalogInput(pressure_transducer.pressure_signal, range=10.0)
+                for pressure_transducer in self.pressure_transducers.values()]
+
+    def calibrations(self) -> Dict[str, Tuple[str, Calibration]]:
+        """
+        Returns the register and default calibration of each transducer channel.
+        """
+        return {f"pressure.{name}": (pressure_transducer.pressure_signal, pressure_transducer.default_calibration())
+                for name, pressure_transducer in self.pressure_transducers.items()}
+
+    def filters(self) -> Dict[str, dict]:
+        """
+        Returns the default real-time filter of each transducer channel, a moving average over filter_size samples.
+        """
+        return {f"pressure.{name}": {"type": "moving_average", "size": self.filter_size}
+                for name in self.pressure_transducers}
+
+    async def setup(self):
+        """
+        Pressure transducers are plain single-ended AIN reads and need no device configuration.
+        """
 
     def _get_pressure_transducer(self, pressure_transducer_name: str) -> PressureTransducer:
         """
@@ -73,13 +107,25 @@ class PressureTransducerSensor:
             logger.error(f"Pressure Transducer with name {pressure_transducer_name} not found")
             raise PressureSensorError(f"Pressure Transducer with name {pressure_transducer_name} not found")
 
-    async def get_pressure_transducer_feedback(self, pressure_transducer_name: str) -> Tuple[float, float]:
+    def pressure_from_snapshot(self, snapshot: Snapshot, pressure_transducer_name: str) -> Tuple[float, float]:
+        """
+        Gets a transducer's filtered pressure from a scan snapshot.
+
+        Args:
+            snapshot (Snapshot): A snapshot from the shared acquisition scan.
+            pressure_transducer_name (str): The name of the pressure transducer.
+
+        Returns:
+            Tuple[float, float]: The pressure and the raw voltage.
+        """
         pressure_transducer = self._get_pressure_transducer(pressure_transducer_name)
-        voltage = await self.labjack.read(pressure_transducer.pressure_signal)
-        # Calculate pressure from voltage
-        # pressure = (voltage - 0.5) / 4 * pressure_transducer.max_pressure
-        pressure = (voltage * 54.87) - 25.82
-        return round(pressure, 2), voltage
+        voltage = snapshot.values[pressure_transducer.pressure_signal]
+        return snapshot.filtered[f"pressure.{pressure_transducer_name}"], voltage
+
+    async def get_pressure_transducer_feedback(self, pressure_transducer_name: str) -> Tuple[float, float]:
+        self._get_pressure_transducer(pressure_transducer_name)
+        snapshot = await self.scanner.latest()
+        return self.pressure_from_snapshot(snapshot, pressure_transducer_name)
 
     async def pressure_transducer_datastream(self, pressure_transducer_name: str):
         """
@@ -92,80 +138,8 @@ class PressureTransducerSensor:
             float: The next pressure reading from the specified pressure transducer.
 
         """
-        while True:
-            pressure_reading, voltage = await self.get_pressure_transducer_feedback(pressure_transducer_name)
-            yield pressure_reading
-            await asyncio.sleep(POLLING_RATE)
-
-    async def pressure_transducer_logging(self, pressure_transducer_name: str):
-        # Initialize Redis connection
-        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
-        
-        # Create a ThreadPoolExecutor
-        executor = ThreadPoolExecutor()
-
-        try:
-            while self.logging_active:
-                pressure_reading, voltage = await self.get_pressure_transducer_feedback(pressure_transducer_name)
-                current_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                
-                # Create a structured string or a dictionary to represent the data
-                data = f"{pressure_reading},{voltage},{current_time}"
-                
-                # Use run_in_executor to run the synchronous Redis operation in a separate thread
-                await asyncio.get_event_loop().run_in_executor(executor, lambda: redis_client.lpush(f"pressure_data:{pressure_transducer_name}", data))
-                
-                await asyncio.sleep(LOGGING_RATE)
-        finally:
-            # Close Redis connection outside of the loop
-            redis_client.close()
-            # Shutdown the executor
-            executor.shutdown(wait=True)
-
-
-    async def start_logging_all_sensors(self):
-        self.logging_active = True
-        tasks = [self.pressure_transducer_logging(name) for name in self.pressure_transducers]
-        await asyncio.gather(*tasks)
-
-        return {"message": "Logging started"}
-
-
-    async def stop_pressure_transducer_logging(self, pressure_transducer_name: str):
-        # Ensure logging is marked as inactive
-        self.logging_active = False
-
-        # Initialize Redis connection
-        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
-
-        # Create a ThreadPoolExecutor for running synchronous Redis operations
-        executor = ThreadPoolExecutor()
-
-        try:
-            # Fetch data from Redis asynchronously using executor
-            data = await asyncio.get_event_loop().run_in_executor(executor, lambda: redis_client.lrange(f"pressure_data:{pressure_transducer_name}", 0, -1))
-
-            # Define filename for saving data
-            filename = os.path.join(os.getcwd(), f'logs/pressure/{pressure_transducer_name}_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.csv')
-
-            # Write data to file asynchronously
-            async with aiofiles.open(filename, 'w') as file:
-                await file.write("Pressure Reading,Voltage,Time\n")
-                for entry in data:
-                    await file.write(f"{entry}\n")
-        finally:
-            # Close Redis connection and shutdown executor
-
-            logger.info(f"Data saved to {filename}")
-            redis_client.close()
-            executor.shutdown(wait=True)
-
-    async def end_logging_all_sensors(self):
-        # Ensure logging is marked as inactive
-        self.logging_active = False
-
-        # Create tasks for each sensor to stop logging and save data
-        tasks = [self.stop_pressure_transducer_logging(name) for name in self.pressure_transducers]
-        await asyncio.gather(*tasks)
-
-        
\ No newline at end of file
+        self._get_pressure_transducer(pressure_transducer_name)
+        with self.scanner.hub.subscribe() as subscription:
+            async for snapshot in subscription:
+                pressure_reading, voltage = self.pressure_from_snapshot(snapshot, pressure_transducer_name)
+                yield pressure_reading
@@ -0,0 +1,125 @@
+"""
+This module, stream.py, contains the StreamAcquisition class which reads analog channels with LabJack stream mode.
+
+In stream mode the T7 samples the configured channels on its own hardware clock and buffers them, so the sample
+spacing is exact and does not depend on event loop scheduling. Every read returns a SampleBlock of many scans, which
+the AcquisitionScanner publishes in full to its samples hub as arrays and feeds a decimated copy to the snapshot path
+used by the UI.
+"""
+
+from dataclasses import dataclass
+import logging
+import time
+from typing import Iterator, List, Sequence, TypeVar
+
+from app.comms.hardware import LabJackConnection
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class SampleBlock:
+    """
+    Represents consecutive hardware-timed scans of a fixed set of registers.
+
+    Attributes:
+        timestamp (float): The UNIX time in seconds of the first scan in the block.
+        scan_rate (float): The number of scans per second.
+        registers (List[str]): The registers in each scan, in scan order.
+        data (List[float]): The samples, interleaved by scan as returned by eStreamRead.
+    """
+    timestamp: float
+    scan_rate: float
+    registers: List[str]
+    data: List[float]
+
+    @property
+    def scans(self) -> int:
+        return len(self.data) // len(self.registers)
+
+
+class StreamAcquisition:
+    """
+    Runs LabJack stream mode for a set of registers.
+
+    Attributes:
+        labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+        registers (List[str]): The registers included in every scan.
+        scan_rate (float): The scan rate in Hz, replaced by the rate the device actually configured once started.
+        scans_per_read (int): The number of scans in each block.
+        decimation (int): The number of scans per decimated sample.
+    """
+
+    def __init__(self, labjack: LabJackConnection, registers: List[str], scan_rate: float, scans_per_read: int,
+                 ui_rate: float):
+        """
+        Initializes a StreamAcquisition object.
+
+        Args:
+            labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+            registers (List[str]): The registers included in every scan.
+            scan_rate (float): The requested scan rate in Hz.
+            scans_per_read (int): The number of scans in each block.
+            ui_rate (float): The rate in Hz of the decimated samples.
+        """
+        self.labjack = labjack
+        self.registers = list(registers)
+        self.scan_rate = scan_rate
+        self.scans_per_read = scans_per_read
+        self.ui_rate = ui_rate
+        self.decimation = 1
+        self.running = False
+        self._started_at = 0.0
+        self._scans_read = 0
+
+    async def start(self):
+        """
+        Starts streaming on the device.
+        """
+        self.scan_rate = await self.labjack.stream_start(self.registers, self.scan_rate, self.scans_per_read)
+        self._started_at = time.time()
+        self._scans_read = 0
+        self.decimation = max(1, round(self.scan_rate / self.ui_rate))
+        self.running = True
+        logger.info(f"Streaming {len(self.registers)} channels at {self.scan_rate} Hz")
+
+    async def stop(self):
+        """
+        Stops streaming on the device.
+        """
+        if self.running:
+            self.running = False
+            await self.labjack.stream_stop()
+
+    async def read(self) -> SampleBlock:
+        """
+        Waits for the next block of scans.
+
+        Returns:
+            SampleBlock: The block of scans, timestamped from the device scan clock.
+        """
+        data, device_backlog, ljm_backlog = await self.labjack.stream_read()
+        block = SampleBlock(self._started_at + self._scans_read / self.scan_rate, self.scan_rate, self.registers,
+                            data)
+        self._scans_read += block.scans
+        if ljm_backlog > self.scans_per_read * 2:
+            logger.warning(f"Stream falling behind, {ljm_backlog} scans backlogged in LJM")
+        return block
+
+    def decimate(self, block: SampleBlock, items: Sequence[T]) -> Iterator[T]:
+        """
+        Picks every decimation-th scan out of a block, counting across block boundaries.
+
+        Args:
+            block (SampleBlock): A block returned by read().
+            items (Sequence[T]): One item per scan in the block, e.g. range(block.scans).
+
+        Yields:
+            T: The items of the selected scans.
+        """
+        first_scan = self._scans_read - block.scans
+        for index, item in enumerate(items):
+            if (first_scan + index + 1) % self.decimation == 0:
+                yield item
@@ -1,22 +1,13 @@
-from collections import deque
 from dataclasses import dataclass
-import asyncio
-from datetime import datetime, timezone
 import logging
 from app.comms.hardware import LabJackConnection
 from app.comms.exceptions import ThermocoupleSensorError
+from app.sensors.acquisition import AcquisitionScanner, Snapshot
+from app.sensors.analog import AnalogInput
+from app.sensors.calibration import Calibration
 from app.config import LABJACK_PINS
-import aiofiles
-import redis
-from concurrent.futures import ThreadPoolExecutor
 
-
-import csv
-import os
-from pathlib import Path
-
-LOGGING_RATE = 1  # Time between tc log points in seconds
-POLLING_RATE = 0.005  # Time between tc readings in seconds
+from typing import Dict, List, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +15,23 @@ logger = logging.getLogger(__name__)
 @dataclass
 class Thermocouple:
     thermo_pin: str
+    ef_index: int = 22  # AIN_EF type K thermocouple
+    temperature_units: int = 1  # Degrees Celsius
+    cjc_register: int = 60052  # Cold junction compensation from TEMPERATURE_DEVICE_K
+    cjc_slope: float = 1.0
+    cjc_offset: float = 0.0
+
+    def ef_config(self) -> List[Tuple[str, float]]:
+        """
+        Returns the extended feature configuration writes of the thermocouple, in the order they must be applied.
+        """
+        return [
+            (f"{self.thermo_pin}_EF_INDEX", self.ef_index),
+            (f"{self.thermo_pin}_EF_CONFIG_A", self.temperature_units),
+            (f"{self.thermo_pin}_EF_CONFIG_B", self.cjc_register),
+            (f"{self.thermo_pin}_EF_CONFIG_D", self.cjc_slope),
+            (f"{self.thermo_pin}_EF_CONFIG_E", self.cjc_offset),
+        ]
 
 
 class ThermocoupleSensor:
@@ -34,24 +42,71 @@ class ThermocoupleSensor:
         thermocouples (dict): A dictionary of thermocouples, where the keys are the names of the thermocouples
             and the values are instances of the Thermocouple class.
         labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+        scanner (AcquisitionScanner): The shared scanner that reads every thermocouple in one batch.
+        filter_size (int): The moving average window applied to each channel unless FILTERS configures one.
     """
 
-    def __init__(self, labjack: LabJackConnection, filter_size: int = 10):
+    def __init__(self, labjack: LabJackConnection, scanner: AcquisitionScanner, filter_size: int = 10):
         """
         Initializes a ThermocoupleSensor object.
 
         Args:
             labjack (LabJackConnection): An instance of the LabJackConnection class used to communicate with the LabJack device.
+            scanner (AcquisitionScanner): The shared scanner that reads every thermocouple in one batch.
+            filter_size (int): The default moving average window of each channel, in samples.
         """
         self.thermocouples = {
             "tank_thermocouple": Thermocouple(LABJACK_PINS["thermocouple_engine"]),
         }
         self.labjack = labjack
+        self.scanner = scanner
+        self.filter_size = filter_size
 
         self.thermocouple_setup_status = {}
 
+        scanner.register(self)
+
+    def registers(self) -> List[str]:
+        """
+        Returns the LabJack registers read by the shared acquisition scan.
+        """
+        return [f"{thermocouple.thermo_pin}_EF_READ_A" for thermocouple in self.thermocouples.values()]
+
+    def analog_inputs(self) -> List[AnalogInput]:
+        """
+        Returns the input configuration of each thermocouple. The extended feature sets up the input itself, so only
+        the resolution and settling time of the profile apply.
+        """
+        return [AnalogInput(thermocouple.thermo_pin, negative_channel=None)
+                for thermocouple in self.thermocouples.values()]
+
+    def calibrations(self) -> Dict[str, Tuple[str, Calibration]]:
+        """
+        Returns the register and default calibration of each thermocouple channel. The thermocouple extended feature
+        already reports degrees Celsius, so the default leaves the value unchanged.
+        """
+        return {f"thermocouple.{name}": (f"{thermocouple.thermo_pin}_EF_READ_A", Calibration())
+                for name, thermocouple in self.thermocouples.items()}
+
+    def filters(self) -> Dict[str, dict]:
+        """
+        Returns the default real-time filter of each thermocouple channel, a moving average over filter_size samples.
+        """
+        return {f"thermocouple.{name}": {"type": "moving_average", "size": self.filter_size}
+                for name in self.thermocouples}
 
-        self.logging_active = False
+    async def setup(self):
+        """
+        Configures the thermocouple extended feature on every thermocouple channel in one eWriteNames call, so adding
+        thermocouples adds no round trips. Runs once per connection, the scan reads EF_READ_A from then on.
+        """
+        writes = [write for thermocouple in self.thermocouples.values() for write in thermocouple.ef_config()]
+        if not writes:
+            return
+        pins, values = zip(*writes)
+        await self.labjack.write_many(list(pins), list(values))
+        self.thermocouple_setup_status = {name: True for name in self.thermocouples}
+        logger.info(f"Configured {len(self.thermocouples)} thermocouples in one write of {len(writes)} registers")
 
     def _get_thermocouple(self, thermocouple_name: str) -> Thermocouple:
         """
@@ -71,25 +126,20 @@ class ThermocoupleSensor:
         except KeyError:
             logger.error("Thermocouple not found")
             raise ThermocoupleSensorError("Thermocouple not found")
-        
 
-    async def _thermocouple_setup(self, thermocouple_name: str):
+    def temperature_from_snapshot(self, snapshot: Snapshot, thermocouple_name: str) -> float:
         """
-        Sets up the LabJack device to read from the specified thermocouple.
+        Get a thermocouple's temperature from a scan snapshot.
 
         Args:
+            snapshot (Snapshot): A snapshot from the shared acquisition scan.
             thermocouple_name (str): The name of the thermocouple.
-        """
-        thermocouple = self._get_thermocouple(thermocouple_name)
-
-        # Set up the thermocouple
-        await self.labjack.write(f"{thermocouple.thermo_pin}_EF_INDEX", 22)
-        await self.labjack.write(f"{thermocouple.thermo_pin}_EF_CONFIG_A", 1)
-        await self.labjack.write(f"{thermocouple.thermo_pin}_EF_CONFIG_B", 60052)
-        await self.labjack.write(f"{thermocouple.thermo_pin}_EF_CONFIG_D", 1.0)
-        await self.labjack.write(f"{thermocouple.thermo_pin}_EF_CONFIG_E", 0.0)
-        self.thermocouple_setup_status[thermocouple_name] = True
 
+        Returns:
+            float: The temperature reading in degrees Celsius.
+        """
+        self._get_thermocouple(thermocouple_name)
+        return snapshot.filtered[f"thermocouple.{thermocouple_name}"]
 
     async def get_thermocouple_temperature(self, thermocouple_name: str) -> float:
         """
@@ -101,15 +151,9 @@ class ThermocoupleSensor:
         Returns:
             float: The temperature reading in degrees Celsius.
         """
-        thermocouple = self._get_thermocouple(thermocouple_name)
-        if not self.thermocouple_setup_status.get(thermocouple_name, False):
-            await self._thermocouple_setup(thermocouple_name)
-        try:
-            temperature = await self.labjack.read(f"{thermocouple.thermo_pin}_EF_READ_A")
-        except:
-            await self._thermocouple_setup(thermocouple_name)
-
-        return temperature
+        self._get_thermocouple(thermocouple_name)
+        snapshot = await self.scanner.latest()
+        return self.temperature_from_snapshot(snapshot, thermocouple_name)
 
     async def thermocouple_datastream(self, thermocouple_name: str):
         """
@@ -122,76 +166,7 @@ class ThermocoupleSensor:
             float: The next temperature reading from the specified thermocouple.
         """
 
-        while True:
-            temperature = await self.get_thermocouple_temperature(thermocouple_name)
-            yield temperature
-            await asyncio.sleep(POLLING_RATE)
-    
-    async def thermocouple_logging(self, thermocouple_name: str):
-        # Initialize Redis connection
-        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
-        
-        # Create a ThreadPoolExecutor
-        executor = ThreadPoolExecutor()
-
-        try:
-            while self.logging_active:
-                temperature_reading = await self.get_thermocouple_temperature(thermocouple_name)
-                current_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                
-                # Create a structured string or a dictionary to represent the data
-                data = f"{temperature_reading},{current_time}"
-                
-                # Use run_in_executor to run the synchronous Redis operation in a separate thread
-                await asyncio.get_event_loop().run_in_executor(executor, lambda: redis_client.lpush(f"temperature_data:{thermocouple_name}", data))
-                
-                await asyncio.sleep(LOGGING_RATE)
-        finally:
-            # Close Redis connection outside of the loop
-            redis_client.close()
-            # Shutdown the executor
-            executor.shutdown(wait=True)
-
-
-    async def start_logging_all_sensors(self):
-        self.logging_active = True
-        tasks = [self.thermocouple_logging(name) for name in self.thermocouples]
-        await asyncio.gather(*tasks)
-
-        return {"message": "Logging started"}
-
-
-    async def stop_thermocouple_logging(self, thermocouple_name: str):
-        # Ensure logging is marked as inactive
-        self.logging_active = False
-
-        # Initialize Redis connection
-        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
-
-        # Create a ThreadPoolExecutor for running synchronous Redis operations
-        executor = ThreadPoolExecutor()
-
-        try:
-            # Fetch data from Redis asynchronously using executor
-            data = await asyncio.get_event_loop().run_in_executor(executor, lambda: redis_client.lrange(f"temperature_data:{thermocouple_name}", 0, -1))
-
-            # Define filename for saving data
-            filename = os.path.join(os.getcwd(), f'logs/thermocouple/{thermocouple_name}_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.csv')
-
-            # Write data to file asynchronously
-            async with aiofiles.open(filename, 'w') as file:
-                await file.write("Temperature,Time\n")
-                for entry in data:
-                    await file.write(f"{entry}\n")
-        finally:
-            # Close Redis connection and shutdown executor
-            redis_client.close()
-            executor.shutdown(wait=True)
-
-    async def end_logging_all_sensors(self):
-        # Ensure logging is marked as inactive
-        self.logging_active = False
-
-        # Create tasks for each sensor to stop logging and save data
-        tasks = [self.stop_thermocouple_logging(name) for name in self.thermocouples]
-        await asyncio.gather(*tasks)
\ No newline at end of file
+        self._get_thermocouple(thermocouple_name)
+        with self.scanner.hub.subscribe() as subscription:
+            async for snapshot in subscription:
+                yield self.temperature_from_snapshot(snapshot, thermocouple_name)
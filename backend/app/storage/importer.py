@@ -0,0 +1,282 @@
+"""
+This module, importer.py, imports the CSV logs of the old per-sensor loggers into the run store.
+
+The old loggers wrote one CSV per sensor under logs/pressure, logs/thermocouple and logs/load_cell, e.g.
+
+    logs/pressure/chamber.csv           Pressure Reading,Voltage,Time
+    logs/thermocouple/engine.csv        Thermocouple Reading    (or Temperature,Time)
+    logs/load_cell/test_stand.csv       Mass,Time
+
+with the time either as a UNIX time or as a '%Y-%m-%d %H:%M:%S.%f' UTC string, in ascending or, for logs read back
+from Redis, descending order.
+
+Channels are named after the sensors of the current logger, so old and new burns can be queried side by side. The old
+loggers named some files after the pin the transducer was wired to rather than the sensor, and LEGACY_NAMES renames
+them on import:
+
+    pressure/engine.csv       pressure.tank_bottom and voltage.tank_bottom
+    pressure/tank.csv         pressure.tank_top and voltage.tank_top
+    thermocouple/engine.csv   thermocouple.tank_thermocouple
+
+Every other file keeps its name, e.g. pressure/chamber.csv becomes pressure.chamber.
+
+Archives such as fire1.zip are read member by member without being extracted. Each CSV
+is parsed once into a temporary binary spool, so it can be read back in time order whichever way it was written, and
+the spools are merged by time into one run. Every sensor samples on its own clock, so each record holds the latest
+value of every channel at that time (NaN before a channel's first sample). The run gets a level-of-detail pyramid like
+any recorded run, so imported and new burns are queried the same way.
+
+Usage, from the backend directory:
+
+    python -m app.storage.importer ../fire1.zip ../fire2.zip ../fire3.zip
+"""
+
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import argparse
+import csv
+import heapq
+import io
+import logging
+import math
+import os
+import re
+import tempfile
+import zipfile
+from typing import IO, Iterator, List, Optional, Tuple
+
+from app.storage.lod import build_lod
+from app.storage.recorder import READ_CHUNK_RECORDS, RUN_ID_FORMAT, RUNS_DIR, RunMeta, RunReader, RunRecorder
+
+LEGACY_GROUPS = ("pressure", "thermocouple", "load_cell")
+# The current sensor name of each legacy file name that changed, per group, see app.sensors
+LEGACY_NAMES = {
+    "pressure": {"engine": "tank_bottom", "tank": "tank_top"},
+    "thermocouple": {"engine": "tank_thermocouple"},
+}
+LEGACY_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+# The old loggers suffixed each file with the time logging stopped, e.g. chamber_2024-05-25_02-45-46.csv
+STOP_TIME_SUFFIX = re.compile(r"_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$")
+
+logger = logging.getLogger(__name__)
+
+
+def parse_legacy_time(text: str) -> float:
+    """
+    Converts a legacy log time, either a UNIX time or a UTC time string, to a UNIX time.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.strptime(text.strip(), LEGACY_TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+@dataclass
+class LegacySeries:
+    """
+    Represents one legacy sensor CSV inside an archive.
+
+    Attributes:
+        member (str): The path of the CSV inside the archive.
+        channels (List[str]): The run channels its value columns map to, in column order.
+        spool (IO[bytes]): The temporary file holding its records, each a time followed by the values.
+        samples (int): The number of records spooled.
+        order (int): 1 if the records are in ascending time order, -1 if descending, 0 if neither.
+        skipped (int): The number of rows that could not be parsed.
+        first (float): The earliest time in the CSV.
+        last (float): The latest time in the CSV.
+    """
+    member: str
+    channels: List[str]
+    spool: Optional[IO[bytes]] = None
+    samples: int = 0
+    order: int = 1
+    skipped: int = 0
+    first: float = field(default=math.inf)
+    last: float = field(default=-math.inf)
+
+    @property
+    def width(self) -> int:
+        return len(self.channels) + 1
+
+
+def find_series(archive: zipfile.ZipFile) -> List[LegacySeries]:
+    """
+    Finds the legacy sensor CSVs in an archive, skipping macOS metadata and unrelated files.
+    """
+    series = []
+    for info in archive.infolist():
+        parts = info.filename.split("/")
+        filename = parts[-1]
+        if info.is_dir() or "__MACOSX" in parts or filename.startswith(".") or not filename.endswith(".csv"):
+            continue
+        group = parts[-2] if len(parts) > 1 else ""
+        if group not in LEGACY_GROUPS:
+            logger.warning(f"Skipping {info.filename}, not a pressure, thermocouple or load cell log")
+            continue
+        name = STOP_TIME_SUFFIX.sub("", filename[:-len(".csv")])
+        name = LEGACY_NAMES.get(group, {}).get(name, name)
+        channels = [f"{group}.{name}"]
+        if group == "pressure":
+            channels.append(f"voltage.{name}")
+        series.append(LegacySeries(info.filename, channels))
+    return series
+
+
+def _spool(archive: zipfile.ZipFile, series: LegacySeries):
+    """
+    Parses one CSV into a temporary binary spool, noting its time order.
+    """
+    series.spool = tempfile.TemporaryFile()
+    records = array("d")
+    previous = None
+    values = len(series.channels)
+    with io.TextIOWrapper(archive.open(series.member), encoding="utf-8", newline="") as text:
+        for line, row in enumerate(csv.reader(text)):
+            try:
+                # The value columns come first and the time last
+                record = [parse_legacy_time(row[-1])] + [float(value) for value in row[:values]]
+            except (ValueError, IndexError):
+                record = None
+            if record is None or len(record) != series.width:
+                # The first line is the header
+                series.skipped += line > 0
+                continue
+            timestamp = record[0]
+            if previous is not None and series.order and (timestamp - previous) * series.order < 0:
+                series.order = -1 if series.samples == 1 else 0
+            previous = timestamp
+            series.first = min(series.first, timestamp)
+            series.last = max(series.last, timestamp)
+            series.samples += 1
+            records.extend(record)
+            if len(records) >= READ_CHUNK_RECORDS * series.width:
+                records.tofile(series.spool)
+                records = array("d")
+    records.tofile(series.spool)
+
+
+def _read_spool(series: LegacySeries, index: int) -> Iterator[Tuple[float, int, array]]:
+    """
+    Reads a spool back in ascending time order, a chunk at a time.
+
+    Yields:
+        Tuple[float, int, array]: The time, the series index and the values of each record.
+    """
+    width = series.width
+    size = width * array("d").itemsize
+    chunk_records = READ_CHUNK_RECORDS
+    if series.order == 0:
+        # Rows out of order are rare, sort the series in memory rather than failing the import
+        logger.warning(f"{series.member} is not in time order, sorting {series.samples} rows in memory")
+        series.spool.seek(0)
+        records = array("d")
+        records.frombytes(series.spool.read())
+        rows = sorted(records[start:start + width] for start in range(0, len(records), width))
+        for row in rows:
+            yield row[0], index, row[1:]
+        return
+    if series.order == 1:
+        series.spool.seek(0)
+        while True:
+            records = array("d")
+            records.frombytes(series.spool.read(chunk_records * size))
+            if not records:
+                return
+            for start in range(0, len(records), width):
+                yield records[start], index, records[start + 1:start + width]
+    else:
+        end = series.samples
+        while end > 0:
+            first = max(0, end - chunk_records)
+            series.spool.seek(first * size)
+            records = array("d")
+            records.frombytes(series.spool.read((end - first) * size))
+            for start in range(len(records) - width, -1, -width):
+                yield records[start], index, records[start + 1:start + width]
+            end = first
+
+
+def import_archive(path: str, runs_dir: str = RUNS_DIR) -> RunMeta:
+    """
+    Imports the legacy sensor logs in one archive as a single run.
+
+    Args:
+        path (str): The zip archive, e.g. fire1.zip.
+        runs_dir (str): The directory holding every run.
+
+    Returns:
+        RunMeta: The metadata of the imported run, named by its first sample time and the archive name.
+
+    Raises:
+        ValueError: If the archive holds no legacy sensor logs.
+        FileExistsError: If the run has already been imported.
+    """
+    source = os.path.basename(path)
+    with zipfile.ZipFile(path) as archive:
+        series = find_series(archive)
+        if not series:
+            raise ValueError(f"{source} holds no pressure, thermocouple or load cell logs")
+        try:
+            for item in series:
+                _spool(archive, item)
+                logger.info(f"Read {item.samples} rows from {item.member}")
+            meta, directory = _merge(source, [item for item in series if item.samples], runs_dir)
+        finally:
+            for item in series:
+                if item.spool is not None:
+                    item.spool.close()
+    build_lod(RunReader(directory))
+    return meta
+
+
+def _merge(source: str, series: List[LegacySeries], runs_dir: str) -> Tuple[RunMeta, str]:
+    """
+    Merges spooled series by time into a new run, holding each channel's latest value.
+
+    Returns:
+        Tuple[RunMeta, str]: The metadata and directory of the run.
+    """
+    if not series:
+        raise ValueError(f"{source} holds no readable rows")
+    started_at = min(item.first for item in series)
+    ended_at = max(item.last for item in series)
+    channels, offsets = [], []
+    for item in series:
+        offsets.append(len(channels))
+        channels.extend(item.channels)
+    run_id = f"{datetime.fromtimestamp(started_at).strftime(RUN_ID_FORMAT)}_{os.path.splitext(source)[0]}"
+    recorder = RunRecorder.create(channels, runs_dir, started_at, run_id, extra={
+        "imported_from": source,
+        "files": {item.member: {"rows": item.samples, "skipped": item.skipped} for item in series},
+    })
+    latest = [math.nan] * len(channels)
+    merged = heapq.merge(*(_read_spool(item, index) for index, item in enumerate(series)),
+                         key=lambda record: record[0])
+    for timestamp, index, values in merged:
+        offset = offsets[index]
+        latest[offset:offset + len(values)] = values
+        recorder.append(timestamp, latest)
+        if recorder.buffer_full:
+            recorder.write_buffer()
+    recorder.write_buffer()
+    return recorder.finish(ended_at), recorder.directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import legacy sensor CSV archives into the run store.")
+    parser.add_argument("archives", nargs="+", help="zip archives of a legacy logs directory, e.g. fire1.zip")
+    parser.add_argument("--runs-dir", default=RUNS_DIR, help="the run store directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for path in args.archives:
+        try:
+            meta = import_archive(path, args.runs_dir)
+            logger.info(f"Imported {path} as run {meta.run_id} with {meta.samples} samples")
+        except (ValueError, OSError, zipfile.BadZipFile) as e:
+            logger.error(f"Failed to import {path}: {e}")
+
+
+if __name__ == "__main__":
+    main()
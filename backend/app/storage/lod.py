@@ -0,0 +1,252 @@
+"""
+This module, lod.py, contains the level-of-detail pyramid of a recorded run and the range queries served from it.
+
+Level 1 summarises every LOD_FACTOR consecutive records as one bucket, level 2 every LOD_FACTOR level 1 buckets, and
+so on until a level has at most LOD_MIN_BUCKETS buckets. Each level is a file lod.<level>.bin in the run directory
+holding fixed-width float64 buckets:
+
+    time      UNIX time of the first record in the bucket
+    count     number of records in the bucket
+    min, max, mean of each channel in channel order, ignoring NaN
+
+lod.json is written last and lists the levels, so a pyramid is only used once it is complete. Buckets are aligned to
+record indices, so the records of a time range map directly onto a bucket range of every level. A query picks the
+finest level that covers its range in at most LOD_FACTOR buckets per requested point, so it reads a bounded number of
+buckets whatever the length and sample rate of the run.
+"""
+
+from array import array
+import json
+import logging
+import math
+import os
+from typing import List, Optional, Sequence
+
+from app.storage.recorder import READ_CHUNK_RECORDS, RunReader
+
+LOD_FACTOR = 8  # Records or buckets summarised by each bucket of the next level
+LOD_MIN_BUCKETS = 64  # A level with no more buckets than this is the top of the pyramid
+
+logger = logging.getLogger(__name__)
+
+
+def _bucket_width(channels: int) -> int:
+    return 2 + 3 * channels
+
+
+def _without_nan(values: Sequence[float]) -> Sequence[float]:
+    total = sum(values)
+    if total == total:
+        return values
+    return [value for value in values if value == value]
+
+
+def _summarise_records(records: array, width: int, group: int, channels: Sequence[int]) -> array:
+    """
+    Summarises every group consecutive records into one bucket.
+
+    Args:
+        records (array): A flat float64 array of whole records.
+        width (int): The number of values in each record.
+        group (int): The number of records per bucket.
+        channels (Sequence[int]): The record columns of the channels to summarise.
+
+    Returns:
+        array: The buckets, holding only the given channels.
+    """
+    buckets = array("d")
+    count = len(records) // width
+    times = records[0::width]
+    columns = [records[column::width] for column in channels]
+    for first in range(0, count, group):
+        last = min(first + group, count)
+        buckets.append(times[first])
+        buckets.append(last - first)
+        for column in columns:
+            values = _without_nan(column[first:last])
+            if values:
+                buckets.extend((min(values), max(values), sum(values) / len(values)))
+            else:
+                buckets.extend((math.nan, math.nan, math.nan))
+    return buckets
+
+
+def _merge_buckets(buckets: array, channels: int, group: int, selected: Sequence[int]) -> array:
+    """
+    Merges every group consecutive buckets into one.
+
+    Args:
+        buckets (array): Buckets of one level.
+        channels (int): The number of channels in each bucket.
+        group (int): The number of buckets merged into each new bucket.
+        selected (Sequence[int]): The channel positions within a bucket to keep, in order.
+
+    Returns:
+        array: The merged buckets, holding only the selected channels.
+    """
+    merged = array("d")
+    width = _bucket_width(channels)
+    count = len(buckets) // width
+    times = buckets[0::width]
+    counts = buckets[1::width]
+    columns = [(buckets[2 + 3 * channel::width], buckets[3 + 3 * channel::width], buckets[4 + 3 * channel::width])
+               for channel in selected]
+    for first in range(0, count, group):
+        last = min(first + group, count)
+        weights = counts[first:last]
+        merged.append(times[first])
+        merged.append(sum(weights))
+        for minimums, maximums, means in columns:
+            low = _without_nan(minimums[first:last])
+            high = _without_nan(maximums[first:last])
+            total = weight = 0.0
+            for mean, records in zip(means[first:last], weights):
+                if mean == mean:
+                    total += mean * records
+                    weight += records
+            merged.extend((min(low) if low else math.nan, max(high) if high else math.nan,
+                           total / weight if weight else math.nan))
+    return merged
+
+
+def load_lod(directory: str) -> Optional[dict]:
+    """
+    Returns the description of a run's pyramid, None if it has not been built.
+    """
+    path = os.path.join(directory, "lod.json")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def build_lod(reader: RunReader) -> dict:
+    """
+    Builds the pyramid of a finished run, streaming each level from the one below it.
+
+    Args:
+        reader (RunReader): The reader of the run.
+
+    Returns:
+        dict: The pyramid description saved as lod.json.
+    """
+    directory = reader.directory
+    lod_path = os.path.join(directory, "lod.json")
+    if os.path.exists(lod_path):
+        os.remove(lod_path)
+    channels = len(reader.meta.channels)
+    width = _bucket_width(channels)
+    everything = range(channels)
+    total = reader.record_count
+    levels = []
+    chunk = LOD_FACTOR * max(1, READ_CHUNK_RECORDS // LOD_FACTOR)
+    path = os.path.join(directory, "lod.1.bin")
+    with open(f"{path}.tmp", "wb") as file:
+        for first in range(0, total, chunk):
+            _summarise_records(reader.read_records(first, chunk), reader.meta.record_width, LOD_FACTOR,
+                               range(1, reader.meta.record_width)).tofile(file)
+    os.replace(f"{path}.tmp", path)
+    levels.append({"level": 1, "bucket_records": LOD_FACTOR, "buckets": math.ceil(total / LOD_FACTOR)})
+    while levels[-1]["buckets"] > LOD_MIN_BUCKETS:
+        below = levels[-1]
+        level = below["level"] + 1
+        path = os.path.join(directory, f"lod.{level}.bin")
+        with open(os.path.join(directory, f"lod.{below['level']}.bin"), "rb") as source, \
+                open(f"{path}.tmp", "wb") as file:
+            while True:
+                data = source.read(chunk * width * 8)
+                if not data:
+                    break
+                buckets = array("d")
+                buckets.frombytes(data)
+                _merge_buckets(buckets, channels, LOD_FACTOR, everything).tofile(file)
+        os.replace(f"{path}.tmp", path)
+        levels.append({"level": level, "bucket_records": below["bucket_records"] * LOD_FACTOR,
+                       "buckets": math.ceil(below["buckets"] / LOD_FACTOR)})
+    lod = {"factor": LOD_FACTOR, "records": total, "levels": levels}
+    with open(f"{lod_path}.tmp", "w") as file:
+        json.dump(lod, file, indent=2)
+    os.replace(f"{lod_path}.tmp", lod_path)
+    logger.info(f"Built {len(levels)} level pyramid for run {reader.meta.run_id}")
+    return lod
+
+
+def _read_buckets(directory: str, level: int, channels: int, first: int, count: int) -> array:
+    width = _bucket_width(channels)
+    buckets = array("d")
+    with open(os.path.join(directory, f"lod.{level}.bin"), "rb") as file:
+        file.seek(first * width * buckets.itemsize)
+        buckets.frombytes(file.read(count * width * buckets.itemsize))
+    return buckets
+
+
+def _json_values(values: Sequence[float]) -> List[Optional[float]]:
+    return [value if value == value else None for value in values]
+
+
+def query_range(reader: RunReader, columns: List[int], start: Optional[float], end: Optional[float],
+                points: int) -> dict:
+    """
+    Returns at most points min/max/mean buckets per channel covering a time range of a run.
+
+    Ranges holding no more than points records are returned at full resolution, with min, max and mean all equal to
+    the sample. Otherwise the buckets come from the pyramid, or for a run still being recorded are computed from the
+    records in range. Pyramid buckets are aligned to the pyramid, so the first and last may reach slightly outside
+    the range.
+
+    Args:
+        reader (RunReader): The reader of the run.
+        columns (List[int]): The channel columns as returned by RunReader.select().
+        start (Optional[float]): The UNIX time the range starts at, None starts at the beginning of the run.
+        end (Optional[float]): The UNIX time the range ends at, None ends at the end of the run.
+        points (int): The maximum number of buckets to return.
+
+    Returns:
+        dict: The level used (0 for records), the records per bucket, the bucket times and counts, and the min,
+            max and mean of each channel keyed by channel name.
+    """
+    first = reader.locate(start) if start is not None else 0
+    last = reader.locate(math.nextafter(end, math.inf)) if end is not None else reader.record_count
+    count = max(0, last - first)
+    lod = load_lod(reader.directory)
+    channels = len(reader.meta.channels)
+    level, bucket_records = 0, 1
+    if count <= points:
+        buckets = _summarise_records(reader.read_records(first, count), reader.meta.record_width, 1, columns)
+    elif lod is None or not lod["levels"]:
+        group = math.ceil(count / points)
+        buckets = array("d")
+        # Whole groups per read keeps every bucket inside one read
+        chunk = group * max(1, READ_CHUNK_RECORDS // group)
+        for offset in range(first, last, chunk):
+            buckets.extend(_summarise_records(reader.read_records(offset, min(chunk, last - offset)),
+                                              reader.meta.record_width, group, columns))
+        bucket_records = group
+    else:
+        levels = lod["levels"]
+        chosen = next((entry for entry in levels
+                       if math.ceil(count / entry["bucket_records"]) <= LOD_FACTOR * points), levels[-1])
+        level = chosen["level"]
+        first_bucket = first // chosen["bucket_records"]
+        last_bucket = min(math.ceil(last / chosen["bucket_records"]), chosen["buckets"])
+        group = math.ceil((last_bucket - first_bucket) / points)
+        buckets = _merge_buckets(_read_buckets(reader.directory, level, channels, first_bucket,
+                                               last_bucket - first_bucket),
+                                 channels, group, [column - 1 for column in columns])
+        bucket_records = chosen["bucket_records"] * group
+    width = _bucket_width(len(columns))
+    result = {
+        "run_id": reader.meta.run_id,
+        "level": level,
+        "bucket_records": bucket_records,
+        "t": buckets[0::width].tolist(),
+        "count": [int(records) for records in buckets[1::width]],
+        "channels": {},
+    }
+    for index, column in enumerate(columns):
+        result["channels"][reader.meta.channels[column - 1]] = {
+            "min": _json_values(buckets[2 + 3 * index::width]),
+            "max": _json_values(buckets[3 + 3 * index::width]),
+            "mean": _json_values(buckets[4 + 3 * index::width]),
+        }
+    return result
@@ -0,0 +1,673 @@
+"""
+This module, recorder.py, contains the append-only on-disk run recorder and the reader that converts runs on demand.
+
+A run is a directory under RUNS_DIR named by its start time, with a "-1", "-2", ... suffix if a run started in the
+same second, holding:
+
+    meta.json         the channel list, start/end time, sample count and the index of closed segments
+    data.000000.bin   fixed-width records, each a float64 UNIX timestamp followed by one float64 per channel
+    data.000001.bin   ...
+
+Records are buffered in memory and appended in large chunks, with an fsync at most every FSYNC_INTERVAL seconds, so
+memory use is bounded by the buffer size no matter how long the run is. Once a segment reaches SEGMENT_BYTES it is
+fsynced, closed and added to the segment index in meta.json, and recording continues in the next segment.
+
+If the process dies mid-run, meta.json still has no end time. recover_runs() finalises such runs on startup: closed
+segments are already indexed, so only the segments written after the last index update are inspected, and each of
+those only by its size and its first and last record.
+
+Runs are read back in chunks of whole records, optionally limited to a time range: the segment index skips whole
+segments outside the range and a binary search over record timestamps finds the first record inside it, so memory use
+and the amount read do not depend on the size of the run. A run is exported as CSV or as a binary columnar stream:
+
+    4 bytes   magic b"PSR1"
+    uint32    length of the JSON description that follows
+    JSON      {"run": {...meta...}, "columns": [{"name": "time", "dtype": "float64"}, ...]}
+
+followed by blocks, each a uint32 record count and then that many little-endian float64 values of each column in
+turn, and finally a block with a count of 0 marking the end of the export.
+"""
+
+from array import array
+from bisect import bisect_right
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from app.comms.exceptions import RunNotFoundError, TelemetryError
+
+RUNS_DIR = os.path.join(os.getcwd(), "runs")
+RUN_ID_FORMAT = "%Y-%m-%d_%H-%M-%S"
+FLUSH_BYTES = 64 * 1024  # Buffered bytes that trigger a write
+FLUSH_INTERVAL = 0.5  # Maximum time in seconds a record waits in the buffer
+FSYNC_INTERVAL = 2.0  # Minimum time in seconds between fsyncs
+READ_CHUNK_RECORDS = 4096  # Records read at a time when converting a run
+SEGMENT_BYTES = 32 * 1024 * 1024  # Size at which the recorder moves on to a new data segment
+EXPORT_MAGIC = b"PSR1"
+BLOCK_PREFIX = struct.Struct("<I")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RunMeta:
+    """
+    Represents the description of a recorded run.
+
+    Attributes:
+        run_id (str): The name of the run directory.
+        channels (List[str]): The channel stored in each record column after the timestamp.
+        started_at (float): The UNIX time the run started.
+        ended_at (Optional[float]): The UNIX time the run was finalised, None while recording.
+        samples (int): The number of records, updated when the run is finalised.
+        extra (dict): Free-form details about where the run came from.
+        segments (List[dict]): The closed data segments in order, each with its file name, number of records and
+            the timestamps of its first and last record.
+    """
+    run_id: str
+    channels: List[str]
+    started_at: float
+    ended_at: Optional[float] = None
+    samples: int = 0
+    extra: dict = field(default_factory=dict)
+    segments: List[dict] = field(default_factory=list)
+
+    @property
+    def record_width(self) -> int:
+        return len(self.channels) + 1
+
+    @property
+    def record_size(self) -> int:
+        return self.record_width * array("d").itemsize
+
+    def save(self, directory: str):
+        """
+        Atomically writes the metadata file into a run directory.
+        """
+        path = os.path.join(directory, "meta.json")
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(asdict(self), file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, directory: str) -> "RunMeta":
+        with open(os.path.join(directory, "meta.json")) as file:
+            return cls(**json.load(file))
+
+
+def list_run_meta(runs_dir: str = RUNS_DIR) -> List[RunMeta]:
+    """
+    Returns the metadata of every run, oldest first.
+
+    Args:
+        runs_dir (str): The directory holding every run.
+    """
+    if not os.path.isdir(runs_dir):
+        return []
+    runs = []
+    for run_id in sorted(os.listdir(runs_dir)):
+        if os.path.isfile(os.path.join(runs_dir, run_id, "meta.json")):
+            runs.append(RunMeta.load(os.path.join(runs_dir, run_id)))
+    return runs
+
+
+def segment_files(directory: str) -> List[str]:
+    """
+    Returns the data segment file names of a run directory, in recording order.
+    """
+    return sorted(name for name in os.listdir(directory) if name.startswith("data.") and name.endswith(".bin"))
+
+
+def _fsync_directory(directory: str):
+    """
+    Makes a file created or renamed in a directory survive a power loss.
+    """
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _index_segment(directory: str, name: str, record_size: int) -> Optional[dict]:
+    """
+    Builds the index entry of a segment that was not closed cleanly.
+
+    A partially written trailing record is truncated away. Only the first and last records are read.
+
+    Returns:
+        Optional[dict]: The segment entry, None if the segment holds no whole record.
+    """
+    path = os.path.join(directory, name)
+    size = os.path.getsize(path)
+    whole = size - size % record_size
+    with open(path, "r+b") as file:
+        if whole != size:
+            file.truncate(whole)
+            file.flush()
+            os.fsync(file.fileno())
+        if not whole:
+            return None
+        first, last = array("d"), array("d")
+        first.frombytes(file.read(8))
+        file.seek(whole - record_size)
+        last.frombytes(file.read(8))
+    return {"file": name, "samples": whole // record_size, "start": first[0], "end": last[0]}
+
+
+def recover_run(directory: str) -> RunMeta:
+    """
+    Finalises a run whose recorder never closed, e.g. because the backend crashed or was restarted mid-run.
+
+    Args:
+        directory (str): The run directory.
+
+    Returns:
+        RunMeta: The finalised run metadata, with extra["recovered"] set.
+    """
+    meta = RunMeta.load(directory)
+    indexed = {segment["file"] for segment in meta.segments}
+    for name in segment_files(directory):
+        if name not in indexed:
+            segment = _index_segment(directory, name, meta.record_size)
+            if segment is not None:
+                meta.segments.append(segment)
+    meta.samples = sum(segment["samples"] for segment in meta.segments)
+    meta.ended_at = meta.segments[-1]["end"] if meta.segments else meta.started_at
+    meta.extra["recovered"] = True
+    meta.save(directory)
+    logger.warning(f"Recovered interrupted run {meta.run_id} with {meta.samples} samples")
+    return meta
+
+
+def recover_runs(runs_dir: str = RUNS_DIR) -> List[RunMeta]:
+    """
+    Finalises every run left unfinished by a previous process. Must run before a new run is started.
+
+    Args:
+        runs_dir (str): The directory holding every run.
+
+    Returns:
+        List[RunMeta]: The metadata of each recovered run.
+    """
+    return [recover_run(os.path.join(runs_dir, meta.run_id))
+            for meta in list_run_meta(runs_dir) if meta.ended_at is None]
+
+
+def _check_run_id(run_id: str):
+    """
+    Makes sure a run id names a directory directly inside the runs directory.
+
+    Raises:
+        ValueError: If the run id is empty, "." or "..", or holds a path separator.
+    """
+    separators = [separator for separator in (os.sep, os.altsep, "/") if separator]
+    if run_id in ("", ".", "..") or any(separator in run_id for separator in separators):
+        raise ValueError(f"Invalid run id {run_id!r}")
+
+
+def format_timestamp(timestamp: float) -> str:
+    """
+    Formats a UNIX time the way the sensor logs always have, e.g. 2024-07-20 03:12:45.120.
+    """
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+class RunRecorder:
+    """
+    Appends fixed-width records for one run.
+
+    Attributes:
+        directory (str): The run directory.
+        meta (RunMeta): The run metadata.
+    """
+
+    def __init__(self, directory: str, meta: RunMeta):
+        self.directory = directory
+        self.meta = meta
+        self._buffer = array("d")
+        self._buffer_limit = max(1, FLUSH_BYTES // meta.record_size) * meta.record_width
+        self._segment = len(meta.segments)
+        self._segment_size = 0
+        self._segment_start = 0.0
+        self._segment_end = 0.0
+        self._file = self._open_segment()
+        self._last_flush = time.monotonic()
+        self._last_fsync = time.monotonic()
+
+    @classmethod
+    def create(cls, channels: Sequence[str], runs_dir: str = RUNS_DIR, started_at: Optional[float] = None,
+               run_id: Optional[str] = None, extra: Optional[dict] = None) -> "RunRecorder":
+        """
+        Creates a new run directory and a recorder for it.
+
+        Args:
+            channels (Sequence[str]): The channels stored in each record.
+            runs_dir (str): The directory holding every run.
+            started_at (Optional[float]): The UNIX time the run started, defaults to now.
+            run_id (Optional[str]): The name of the run directory, defaults to the start time, suffixed with "-1",
+                "-2", ... if that run already exists.
+            extra (Optional[dict]): Free-form details about where the run came from.
+
+        Returns:
+            RunRecorder: The recorder for the new run.
+
+        Raises:
+            ValueError: If the given run id is not a plain directory name.
+            FileExistsError: If a run with the given run id already exists.
+        """
+        started_at = time.time() if started_at is None else started_at
+        if run_id is not None:
+            _check_run_id(run_id)
+            directory = os.path.join(runs_dir, run_id)
+            os.makedirs(directory)
+        else:
+            base = datetime.fromtimestamp(started_at).strftime(RUN_ID_FORMAT)
+            run_id, suffix = base, 0
+            while True:
+                directory = os.path.join(runs_dir, run_id)
+                try:
+                    os.makedirs(directory)
+                    break
+                except FileExistsError:
+                    # A run started within the same second, e.g. a stop followed straight away by a start
+                    suffix += 1
+                    run_id = f"{base}-{suffix}"
+        meta = RunMeta(run_id, list(channels), started_at, extra=dict(extra or {}))
+        meta.save(directory)
+        _fsync_directory(runs_dir)
+        logger.info(f"Recording run {run_id} to {directory}")
+        return cls(directory, meta)
+
+    @property
+    def _segment_name(self) -> str:
+        return f"data.{self._segment:06d}.bin"
+
+    def _open_segment(self):
+        file = open(os.path.join(self.directory, self._segment_name), "ab")
+        _fsync_directory(self.directory)
+        return file
+
+    def _close_segment(self):
+        """
+        Makes the current segment durable and adds it to the segment index.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if self._segment_size:
+            samples = self._segment_size // self.meta.record_size
+            self.meta.segments.append({"file": self._segment_name, "samples": samples,
+                                       "start": self._segment_start, "end": self._segment_end})
+        else:
+            os.remove(os.path.join(self.directory, self._segment_name))
+
+    def append(self, timestamp: float, values: Sequence[float]):
+        """
+        Buffers one record.
+
+        Args:
+            timestamp (float): The UNIX time of the sample.
+            values (Sequence[float]): One value per channel, in channel order.
+        """
+        self._buffer.append(timestamp)
+        self._buffer.extend(values)
+        self.meta.samples += 1
+
+    def append_block(self, timestamps: np.ndarray, values: np.ndarray):
+        """
+        Buffers one record per row of a block in a single copy.
+
+        Args:
+            timestamps (np.ndarray): The UNIX time of each sample.
+            values (np.ndarray): A samples by channels array, in channel order.
+        """
+        records = np.column_stack((timestamps, values)).astype(np.float64, copy=False)
+        self._buffer.frombytes(records.tobytes())
+        self.meta.samples += len(records)
+
+    def _write(self, records: array, fsync: bool):
+        if self._segment_size >= SEGMENT_BYTES:
+            self._close_segment()
+            self._segment += 1
+            self._segment_size = 0
+            self._file = self._open_segment()
+            # Saving the index here is what lets recovery skip every closed segment
+            self.meta.save(self.directory)
+        if not self._segment_size:
+            self._segment_start = records[0]
+        self._segment_end = records[len(records) - self.meta.record_width]
+        records.tofile(self._file)
+        self._segment_size += len(records) * records.itemsize
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    async def flush(self, force: bool = False) -> Optional[array]:
+        """
+        Writes the buffered records if the buffer is full or has waited long enough.
+
+        The write and any fsync run in a thread so a slow disk never blocks the event loop.
+
+        Args:
+            force (bool): Write and fsync regardless of the thresholds.
+
+        Returns:
+            Optional[array]: The records written, None if nothing was written.
+        """
+        now = time.monotonic()
+        if not force and len(self._buffer) < self._buffer_limit and now - self._last_flush < FLUSH_INTERVAL:
+            return None
+        records, self._buffer = self._buffer, array("d")
+        fsync = force or now - self._last_fsync >= FSYNC_INTERVAL
+        if records:
+            await asyncio.to_thread(self._write, records, fsync)
+        self._last_flush = now
+        if fsync:
+            self._last_fsync = now
+        return records or None
+
+    @property
+    def buffer_full(self) -> bool:
+        return len(self._buffer) >= self._buffer_limit
+
+    def write_buffer(self):
+        """
+        Writes the buffered records from the calling thread, for writers that do not run on the event loop.
+        """
+        records, self._buffer = self._buffer, array("d")
+        if records:
+            self._write(records, False)
+
+    def finish(self, ended_at: Optional[float] = None) -> RunMeta:
+        """
+        Closes the last segment and finalises the run metadata from the calling thread. Buffered records must have
+        been written first.
+
+        Args:
+            ended_at (Optional[float]): The UNIX time the run ended, defaults to now.
+
+        Returns:
+            RunMeta: The final run metadata.
+        """
+        self._close_segment()
+        # Only what reached the segments counts, records buffered when a write failed were never stored
+        self.meta.samples = sum(segment["samples"] for segment in self.meta.segments)
+        self.meta.ended_at = time.time() if ended_at is None else ended_at
+        self.meta.save(self.directory)
+        logger.info(f"Finished run {self.meta.run_id} with {self.meta.samples} samples")
+        return self.meta
+
+    async def close(self) -> RunMeta:
+        """
+        Writes any buffered records and finalises the run metadata.
+
+        Returns:
+            RunMeta: The final run metadata.
+        """
+        await self.flush(force=True)
+        return await asyncio.to_thread(self.finish)
+
+
+class RunReader:
+    """
+    Reads a recorded run in chunks and converts it to other formats.
+
+    Records are assumed to be in time order, which holds for every run the RunRecorder writes.
+
+    Attributes:
+        directory (str): The run directory.
+        meta (RunMeta): The run metadata.
+    """
+
+    def __init__(self, directory: str):
+        if not os.path.isfile(os.path.join(directory, "meta.json")):
+            raise RunNotFoundError(f"Run {os.path.basename(directory)} not found")
+        self.directory = directory
+        self.meta = RunMeta.load(directory)
+
+    @classmethod
+    def open(cls, run_id: str, runs_dir: str = RUNS_DIR) -> "RunReader":
+        try:
+            _check_run_id(run_id)
+        except ValueError:
+            raise RunNotFoundError(f"Run {run_id} not found")
+        return cls(os.path.join(runs_dir, run_id))
+
+    def select(self, selection: Optional[Iterable[str]] = None) -> List[int]:
+        """
+        Resolves a channel selection to record columns, matching channel or group names like the telemetry stream.
+
+        Args:
+            selection (Optional[Iterable[str]]): Channel or group names, None selects every channel.
+
+        Returns:
+            List[int]: The record column of each selected channel, the timestamp being column 0.
+
+        Raises:
+            TelemetryError: If a name matches no channel or group in the run.
+        """
+        if not selection:
+            return list(range(1, self.meta.record_width))
+        columns = []
+        for item in selection:
+            matches = [index + 1 for index, channel in enumerate(self.meta.channels)
+                       if channel == item or channel.split(".", 1)[0] == item]
+            if not matches:
+                raise TelemetryError(f"Telemetry channel {item} not found in run {self.meta.run_id}")
+            columns.extend(column for column in matches if column not in columns)
+        return columns
+
+    def _first_record_from(self, file, count: int, start: float) -> int:
+        """
+        Binary searches a segment for the first record at or after start, reading one timestamp per step.
+        """
+        low, high = 0, count
+        timestamp = array("d")
+        while low < high:
+            middle = (low + high) // 2
+            file.seek(middle * self.meta.record_size)
+            timestamp.frombytes(file.read(timestamp.itemsize))
+            if timestamp.pop() < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _segment_spans(self) -> List[tuple]:
+        """
+        Returns the file name, index of the first record and number of whole records of each segment.
+        """
+        spans, first = [], 0
+        for name in segment_files(self.directory):
+            count = os.path.getsize(os.path.join(self.directory, name)) // self.meta.record_size
+            spans.append((name, first, count))
+            first += count
+        return spans
+
+    @property
+    def record_count(self) -> int:
+        """
+        The number of whole records written so far, including those of a run still being recorded.
+        """
+        return sum(count for _, _, count in self._segment_spans())
+
+    def locate(self, timestamp: float) -> int:
+        """
+        Finds the index of the first record at or after a time, reading a few timestamps per segment.
+
+        Args:
+            timestamp (float): A UNIX time.
+
+        Returns:
+            int: The record index, the number of records if every record is earlier.
+        """
+        indexed = {segment["file"]: segment for segment in self.meta.segments}
+        spans = self._segment_spans()
+        for name, first, count in spans:
+            segment = indexed.get(name)
+            if segment is not None and segment["end"] < timestamp:
+                continue
+            with open(os.path.join(self.directory, name), "rb") as file:
+                index = self._first_record_from(file, count, timestamp)
+            if index < count:
+                return first + index
+        return sum(count for _, _, count in spans)
+
+    def read_records(self, first: int, count: int) -> array:
+        """
+        Reads consecutive records by index, across segment boundaries.
+
+        Args:
+            first (int): The index of the first record.
+            count (int): The maximum number of records to read.
+
+        Returns:
+            array: A flat float64 array of whole records.
+        """
+        records = array("d")
+        size = self.meta.record_size
+        for name, segment_first, segment_count in self._segment_spans():
+            if count <= 0:
+                break
+            if first >= segment_first + segment_count:
+                continue
+            offset = first - segment_first
+            wanted = min(count, segment_count - offset)
+            with open(os.path.join(self.directory, name), "rb") as file:
+                file.seek(offset * size)
+                records.frombytes(file.read(wanted * size))
+            first += wanted
+            count -= wanted
+        return records
+
+    def chunks(self, records: int = READ_CHUNK_RECORDS, start: Optional[float] = None,
+               end: Optional[float] = None) -> Iterator[array]:
+        """
+        Iterates over the run's records in chunks.
+
+        Args:
+            records (int): The maximum number of records per chunk.
+            start (Optional[float]): The UNIX time of the first record to include, None starts at the beginning.
+            end (Optional[float]): The UNIX time of the last record to include, None reads to the end.
+
+        Yields:
+            array: A flat float64 array of whole records, column c of the chunk is chunk[c::meta.record_width].
+        """
+        size = self.meta.record_size
+        width = self.meta.record_width
+        indexed = {segment["file"]: segment for segment in self.meta.segments}
+        for name in segment_files(self.directory):
+            segment = indexed.get(name)
+            if segment is not None and start is not None and segment["end"] < start:
+                continue
+            with open(os.path.join(self.directory, name), "rb") as file:
+                # Ignore a partially written trailing record
+                count = os.fstat(file.fileno()).st_size // size
+                first = self._first_record_from(file, count, start) if start is not None else 0
+                file.seek(first * size)
+                remaining = count - first
+                while remaining > 0:
+                    data = file.read(min(records, remaining) * size)
+                    data = data[:len(data) - len(data) % size]
+                    if not data:
+                        break
+                    remaining -= len(data) // size
+                    chunk = array("d")
+                    chunk.frombytes(data)
+                    if end is not None and chunk[len(chunk) - width] > end:
+                        del chunk[bisect_right(chunk[0::width], end) * width:]
+                        if chunk:
+                            yield chunk
+                        return
+                    yield chunk
+
+    def iter_csv(self, columns: Optional[List[int]] = None, start: Optional[float] = None,
+                 end: Optional[float] = None) -> Iterator[bytes]:
+        """
+        Streams the run as CSV with a Time column followed by one column per selected channel.
+
+        Args:
+            columns (Optional[List[int]]): The channel columns as returned by select(), None includes every channel.
+            start (Optional[float]): The UNIX time of the first record to include.
+            end (Optional[float]): The UNIX time of the last record to include.
+
+        Yields:
+            bytes: The header line, then the lines of one chunk of records at a time.
+        """
+        columns = columns or self.select()
+        width = self.meta.record_width
+        yield (",".join(["Time"] + [self.meta.channels[column - 1] for column in columns]) + "\n").encode()
+        for chunk in self.chunks(start=start, end=end):
+            lines = []
+            for first in range(0, len(chunk), width):
+                record = chunk[first:first + width]
+                lines.append(",".join([format_timestamp(record[0])] + [repr(record[column]) for column in columns]))
+            yield ("\n".join(lines) + "\n").encode()
+
+    def iter_columnar(self, columns: Optional[List[int]] = None, start: Optional[float] = None,
+                      end: Optional[float] = None) -> Iterator[bytes]:
+        """
+        Streams the run in the binary columnar format described at the top of this module.
+
+        Args:
+            columns (Optional[List[int]]): The channel columns as returned by select(), None includes every channel.
+            start (Optional[float]): The UNIX time of the first record to include.
+            end (Optional[float]): The UNIX time of the last record to include.
+
+        Yields:
+            bytes: The header, then one block per chunk of records, then the end block.
+        """
+        columns = [0] + (columns or self.select())
+        width = self.meta.record_width
+        names = ["time"] + self.meta.channels
+        description = json.dumps({"run": asdict(self.meta), "columns": [
+            {"name": names[column], "dtype": "float64"} for column in columns]}).encode()
+        yield EXPORT_MAGIC + struct.pack("<I", len(description)) + description
+        for chunk in self.chunks(start=start, end=end):
+            block = [chunk[column::width].tobytes() for column in columns]
+            yield BLOCK_PREFIX.pack(len(chunk) // width) + b"".join(block)
+        yield BLOCK_PREFIX.pack(0)
+
+    def export_csv(self, path: str):
+        """
+        Writes the run as a CSV file with a Time column followed by one column per channel.
+
+        Args:
+            path (str): The CSV file to write.
+        """
+        with open(path, "wb") as file:
+            for data in self.iter_csv():
+                file.write(data)
+
+    def export_columnar(self, directory: str):
+        """
+        Writes the run as a columnar directory holding schema.json and one raw float64 file per column.
+
+        Args:
+            directory (str): The directory to write, created if needed.
+        """
+        os.makedirs(directory, exist_ok=True)
+        width = self.meta.record_width
+        columns = ["time"] + self.meta.channels
+        files = [open(os.path.join(directory, f"{column}.f64"), "wb") for column in columns]
+        try:
+            for chunk in self.chunks():
+                for index, file in enumerate(files):
+                    chunk[index::width].tofile(file)
+        finally:
+            for file in files:
+                file.close()
+        with open(os.path.join(directory, "schema.json"), "w") as file:
+            json.dump({"run": asdict(self.meta), "columns": [
+                {"name": column, "file": f"{column}.f64", "dtype": "float64"} for column in columns]}, file, indent=2)
@@ -0,0 +1,111 @@
+"""
+This module, redis_sink.py, contains the RedisRunSink which mirrors logged runs into Redis.
+
+The sink is optional and only used when REDIS_ENABLED is set in the config. It shares one redis.asyncio client, and
+with it one connection pool, created in the FastAPI lifespan. Each run is kept as a Redis list of CSV lines under
+"run_data:<run_id>", starting with the same header as the CSV export, so other tools can follow a run while it is
+recorded. Every recorder flush becomes one pipelined round trip of RPUSH commands, each carrying many lines. The
+lines are formatted in a thread, so a large flush never holds up the event loop that acquisition and the datastreams
+share.
+"""
+
+from array import array
+import asyncio
+import logging
+from typing import List, Sequence
+
+import redis
+import redis.asyncio
+
+from app.storage.recorder import format_timestamp
+
+PUSH_CHUNK_LINES = 1000  # Lines per RPUSH command, keeps a single command from growing without bound
+
+logger = logging.getLogger(__name__)
+
+
+def create_client(url: str, max_connections: int) -> redis.asyncio.Redis:
+    """
+    Creates the application-wide Redis client backed by a bounded connection pool.
+
+    Args:
+        url (str): The Redis URL, e.g. redis://localhost:6379/0.
+        max_connections (int): The maximum number of pooled connections.
+
+    Returns:
+        redis.asyncio.Redis: The client, closed with aclose() on shutdown.
+    """
+    pool = redis.asyncio.ConnectionPool.from_url(url, max_connections=max_connections, decode_responses=True)
+    return redis.asyncio.Redis.from_pool(pool)
+
+
+def format_lines(records: array, width: int) -> List[str]:
+    """
+    Formats records as CSV lines, in the same format as the CSV export.
+
+    Args:
+        records (array): A flat float64 array of whole records.
+        width (int): The number of values in each record.
+
+    Returns:
+        List[str]: One line per record.
+    """
+    lines = []
+    for start in range(0, len(records), width):
+        record = records[start:start + width]
+        lines.append(",".join([format_timestamp(record[0])] + [repr(value) for value in record[1:]]))
+    return lines
+
+
+class RedisRunSink:
+    """
+    Pushes the records of each logged run to a Redis list.
+
+    Attributes:
+        client (redis.asyncio.Redis): The shared Redis client.
+        failures (int): The number of flushes that could not be pushed.
+    """
+
+    def __init__(self, client: redis.asyncio.Redis):
+        self.client = client
+        self.failures = 0
+
+    @staticmethod
+    def key(run_id: str) -> str:
+        return f"run_data:{run_id}"
+
+    async def start(self, run_id: str, channels: Sequence[str]):
+        """
+        Starts the list of a new run with its CSV header.
+
+        Args:
+            run_id (str): The id of the run.
+            channels (Sequence[str]): The channels in each record, in order.
+        """
+        await self._push(self.key(run_id), [",".join(["Time"] + list(channels))])
+
+    async def push(self, run_id: str, records: array, width: int):
+        """
+        Appends flushed records to the list of a run.
+
+        Args:
+            run_id (str): The id of the run.
+            records (array): A flat float64 array of whole records, as returned by RunRecorder.flush().
+            width (int): The number of values in each record.
+        """
+        lines = await asyncio.to_thread(format_lines, records, width)
+        await self._push(self.key(run_id), lines)
+
+    async def _push(self, key: str, lines: Sequence[str]):
+        """
+        Sends lines in one pipelined round trip. Failures are logged and counted rather than raised, so an
+        unavailable Redis server never stops the run being recorded to disk.
+        """
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for start in range(0, len(lines), PUSH_CHUNK_LINES):
+                    pipe.rpush(key, *lines[start:start + PUSH_CHUNK_LINES])
+                await pipe.execute()
+        except redis.RedisError as e:
+            self.failures += 1
+            logger.error(f"Failed to push {len(lines)} lines to Redis {key}: {e}")
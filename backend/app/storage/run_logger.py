@@ -0,0 +1,280 @@
+"""
+This module, run_logger.py, contains the RunLogger which records acquisition snapshots into runs on disk.
+
+The logger subscribes to the scanner's full-rate samples hub, so it records every sample the acquisition layer
+produces (each polled scan, or every scan of every stream block) rather than the rate the UI sees. Each batch of
+samples is converted to the numeric telemetry channels in one go, with array operations over the streamed columns
+rather than per scan, and buffered by the RunRecorder, which writes many records per syscall from a thread. If a RedisRunSink is given, every flushed batch is also pushed to Redis.
+
+If writing fails, e.g. because the disk is full, recording stops there: the error is logged at once and kept in the
+run's metadata, and the run is finalised with the samples written so far when logging is stopped or started again.
+
+Runs interrupted by a crash or restart are finalised by recover() on the next startup. Every finished run gets a
+level-of-detail pyramid for fast range queries, see app.storage.lod.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from app.metrics import LatencyHistogram, PrometheusWriter
+from app.sensors.acquisition import AcquisitionScanner
+from app.storage.lod import build_lod, load_lod, query_range
+from app.storage.recorder import RUNS_DIR, RunMeta, RunReader, RunRecorder, recover_runs
+from app.storage.redis_sink import RedisRunSink
+from app.telemetry.frames import TelemetryFrameBuilder
+from app.telemetry.hub import Subscription
+
+LOG_MAX_RATE = None  # Maximum logged samples per second, None logs every sample
+LOG_QUEUE_SIZE = 1024  # Sample batches buffered for the logger before the oldest are dropped
+EXPORT_DIR = os.path.join(os.getcwd(), "logs", "runs")
+
+logger = logging.getLogger(__name__)
+
+
+class RunLogger:
+    """
+    Records every telemetry channel into a run while logging is active.
+
+    Attributes:
+        scanner (AcquisitionScanner): The scanner whose samples hub is recorded.
+        frames (TelemetryFrameBuilder): The frame builder that converts snapshots to channel values.
+        runs_dir (str): The directory holding every run.
+        recorder (Optional[RunRecorder]): The recorder of the active run, None when not logging.
+        failed_runs (int): The number of runs whose recording failed since startup.
+        sink (Optional[RedisRunSink]): The Redis sink every flushed batch is also pushed to, if any.
+        flush_time (LatencyHistogram): The time taken by each flush that wrote records, including the sink.
+        flushed_records (int): The number of records written since startup.
+        flushed_bytes (int): The number of bytes written since startup.
+    """
+
+    def __init__(self, scanner: AcquisitionScanner, frames: TelemetryFrameBuilder, runs_dir: str = RUNS_DIR,
+                 sink: Optional[RedisRunSink] = None):
+        self.scanner = scanner
+        self.frames = frames
+        self.runs_dir = runs_dir
+        self.sink = sink
+        self.channels = frames.select()
+        self.recorder: Optional[RunRecorder] = None
+        self._subscription: Optional[Subscription] = None
+        self._task: Optional[asyncio.Task] = None
+        # Held across every await of start() and stop(), so overlapping requests cannot each create a run
+        self._lock = asyncio.Lock()
+        self.failed_runs = 0
+        self.flush_time = LatencyHistogram()
+        self.flushed_records = 0
+        self.flushed_bytes = 0
+
+    @property
+    def logging_active(self) -> bool:
+        return self.recorder is not None and not self._task.done()
+
+    async def start(self, max_rate: Optional[float] = None) -> str:
+        """
+        Starts recording a new run, unless one is already being recorded.
+
+        Args:
+            max_rate (Optional[float]): The maximum logged samples per second, defaults to LOG_MAX_RATE.
+
+        Returns:
+            str: The id of the run being recorded.
+        """
+        async with self._lock:
+            if self.recorder is not None and self._task.done():
+                # The recording task failed, finalise that run rather than report it as the active one
+                await self._finish()
+            if self.recorder is None:
+                recorder = await asyncio.to_thread(RunRecorder.create, self.channels, self.runs_dir)
+                if self.sink is not None:
+                    await self.sink.start(recorder.meta.run_id, self.channels)
+                self.recorder = recorder
+                self._subscription = self.scanner.samples.subscribe(LOG_QUEUE_SIZE)
+                self._task = asyncio.create_task(self._record(recorder, self._subscription, max_rate or LOG_MAX_RATE))
+                self._task.add_done_callback(lambda task: self._record_done(recorder, task))
+            return self.recorder.meta.run_id
+
+    async def _record(self, recorder: RunRecorder, subscription: Subscription, max_rate: Optional[float]):
+        """
+        Appends every sample batch to the recorder, thinned to max_rate if set, until a None is queued.
+
+        Thinning keeps the first sample in each 1 / max_rate slot of UNIX time.
+        """
+        last_slot = -np.inf
+        channels = self.channels
+        build_block = self.frames.build_block
+        with subscription:
+            async for batch in subscription:
+                if batch is None:
+                    break
+                timestamps = batch.timestamps
+                values = build_block(batch, channels)
+                if max_rate:
+                    slots = np.floor(timestamps * max_rate)
+                    keep = np.diff(slots, prepend=last_slot) > 0
+                    last_slot = slots[-1]
+                    timestamps, values = timestamps[keep], values[keep]
+                if len(timestamps):
+                    recorder.append_block(timestamps, values)
+                # Writes happen once per FLUSH_BYTES or FLUSH_INTERVAL, not per batch
+                await self._flush(recorder)
+            await self._flush(recorder, force=True)
+            if subscription.dropped:
+                logger.warning(f"Run {recorder.meta.run_id} dropped {subscription.dropped} sample batches")
+                recorder.meta.extra["dropped_batches"] = subscription.dropped
+
+    def _record_done(self, recorder: RunRecorder, task: asyncio.Task):
+        """
+        Logs the error a recording task failed with as soon as it happens and marks the run as failed.
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        logger.error(f"Run {recorder.meta.run_id} recording failed, no further samples are written: {error}",
+                     exc_info=error)
+        recorder.meta.extra["error"] = str(error)
+        self.failed_runs += 1
+
+    async def _flush(self, recorder: RunRecorder, force: bool = False):
+        """
+        Flushes the recorder and pushes whatever it wrote to the sink.
+        """
+        started_at = time.perf_counter()
+        records = await recorder.flush(force)
+        if records is None:
+            return
+        if self.sink is not None:
+            await self.sink.push(recorder.meta.run_id, records, recorder.meta.record_width)
+        self.flush_time.observe(time.perf_counter() - started_at)
+        self.flushed_records += len(records) // recorder.meta.record_width
+        self.flushed_bytes += len(records) * records.itemsize
+
+    async def stop(self) -> Optional[RunMeta]:
+        """
+        Stops recording and finalises the run.
+
+        If recording failed, the metadata holds the error under extra["error"] and counts only the samples written.
+
+        Returns:
+            Optional[RunMeta]: The metadata of the finished run, None if logging was not active.
+        """
+        async with self._lock:
+            if self.recorder is None:
+                return None
+            return await self._finish()
+
+    async def _finish(self) -> RunMeta:
+        """
+        Stops the recording task and finalises the active run. The caller must hold the lock.
+        """
+        recorder, self.recorder = self.recorder, None
+        # Let the recording task finish its current write rather than cancelling it mid-flush
+        self._subscription.put(None)
+        try:
+            await self._task
+        except Exception:
+            # Already logged by _record_done, the buffered records are dropped rather than written after a failure
+            return await asyncio.to_thread(recorder.finish)
+        return await recorder.close()
+
+    async def recover(self) -> List[RunMeta]:
+        """
+        Finalises the runs interrupted by a previous process, in a thread. Must finish before start() is called.
+
+        Returns:
+            List[RunMeta]: The metadata of each recovered run.
+        """
+        return await asyncio.to_thread(recover_runs, self.runs_dir)
+
+    async def finalise_recovered(self, recovered: List[RunMeta]):
+        """
+        Builds the pyramid of each recovered run and exports it to CSV, logging rather than raising if one fails.
+
+        Args:
+            recovered (List[RunMeta]): The runs returned by recover().
+        """
+        for meta in recovered:
+            try:
+                await self.build_lod(meta.run_id)
+                await self.export_csv(meta.run_id)
+            except Exception as e:
+                logger.error(f"Failed to finalise recovered run {meta.run_id}: {e}")
+
+    async def build_lod(self, run_id: str):
+        """
+        Builds the level-of-detail pyramid of a finished run, in a thread.
+
+        Args:
+            run_id (str): The id of the run.
+        """
+        await asyncio.to_thread(build_lod, RunReader.open(run_id, self.runs_dir))
+
+    async def query(self, run_id: str, channels: Optional[List[str]], start: Optional[float], end: Optional[float],
+                    points: int) -> dict:
+        """
+        Returns min/max/mean buckets of a time range of a run, see app.storage.lod.query_range().
+
+        The pyramid of a finished run is built first if it is missing, e.g. for runs recorded before pyramids existed.
+
+        Args:
+            run_id (str): The id of the run.
+            channels (Optional[List[str]]): Channel or group names, None selects every channel.
+            start (Optional[float]): The UNIX time the range starts at.
+            end (Optional[float]): The UNIX time the range ends at.
+            points (int): The maximum number of buckets to return.
+
+        Returns:
+            dict: The query result.
+        """
+        def run_query():
+            reader = RunReader.open(run_id, self.runs_dir)
+            columns = reader.select(channels)
+            active = self.recorder is not None and self.recorder.meta.run_id == run_id
+            if not active and reader.meta.ended_at is not None and load_lod(reader.directory) is None:
+                build_lod(reader)
+            return query_range(reader, columns, start, end, points)
+        return await asyncio.to_thread(run_query)
+
+    async def export_csv(self, run_id: str) -> str:
+        """
+        Converts a run to CSV in EXPORT_DIR, in a thread.
+
+        Args:
+            run_id (str): The id of the run.
+
+        Returns:
+            str: The path of the CSV file.
+        """
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        path = os.path.join(EXPORT_DIR, f"{run_id}.csv")
+        await asyncio.to_thread(RunReader.open(run_id, self.runs_dir).export_csv, path)
+        logger.info(f"Data saved to {path}")
+        return path
+
+    async def export_columnar(self, run_id: str) -> str:
+        """
+        Converts a run to a columnar directory in EXPORT_DIR, in a thread.
+
+        Args:
+            run_id (str): The id of the run.
+
+        Returns:
+            str: The path of the columnar directory.
+        """
+        path = os.path.join(EXPORT_DIR, run_id)
+        await asyncio.to_thread(RunReader.open(run_id, self.runs_dir).export_columnar, path)
+        logger.info(f"Data saved to {path}")
+        return path
+
+    def write_metrics(self, writer: PrometheusWriter):
+        """
+        Adds whether logging is active and the flush latency, records and bytes written.
+        """
+        writer.gauge("logging_active", "Whether a run is being recorded.", int(self.logging_active))
+        writer.histogram("logging_flush_seconds", "Time taken by each flush of the run recorder.", self.flush_time)
+        writer.counter("logging_records_total", "Records written to the run store.", self.flushed_records)
+        writer.counter("logging_bytes_total", "Bytes written to the run store.", self.flushed_bytes)
+        writer.counter("logging_failed_runs_total", "Runs whose recording failed.", self.failed_runs)
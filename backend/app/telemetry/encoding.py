@@ -0,0 +1,95 @@
+"""
+This module, encoding.py, contains the BinaryFrameEncoder which packs telemetry samples into fixed-layout binary frames.
+
+The stream starts with a header, sent once, that describes the layout:
+
+    4 bytes   magic b"PST1"
+    uint32    length of the JSON description that follows
+    JSON      {"channels": [...], "sample_format": "<d6f", "state_codes": {...}}
+
+followed by any number of data frames:
+
+    uint16    number of samples in the frame
+    uint32    frame sequence number, increments by one per frame
+    samples   each one float64 UNIX timestamp then one float32 per channel, in header channel order
+
+All integers are little-endian. Non-numeric channels (valve states) are sent as the codes given in the header and
+unknown values as NaN. Since every sample has the same size, a client can read a whole frame from its 6 byte prefix.
+"""
+
+import json
+import math
+import struct
+from typing import Iterable, List, Sequence, Tuple
+
+from app.actuators.pilot_valve import PilotValveState
+from app.actuators.valve import ValveState
+
+MAGIC = b"PST1"
+FRAME_PREFIX = struct.Struct("<HI")
+STATE_CODES = {
+    ValveState.closed: 0.0,
+    ValveState.open: 1.0,
+    ValveState.error: -1.0,
+    PilotValveState.moving: 0.5,
+}
+
+
+def encode_value(value) -> float:
+    """
+    Converts a channel value to the float sent in a binary frame.
+
+    Args:
+        value: A numeric value, a ValveState, a PilotValveState or None.
+
+    Returns:
+        float: The value itself, the state code of a valve state, or NaN for None.
+    """
+    if value is None:
+        return math.nan
+    if isinstance(value, (ValveState, PilotValveState)):
+        return STATE_CODES[value]
+    return float(value)
+
+
+class BinaryFrameEncoder:
+    """
+    Packs batches of samples into binary frames for one fixed list of channels.
+
+    Attributes:
+        channels (List[str]): The channels in every sample, in order.
+        sample (struct.Struct): The layout of one sample.
+        sequence (int): The sequence number of the next frame.
+    """
+
+    def __init__(self, channels: Sequence[str]):
+        self.channels = list(channels)
+        self.sample = struct.Struct("<d" + "f" * len(self.channels))
+        self.sequence = 0
+
+    def header(self) -> bytes:
+        """
+        Returns the stream header describing the channel map and sample layout.
+        """
+        description = json.dumps({
+            "channels": self.channels,
+            "sample_format": self.sample.format,
+            "state_codes": {state.value: code for state, code in STATE_CODES.items()},
+        }).encode()
+        return MAGIC + struct.pack("<I", len(description)) + description
+
+    def encode(self, samples: Iterable[Tuple[float, List[float]]]) -> bytes:
+        """
+        Packs a batch of samples into one frame.
+
+        Args:
+            samples: The timestamp and encoded channel values of each sample.
+
+        Returns:
+            bytes: The frame.
+        """
+        pack = self.sample.pack
+        payload = [pack(timestamp, *values) for timestamp, values in samples]
+        frame = FRAME_PREFIX.pack(len(payload), self.sequence) + b"".join(payload)
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        return frame
@@ -0,0 +1,234 @@
+"""
+This module, frames.py, contains the TelemetryFrameBuilder which turns acquisition snapshots into telemetry frames.
+
+A frame is a flat dict holding the snapshot timestamp under "t" and one entry per channel, where a channel is named
+"<group>.<name>", e.g. "pressure.chamber", "thermocouple.tank_thermocouple", "valve.engine",
+"pilot_valve.pilot_valve", "relay.qd", or "raw.AIN13" for the unconverted value of a scanned register. Valve
+channels report the state decoded from the feedback pins in the same snapshot, so they show what the valve did
+rather than what it was told to do. Sensor channels report the filtered value, and each also has an
+"unfiltered.<group>.<name>" channel holding the calibrated value before filtering, so the run logger records both
+series. Clients select channels by full name or by group, so "pressure" selects every pressure transducer and
+"unfiltered" every unfiltered series.
+
+Full-rate consumers such as the run logger convert a whole SampleBatch with build_block(), which takes the streamed
+channels straight from the batch's arrays and reads every other channel once per batch.
+
+Frames are sent either as JSON or, for high-rate clients, packed into binary frames by the BinaryFrameEncoder.
+Clients that only need a few updates per second can instead stream a decimated tier, see app.telemetry.tiers.
+"""
+
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.actuators.pilot_valve import PilotValveController
+from app.actuators.relay import IgnitorRelayController
+from app.actuators.valve import ValveController
+from app.comms.exceptions import TelemetryError
+from app.sensors.acquisition import AcquisitionScanner, SampleBatch, Snapshot
+from app.sensors.load_cell import LoadCellSensor
+from app.sensors.pressure_transducer import PressureTransducerSensor
+from app.sensors.thermocouple import ThermocoupleSensor
+from app.telemetry.encoding import BinaryFrameEncoder, encode_value
+from app.telemetry.hub import TelemetryHub
+
+logger = logging.getLogger(__name__)
+
+
+class TelemetryFrameBuilder:
+    """
+    Builds telemetry frames holding every sensor, valve and relay channel for one snapshot.
+
+    Attributes:
+        hub (TelemetryHub): The hub the acquisition snapshots are published to.
+        channels (Dict[str, Callable]): The readers for each channel, keyed by channel name.
+        columns (Dict[str, Tuple[str, str, Optional[int]]]): For channels read straight from a snapshot, the Snapshot
+            field, the key in it and the decimals the value is rounded to, used to read them from a SampleBatch.
+    """
+
+    def __init__(self, scanner: AcquisitionScanner, pressure_transducer_sensor: PressureTransducerSensor,
+                 thermocouple_sensor: ThermocoupleSensor, load_cell_sensor: LoadCellSensor,
+                 valve_controller: ValveController, relay_controller: IgnitorRelayController,
+                 pilot_valve_controller: Optional[PilotValveController] = None):
+        self.hub: TelemetryHub = scanner.hub
+        self.channels: Dict[str, Callable[[Snapshot], object]] = {}
+        self.columns: Dict[str, Tuple[str, str, Optional[int]]] = {}
+        for name in pressure_transducer_sensor.pressure_transducers:
+            self.channels[f"pressure.{name}"] = \
+                lambda snapshot, name=name: pressure_transducer_sensor.pressure_from_snapshot(snapshot, name)[0]
+            self.columns[f"pressure.{name}"] = ("filtered", f"pressure.{name}", None)
+        for name in thermocouple_sensor.thermocouples:
+            self.channels[f"thermocouple.{name}"] = \
+                lambda snapshot, name=name: round(thermocouple_sensor.temperature_from_snapshot(snapshot, name), 1)
+            self.columns[f"thermocouple.{name}"] = ("filtered", f"thermocouple.{name}", 1)
+        for name in load_cell_sensor.load_cells:
+            self.channels[f"load_cell.{name}"] = \
+                lambda snapshot, name=name: load_cell_sensor.mass_from_snapshot(snapshot, name)
+            self.columns[f"load_cell.{name}"] = ("filtered", f"load_cell.{name}", None)
+        for channel in scanner.calibration.channels:
+            self.channels[f"unfiltered.{channel}"] = \
+                lambda snapshot, channel=channel: snapshot.converted[channel]
+            self.columns[f"unfiltered.{channel}"] = ("converted", channel, None)
+        for name in valve_controller.valves:
+            self.channels[f"valve.{name}"] = \
+                lambda snapshot, name=name: valve_controller.state_from_snapshot(snapshot, name)
+        if pilot_valve_controller is not None:
+            for name in pilot_valve_controller.motors:
+                self.channels[f"pilot_valve.{name}"] = \
+                    lambda snapshot, name=name: pilot_valve_controller.state_from_snapshot(snapshot, name)
+        for name in relay_controller.relays:
+            self.channels[f"relay.{name}"] = \
+                lambda snapshot, name=name: relay_controller.states[name]
+        for register in scanner.registers:
+            self.channels[f"raw.{register}"] = \
+                lambda snapshot, register=register: snapshot.values[register]
+            self.columns[f"raw.{register}"] = ("values", register, None)
+
+    def select(self, selection: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Resolves a client's channel selection.
+
+        Args:
+            selection (Optional[Iterable[str]]): Channel or group names, None selects every channel.
+
+        Returns:
+            List[str]: The selected channel names.
+
+        Raises:
+            TelemetryError: If a name matches no channel or group.
+        """
+        if not selection:
+            return list(self.channels)
+        selected = []
+        for item in selection:
+            matches = [channel for channel in self.channels
+                       if channel == item or channel.split(".", 1)[0] == item]
+            if not matches:
+                logger.error(f"Telemetry channel {item} not found")
+                raise TelemetryError(f"Telemetry channel {item} not found")
+            selected.extend(channel for channel in matches if channel not in selected)
+        return selected
+
+    def build(self, snapshot: Snapshot, channels: List[str]) -> dict:
+        """
+        Builds one frame from a snapshot.
+
+        Args:
+            snapshot (Snapshot): A snapshot from the shared acquisition scan.
+            channels (List[str]): The channels to include, as returned by select().
+
+        Returns:
+            dict: The frame.
+        """
+        frame = {"t": round(snapshot.timestamp, 4)}
+        for channel in channels:
+            frame[channel] = self.channels[channel](snapshot)
+        return frame
+
+    def build_values(self, snapshot: Snapshot, channels: List[str]) -> List[float]:
+        """
+        Builds the numeric channel values for a binary frame sample.
+
+        Args:
+            snapshot (Snapshot): A snapshot from the shared acquisition scan.
+            channels (List[str]): The channels to include, as returned by select().
+
+        Returns:
+            List[float]: The value of each channel, see encode_value().
+        """
+        return [encode_value(self.channels[channel](snapshot)) for channel in channels]
+
+    def build_block(self, batch: SampleBatch, channels: List[str]) -> np.ndarray:
+        """
+        Builds the numeric channel values of every scan in a batch at once, as build_values() does for one snapshot.
+
+        Streamed channels are taken from the batch's arrays. Every other channel is read once from the polled
+        snapshot and repeated for each scan, as it is in the snapshot of every scan.
+
+        Args:
+            batch (SampleBatch): A batch from the scanner's samples hub.
+            channels (List[str]): The channels to include, as returned by select().
+
+        Returns:
+            np.ndarray: A scans by channels array of values, see encode_value().
+        """
+        if not batch.registers:
+            # A polled scan has no arrays to slice, it is its own snapshot
+            return np.array([self.build_values(batch.polled, channels)])
+        values = np.empty((len(batch), len(channels)))
+        for column, channel in enumerate(channels):
+            source = self.columns.get(channel)
+            streamed = batch.column(source[0], source[1]) if source is not None else None
+            if streamed is None:
+                values[:, column] = encode_value(self.channels[channel](batch.polled))
+            elif source[2] is None:
+                values[:, column] = streamed
+            else:
+                values[:, column] = np.round(streamed, source[2])
+        return values
+
+    async def batches(self, rate: Optional[float], queue_size: Optional[int] = None,
+                      hub: Optional[TelemetryHub] = None):
+        """
+        Yields batches of hub snapshots, at most one per 1 / rate seconds.
+
+        Each batch is the next snapshot plus any already waiting in the queue, so a batch only grows when the
+        consumer is behind and a caught-up consumer gets every snapshot as soon as it is published.
+
+        Args:
+            rate (Optional[float]): The maximum snapshot rate in Hz, None yields every snapshot.
+            queue_size (Optional[int]): The subscription's queue size, defaults to the hub's queue size.
+            hub (Optional[TelemetryHub]): The hub to subscribe to, defaults to the acquisition hub. Anything with a
+                timestamp attribute can be batched, such as the samples of a decimated tier.
+        """
+        interval = 1 / rate if rate else 0
+        last_sent = 0.0
+        with (hub or self.hub).subscribe(queue_size) as subscription:
+            while True:
+                waiting = [await subscription.get()]
+                while not subscription.queue.empty():
+                    waiting.append(subscription.queue.get_nowait())
+                batch = []
+                for snapshot in waiting:
+                    # Skipped snapshots are never converted, so a slow rate costs less than a fast one
+                    if snapshot.timestamp - last_sent < interval:
+                        continue
+                    last_sent = snapshot.timestamp
+                    batch.append(snapshot)
+                if batch:
+                    yield batch
+
+    async def stream(self, channels: List[str], rate: Optional[float] = None):
+        """
+        Creates a stream of frames from the acquisition snapshots.
+
+        Args:
+            channels (List[str]): The channels to include, as returned by select().
+            rate (Optional[float]): The maximum frame rate in Hz, None sends a frame for every snapshot.
+
+        Yields:
+            dict: The next frame.
+        """
+        async for batch in self.batches(rate):
+            for snapshot in batch:
+                yield self.build(snapshot, channels)
+
+    async def stream_binary(self, channels: List[str], rate: Optional[float] = None, batch_size: int = 1):
+        """
+        Creates a binary stream of the acquisition snapshots, see app.telemetry.encoding for the layout.
+
+        Args:
+            channels (List[str]): The channels to include, as returned by select().
+            rate (Optional[float]): The maximum sample rate in Hz, None sends every snapshot.
+            batch_size (int): The maximum number of samples packed into one frame.
+
+        Yields:
+            bytes: The header, then one frame per batch of samples.
+        """
+        encoder = BinaryFrameEncoder(channels)
+        yield encoder.header()
+        async for batch in self.batches(rate, max(batch_size * 2, self.hub.queue_size)):
+            for start in range(0, len(batch), batch_size):
+                yield encoder.encode((snapshot.timestamp, self.build_values(snapshot, channels))
+                                     for snapshot in batch[start:start + batch_size])
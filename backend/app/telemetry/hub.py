@@ -0,0 +1,143 @@
+"""
+This module, hub.py, contains the TelemetryHub which fans one producer's samples out to any number of subscribers.
+
+Every subscriber gets its own bounded queue. When a slow client falls behind, the oldest queued sample is dropped to
+make room for the newest one, so a stalled browser tab never builds up a backlog or slows down the producer.
+"""
+
+import asyncio
+import itertools
+import logging
+from typing import Any, Optional, Set
+
+from app.metrics import PrometheusWriter
+
+SUBSCRIBER_QUEUE_SIZE = 8  # Samples buffered per subscriber before the oldest are dropped
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Represents one subscriber's view of a TelemetryHub.
+
+    Can be used as a context manager, which unsubscribes on exit, and iterated asynchronously to receive samples.
+
+    Attributes:
+        id (int): A number identifying the subscription within its hub.
+        queue (asyncio.Queue): The bounded queue of samples waiting to be consumed.
+        dropped (int): The number of samples discarded because the subscriber fell behind.
+    """
+
+    def __init__(self, hub: "TelemetryHub", maxsize: int, id: int = 0):
+        self.hub = hub
+        self.id = id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item: Any):
+        """
+        Queues a sample, discarding the oldest queued sample if the queue is full.
+
+        Args:
+            item: The sample to queue.
+        """
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.hub.dropped += 1
+        self.queue.put_nowait(item)
+
+    async def get(self) -> Any:
+        """
+        Waits for the next sample.
+        """
+        return await self.queue.get()
+
+    def close(self):
+        """
+        Stops receiving samples from the hub.
+        """
+        self.hub.unsubscribe(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> Any:
+        return await self.get()
+
+
+class TelemetryHub:
+    """
+    Broadcasts samples from a single producer to every subscriber.
+
+    Attributes:
+        queue_size (int): The default queue size for new subscriptions.
+        subscriptions (Set[Subscription]): The active subscriptions.
+        latest: The most recently published sample.
+        published (int): The number of samples published.
+        dropped (int): The number of samples dropped by every subscriber, past and present.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscriptions: Set[Subscription] = set()
+        self.latest: Optional[Any] = None
+        self.published = 0
+        self.dropped = 0
+        self._ids = itertools.count(1)
+
+    def subscribe(self, maxsize: Optional[int] = None) -> Subscription:
+        """
+        Creates a new subscription.
+
+        Args:
+            maxsize (Optional[int]): The queue size for this subscriber, defaults to the hub's queue size.
+
+        Returns:
+            Subscription: The new subscription.
+        """
+        subscription = Subscription(self, maxsize or self.queue_size, next(self._ids))
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """
+        Removes a subscription, if it is still active.
+        """
+        self.subscriptions.discard(subscription)
+
+    def publish(self, item: Any):
+        """
+        Delivers a sample to every subscriber without waiting on any of them.
+
+        Args:
+            item: The sample to publish.
+        """
+        self.latest = item
+        self.published += 1
+        for subscription in self.subscriptions:
+            subscription.put(item)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self.subscriptions)
+
+    def write_metrics(self, writer: PrometheusWriter, name: str):
+        """
+        Adds the hub's counters and the queue depth and drops of every subscriber, labelled with the hub's name.
+        """
+        writer.counter("hub_published_total", "Samples published to the hub.", self.published, hub=name)
+        writer.counter("hub_dropped_total", "Samples dropped by subscribers that fell behind.", self.dropped, hub=name)
+        writer.gauge("hub_subscribers", "Active subscriptions.", self.subscriber_count, hub=name)
+        for subscription in list(self.subscriptions):
+            writer.gauge("subscriber_queue_depth", "Samples waiting in a subscriber's queue.",
+                         subscription.queue.qsize(), hub=name, subscriber=subscription.id)
+            writer.counter("subscriber_dropped_total", "Samples dropped by a subscriber that fell behind.",
+                           subscription.dropped, hub=name, subscriber=subscription.id)
@@ -0,0 +1,246 @@
+"""
+This module, tiers.py, contains the TelemetryTiers which decimate the full-rate acquisition samples into fixed-rate tiers.
+
+Every tier except "full" has its own TelemetryHub, fed by one task that reads the scanner's full-rate samples hub, so
+the work of decimating is shared by every client of a tier rather than repeated per connection. Each tier sample
+summarises one bucket of 1 / rate seconds with the count, minimum, maximum and last value of every channel, so a spike
+shorter than a bucket still shows up in the min and max even though the UI only sees a few updates per second.
+
+Buckets are aligned to multiples of their length in UNIX time, so every 100 Hz bucket lies inside one 20 Hz bucket
+and one 1 Hz bucket. The finest tier is built from the samples and each coarser tier from the buckets of the tier
+below it. A bucket is published when the first sample of the next bucket arrives.
+
+Each sample batch is converted to a scans by channels array and split into the finest tier's buckets with vectorised
+min/max reductions, so a stream block costs a handful of array operations plus one snapshot per bucket, whatever the
+scan rate.
+"""
+
+from dataclasses import dataclass
+import asyncio
+import logging
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.metrics import PrometheusWriter
+from app.sensors.acquisition import SampleBatch, Snapshot
+from app.telemetry.encoding import BinaryFrameEncoder
+from app.telemetry.frames import TelemetryFrameBuilder
+from app.telemetry.hub import Subscription, TelemetryHub
+
+TIERS = {"full": None, "100hz": 100.0, "20hz": 20.0, "1hz": 1.0}  # Tier name to bucket rate, None is undecimated
+TIER_QUEUE_SIZE = 256  # Sample batches buffered for the decimator before the oldest are dropped
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TierSample:
+    """
+    Represents one bucket of a decimated tier.
+
+    Attributes:
+        timestamp (float): The UNIX time of the last sample in the bucket.
+        snapshot (Snapshot): The last snapshot in the bucket, which the frame's values are read from.
+        count (int): The number of samples in the bucket.
+        minimum (List[float]): The minimum of each numeric channel, in TelemetryTiers.channels order, NaN if unknown.
+        maximum (List[float]): The maximum of each numeric channel, in TelemetryTiers.channels order, NaN if unknown.
+    """
+    timestamp: float
+    snapshot: Snapshot
+    count: int
+    minimum: List[float]
+    maximum: List[float]
+
+
+def _merge_extremes(bucket: TierSample, minimum: List[float], maximum: List[float]):
+    """
+    Widens a bucket's minimum and maximum to include another sample or bucket, ignoring NaN.
+    """
+    for index, (low, high) in enumerate(zip(minimum, maximum)):
+        current = bucket.minimum[index]
+        if low < current or current != current:
+            bucket.minimum[index] = low
+        current = bucket.maximum[index]
+        if high > current or current != current:
+            bucket.maximum[index] = high
+
+
+class TelemetryTiers:
+    """
+    Decimates the scanner's full-rate samples into one hub per tier.
+
+    Attributes:
+        frames (TelemetryFrameBuilder): The frame builder whose channels are summarised.
+        channels (List[str]): Every channel, in the order of TierSample.minimum and TierSample.maximum.
+        hubs (Dict[str, TelemetryHub]): The hub of each decimated tier, keyed by tier name.
+        rates (Dict[str, float]): The bucket rate of each decimated tier, finest first.
+        dropped (int): The number of sample batches the decimator fell too far behind to process.
+    """
+
+    def __init__(self, frames: TelemetryFrameBuilder, tiers: Dict[str, Optional[float]] = TIERS):
+        self.frames = frames
+        self.channels: List[str] = frames.select()
+        self.rates = dict(sorted(((name, rate) for name, rate in tiers.items() if rate), key=lambda item: -item[1]))
+        self.hubs: Dict[str, TelemetryHub] = {name: TelemetryHub() for name in self.rates}
+        self.dropped = 0
+        self._buckets: Dict[str, Optional[TierSample]] = {name: None for name in self.rates}
+        self._keys: Dict[str, int] = {name: 0 for name in self.rates}
+        self._columns = {channel: index for index, channel in enumerate(self.channels)}
+
+    def build(self, sample: TierSample, channels: List[str]) -> dict:
+        """
+        Builds one frame from a tier sample.
+
+        The frame holds the last value of every selected channel, like a full-rate frame, plus the number of samples
+        in the bucket under "n" and the minimum and maximum of each numeric channel under "min" and "max".
+
+        Args:
+            sample (TierSample): A bucket of a decimated tier.
+            channels (List[str]): The channels to include, as returned by TelemetryFrameBuilder.select().
+
+        Returns:
+            dict: The frame.
+        """
+        frame = self.frames.build(sample.snapshot, channels)
+        frame["t"] = round(sample.timestamp, 4)
+        frame["n"] = sample.count
+        frame["min"], frame["max"] = {}, {}
+        for channel in channels:
+            column = self._columns[channel]
+            low, high = sample.minimum[column], sample.maximum[column]
+            if low == low:
+                frame["min"][channel], frame["max"][channel] = low, high
+        return frame
+
+    async def stream(self, channels: List[str], tier: str, rate: Optional[float] = None):
+        """
+        Creates a stream of frames from a decimated tier.
+
+        Args:
+            channels (List[str]): The channels to include, as returned by TelemetryFrameBuilder.select().
+            tier (str): The tier name, a key of hubs.
+            rate (Optional[float]): The maximum frame rate in Hz, None sends a frame for every bucket.
+
+        Yields:
+            dict: The next frame.
+        """
+        async for batch in self.frames.batches(rate, hub=self.hubs[tier]):
+            for sample in batch:
+                yield self.build(sample, channels)
+
+    async def stream_binary(self, channels: List[str], tier: str, rate: Optional[float] = None, batch_size: int = 1):
+        """
+        Creates a binary stream of a decimated tier, see app.telemetry.encoding for the layout.
+
+        The header lists the selected channels, holding each bucket's last value, followed by "min.<channel>" and then
+        "max.<channel>" for every selected channel.
+
+        Args:
+            channels (List[str]): The channels to include, as returned by TelemetryFrameBuilder.select().
+            tier (str): The tier name, a key of hubs.
+            rate (Optional[float]): The maximum sample rate in Hz, None sends every bucket.
+            batch_size (int): The maximum number of samples packed into one frame.
+
+        Yields:
+            bytes: The header, then one frame per batch of samples.
+        """
+        columns = [self._columns[channel] for channel in channels]
+        encoder = BinaryFrameEncoder(channels + [f"min.{channel}" for channel in channels]
+                                     + [f"max.{channel}" for channel in channels])
+        yield encoder.header()
+        hub = self.hubs[tier]
+        async for batch in self.frames.batches(rate, max(batch_size * 2, hub.queue_size), hub):
+            for start in range(0, len(batch), batch_size):
+                yield encoder.encode((sample.timestamp, self.frames.build_values(sample.snapshot, channels)
+                                      + [sample.minimum[column] for column in columns]
+                                      + [sample.maximum[column] for column in columns])
+                                     for sample in batch[start:start + batch_size])
+
+    def add(self, batch: SampleBatch):
+        """
+        Adds a batch of full-rate samples to the finest tier, publishing every bucket it completes.
+
+        The batch is split where the finest tier's bucket changes, and each run of samples is reduced to its count,
+        minimum, maximum and last snapshot before being merged like a single sample.
+        """
+        if not self.rates:
+            return
+        if len(batch) == 1:
+            # A polled scan is a bucket of its own, cheaper to merge directly than through the array path
+            snapshot = batch.snapshot(0)
+            values = self.frames.build_values(snapshot, self.channels)
+            self._add(0, TierSample(snapshot.timestamp, snapshot, 1, values, list(values)))
+            return
+        values = self.frames.build_block(batch, self.channels)
+        timestamps = batch.timestamps
+        keys = np.floor(timestamps * next(iter(self.rates.values())))
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        ends = np.append(starts[1:], len(keys))
+        # fmin and fmax ignore NaN unless every value is NaN, like _merge_extremes
+        minimum = np.fmin.reduceat(values, starts, axis=0).tolist()
+        maximum = np.fmax.reduceat(values, starts, axis=0).tolist()
+        for index, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+            self._add(0, TierSample(float(timestamps[end - 1]), batch.snapshot(end - 1), end - start,
+                                    minimum[index], maximum[index]))
+
+    def _add(self, level: int, sample: TierSample):
+        """
+        Adds a sample, or a completed bucket of the tier below, to the tier at a level.
+        """
+        names = list(self.rates)
+        if level >= len(names):
+            return
+        name = names[level]
+        key = math.floor(sample.timestamp * self.rates[name])
+        bucket = self._buckets[name]
+        if bucket is not None and key == self._keys[name]:
+            bucket.timestamp, bucket.snapshot = sample.timestamp, sample.snapshot
+            bucket.count += sample.count
+            _merge_extremes(bucket, sample.minimum, sample.maximum)
+            return
+        if bucket is not None:
+            self.hubs[name].publish(bucket)
+            self._add(level + 1, bucket)
+        self._keys[name] = key
+        self._buckets[name] = TierSample(sample.timestamp, sample.snapshot, sample.count, list(sample.minimum),
+                                         list(sample.maximum))
+
+    def _reset(self):
+        """
+        Drops the open buckets, so the next bucket of every tier starts fresh.
+        """
+        for name in self._buckets:
+            self._buckets[name] = None
+
+    async def run(self, samples: TelemetryHub):
+        """
+        Decimates every batch published to a full-rate samples hub until cancelled.
+
+        No work is done while no client is subscribed to any tier.
+
+        Args:
+            samples (TelemetryHub): The hub every full-rate SampleBatch is published to.
+        """
+        subscription: Subscription
+        with samples.subscribe(TIER_QUEUE_SIZE) as subscription:
+            async for batch in subscription:
+                if not any(hub.subscriber_count for hub in self.hubs.values()):
+                    self._reset()
+                    continue
+                self.add(batch)
+                if subscription.dropped > self.dropped:
+                    logger.warning(f"Telemetry tiers dropped {subscription.dropped - self.dropped} sample batches")
+                    self.dropped = subscription.dropped
+                # Decimating a large stream block is CPU bound, let the clients of the tiers run in between
+                await asyncio.sleep(0)
+
+    def write_metrics(self, writer: PrometheusWriter):
+        """
+        Adds the batches the decimator dropped and the hub of every tier, named "tier_<name>".
+        """
+        writer.counter("tiers_dropped_total", "Sample batches the decimator fell too far behind to process.",
+                       self.dropped)
+        for name, hub in self.hubs.items():
+            hub.write_metrics(writer, f"tier_{name}")